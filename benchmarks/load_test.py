@@ -0,0 +1,391 @@
+"""
+Local multi-client load test of the viewer.
+
+Run as `python benchmarks/load_test.py [--clients 1,10,50] [--size 10000] [--duration 30]`. For every client count
+the app is started in production mode against a synthetic library (generated once, as for `run_benchmarks.py`),
+and that many simulated browsers open `/`, connect over the NiceGUI socket.io protocol, and then pick spectra, drag
+the opacity and width sliders and step through the spectrum rotation.
+
+Reported are the p50/p99 latency from an event to the figure update it causes, the sizes of those updates, the
+page load time, the CPU time of the server per action and its memory per connected client. Results are written as
+JSON to `benchmarks/results/loadtest-<commit>.json`.
+"""
+
+import argparse
+import ast
+import asyncio
+import datetime
+import html
+import json
+import os
+import platform
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+
+import httpx
+import socketio
+
+import run_benchmarks
+
+APP = run_benchmarks.BENCHMARK_DIR.parent / "pxrd_viewer" / "app.py"
+
+SOCKET_PATH = "_nicegui_ws/socket.io"
+# Longest wait for the figure update of an action; slower actions are counted as timeouts
+UPDATE_TIMEOUT = 10.0
+# Pause between the actions of a client, roughly a fast user
+THINK_TIME = 0.3
+# Values sent per slider drag; the browser sends one per step while the handle moves
+DRAG_STEPS = 5
+
+ACTIONS = ("select", "slider", "rotation")
+
+
+def parse_page(page: str) -> tuple[dict, dict]:
+    """
+    Returns the elements and the socket query that a NiceGUI page embeds for its first render. The query is
+    written as a Python dict literal.
+    """
+    elements = re.search(r"parseElements\(String\.raw`(.*?)`\)", page, re.S)
+    query = re.search(r"query: (\{.*?\}),\n", page)
+    if elements is None or query is None:
+        raise ValueError("Not a NiceGUI page")
+    raw = elements.group(1).replace("&#36;", "$").replace("&#96;", "`")
+    return json.loads(html.unescape(raw)), ast.literal_eval(query.group(1))
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """
+    Returns the `q`-th percentile (0-100) of `values` by linear interpolation, or None if there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class SimulatedClient:
+    """
+    A browser tab of the viewer, driven over its socket.io connection like the NiceGUI frontend does.
+    """
+
+    def __init__(self, base_url: str, rng: random.Random):
+        self.base_url = base_url
+        self.rng = rng
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("*", self._on_message)
+        self.elements = {}
+        self.client_id = None
+        self.plot_id = None
+        self._waiter = None
+        self.page_load_s = None
+        self.page_bytes = None
+        self.latencies = {action: [] for action in ACTIONS}
+        self.payloads = {action: [] for action in ACTIONS}
+        self.timeouts = {action: 0 for action in ACTIONS}
+
+    async def connect(self, http: httpx.AsyncClient) -> None:
+        start = time.perf_counter()
+        response = await http.get(self.base_url + "/")
+        response.raise_for_status()
+        self.page_load_s = time.perf_counter() - start
+        self.page_bytes = len(response.content)
+        self.elements, query = parse_page(response.text)
+        self.client_id = query["client_id"]
+        self.plot_id = self.find("nicegui-plotly")
+        query.update(document_id=str(uuid.uuid4()), tab_id=str(uuid.uuid4()), old_tab_id="")
+        query = {key: str(value).lower() if isinstance(value, bool) else value for key, value in query.items()}
+        await self.sio.connect(
+            f"{self.base_url}?{urllib.parse.urlencode(query)}",
+            socketio_path=SOCKET_PATH,
+            transports=["websocket"],
+            wait_timeout=UPDATE_TIMEOUT,
+        )
+
+    async def disconnect(self) -> None:
+        await self.sio.disconnect()
+
+    async def _on_message(self, message_type: str, data) -> None:
+        if not isinstance(data, dict) or "_id" not in data:
+            return
+        # Lets the server drop the message from the history it keeps for reconnects, as the browser does
+        await self.sio.emit("ack", {"client_id": self.client_id, "next_message_id": data["_id"] + 1})
+        if message_type != "update":
+            return
+        for element_id, element in data.items():
+            if element_id == "_id":
+                continue
+            if element is None:
+                self.elements.pop(element_id, None)
+            else:
+                self.elements[element_id] = element
+        if self.plot_id in data and self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(len(json.dumps(data, separators=(",", ":"))))
+
+    def find(self, tag: str, label: str = None) -> str:
+        """
+        Returns the id of the first visible element with `tag` and the label `label`.
+        """
+        parents = {str(child): element_id for element_id, e in self.elements.items() for child in e.get("children", [])}
+
+        def visible(element_id):
+            while element_id is not None:
+                if "hidden" in self.elements.get(element_id, {}).get("class", []):
+                    return False
+                element_id = parents.get(element_id)
+            return True
+
+        for element_id, element in self.elements.items():
+            props = element.get("props", {})
+            if element.get("tag") != tag or (label is not None and props.get("label") != label):
+                continue
+            if visible(element_id):
+                return element_id
+        raise LookupError(f"No visible {tag} '{label}' on the page")
+
+    async def emit(self, element_id: str, event_type: str, value=None) -> None:
+        element = self.elements[element_id]
+        listener_id = next(e["listener_id"] for e in element["events"] if e["type"] == event_type)
+        args = [] if value is None else [json.dumps(value)]
+        await self.sio.emit(
+            "event", {"id": int(element_id), "client_id": self.client_id, "listener_id": listener_id, "args": args}
+        )
+
+    async def timed(self, action: str, element_id: str, event_type: str, value=None) -> None:
+        """
+        Sends an event and records the time until the figure update it causes arrives.
+        """
+        self._waiter = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.emit(element_id, event_type, value)
+        try:
+            size = await asyncio.wait_for(self._waiter, UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts[action] += 1
+            return
+        finally:
+            self._waiter = None
+        self.latencies[action].append(time.perf_counter() - start)
+        self.payloads[action].append(size)
+
+    async def select_spectrum(self) -> None:
+        select_id = self.find("nicegui-select", "Select a spectrum to view")
+        props = self.elements[select_id]["props"]
+        current = (props.get("model-value") or {}).get("value")
+        choices = [option for option in props["options"] if option["value"] != current]
+        if choices:
+            option = self.rng.choice(choices)
+            await self.timed(
+                "select", select_id, "update:modelValue", {"value": option["value"], "label": option["label"]}
+            )
+
+    async def drag_slider(self) -> None:
+        slider_id = self.rng.choice([i for i, e in self.elements.items() if e.get("tag") == "q-slider"])
+        props = self.elements[slider_id]["props"]
+        low, high = props["min"], props["max"]
+        start = props.get("model-value", low)
+        target = self.rng.uniform(low, high)
+        for step in range(1, DRAG_STEPS + 1):
+            value = round(start + (target - start) * step / DRAG_STEPS, 2)
+            # The server only redraws when the value changes
+            if value != props.get("model-value"):
+                props["model-value"] = value
+                await self.timed("slider", slider_id, "update:modelValue", value)
+
+    async def step_rotation(self) -> None:
+        try:
+            await self.timed("rotation", self.find("q-btn", "Next"), "click")
+        except LookupError:
+            await self.timed("rotation", self.find("q-btn", "Activate Spectrum Rotation"), "click")
+
+    async def run(self, until: float) -> None:
+        actions = {"select": self.select_spectrum, "slider": self.drag_slider, "rotation": self.step_rotation}
+        while time.monotonic() < until:
+            await actions[self.rng.choice(ACTIONS)]()
+            await asyncio.sleep(THINK_TIME * self.rng.uniform(0.5, 1.5))
+
+
+class Server:
+    """
+    The app in a subprocess, with CPU time and memory read from /proc (Linux only, None elsewhere).
+    """
+
+    def __init__(self, library: Path):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log = tempfile.TemporaryFile()
+        env = dict(os.environ, PXRD_PRODUCTION="1", PXRD_DATA_DIR=str(library), PXRD_PORT=str(self.port))
+        self.process = subprocess.Popen(
+            [sys.executable, APP.name], cwd=APP.parent, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    async def wait_until_ready(self, timeout: float = 120.0) -> None:
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as http:
+            while True:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.log.seek(0)
+                    raise RuntimeError("The app did not start:\n" + self.log.read().decode(errors="replace")[-4000:])
+                try:
+                    if (await http.get(self.url + "/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.5)
+        # Let the warm-up (catalog index, background jobs) finish, so it is not measured
+        previous = self.cpu_seconds()
+        while previous is not None and time.monotonic() < deadline:
+            await asyncio.sleep(1.0)
+            current = self.cpu_seconds()
+            if current - previous < 0.05:
+                break
+            previous = current
+
+    def cpu_seconds(self) -> float | None:
+        try:
+            fields = Path(f"/proc/{self.process.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime, the 14th and 15th field of the line
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self) -> int | None:
+        try:
+            status = Path(f"/proc/{self.process.pid}/status").read_text()
+        except OSError:
+            return None
+        match = re.search(r"^VmRSS:\s+(\d+) kB", status, re.M)
+        return int(match.group(1)) * 1024 if match else None
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+async def run_round(library: Path, clients: int, duration: float, seed: int) -> dict:
+    """
+    Starts the app, connects `clients` simulated browsers and lets them act for `duration` seconds.
+    """
+    server = Server(library)
+    try:
+        await server.wait_until_ready()
+        rss_before = server.rss_bytes()
+        rng = random.Random(seed)
+        simulated = [SimulatedClient(server.url, random.Random(rng.random())) for _ in range(clients)]
+        async with httpx.AsyncClient(timeout=60) as http:
+            await asyncio.gather(*(client.connect(http) for client in simulated))
+        await asyncio.sleep(1.0)
+        rss_connected = server.rss_bytes()
+        cpu_before = server.cpu_seconds()
+        start = time.monotonic()
+        try:
+            await asyncio.gather(*(client.run(start + duration) for client in simulated))
+            elapsed = time.monotonic() - start
+            cpu_after = server.cpu_seconds()
+        finally:
+            await asyncio.gather(*(client.disconnect() for client in simulated))
+    finally:
+        server.stop()
+
+    entry = {"clients": clients, "duration_s": elapsed, "actions": {}}
+    page_loads = [client.page_load_s for client in simulated]
+    entry["page_load_p50_s"] = percentile(page_loads, 50)
+    entry["page_load_p99_s"] = percentile(page_loads, 99)
+    entry["page_bytes"] = statistics.median(client.page_bytes for client in simulated)
+    total_actions = 0
+    for action in ACTIONS:
+        latencies = [latency for client in simulated for latency in client.latencies[action]]
+        payloads = [size for client in simulated for size in client.payloads[action]]
+        total_actions += len(latencies)
+        entry["actions"][action] = {
+            "count": len(latencies),
+            "p50_s": percentile(latencies, 50),
+            "p99_s": percentile(latencies, 99),
+            "payload_median_bytes": statistics.median(payloads) if payloads else None,
+            "payload_max_bytes": max(payloads, default=None),
+            "timeouts": sum(client.timeouts[action] for client in simulated),
+        }
+    if cpu_before is not None and cpu_after is not None:
+        entry["server_cpu_utilization"] = (cpu_after - cpu_before) / elapsed
+        entry["server_cpu_per_action_s"] = (cpu_after - cpu_before) / max(total_actions, 1)
+    if rss_before is not None and rss_connected is not None:
+        entry["server_rss_bytes"] = rss_connected
+        entry["server_rss_per_client_bytes"] = (rss_connected - rss_before) / clients
+    print_round(entry)
+    return entry
+
+
+def print_round(entry: dict) -> None:
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+    print(
+        f"{entry['clients']} clients: page load p50 {ms(entry['page_load_p50_s'])} ms,"
+        f" p99 {ms(entry['page_load_p99_s'])} ms"
+    )
+    for action, stats in entry["actions"].items():
+        payload = stats["payload_median_bytes"]
+        print(
+            f"  {action:<10} {stats['count']:>6} updates"
+            f"  p50 {ms(stats['p50_s']):>8} ms  p99 {ms(stats['p99_s']):>8} ms"
+            f"  {'-' if payload is None else f'{payload / 1024:.0f}':>6} kB  {stats['timeouts']} timeouts"
+        )
+    if "server_cpu_utilization" in entry:
+        print(
+            f"  server: {entry['server_cpu_utilization']:.0%} of a core,"
+            f" {ms(entry['server_cpu_per_action_s'])} ms CPU per update"
+        )
+    if "server_rss_per_client_bytes" in entry:
+        print(
+            f"  server: {entry['server_rss_bytes'] / 2**20:.0f} MB resident,"
+            f" {entry['server_rss_per_client_bytes'] / 2**20:.2f} MB per client"
+        )
+
+
+def run(client_counts: list[int], size: int, points: int, duration: float, seed: int, output: Path = None) -> Path:
+    commit = run_benchmarks.git_commit()
+    library = run_benchmarks.library_dir(size, points)
+    rounds = [asyncio.run(run_round(library, clients, duration, seed)) for clients in client_counts]
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "size": size,
+        "points": points,
+        "rounds": rounds,
+    }
+    output = output or run_benchmarks.RESULTS_DIR / f"loadtest-{commit[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", default="1,10,50", help="Comma separated numbers of simultaneous clients")
+    parser.add_argument("--size", type=int, default=10000, help="Spectra in the synthetic library")
+    parser.add_argument("--points", type=int, default=4000, help="Points per spectrum")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds the clients act per round")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/loadtest-<commit>.json)")
+    args = parser.parse_args()
+    run([int(n) for n in args.clients.split(",")], args.size, args.points, args.duration, args.seed, args.output)
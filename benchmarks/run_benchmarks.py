@@ -0,0 +1,268 @@
+"""
+Offline benchmark suite for the data layer and the figure construction of the viewer.
+
+Run as `python benchmarks/run_benchmarks.py [--sizes 100,10000,100000] [--points 4000]`. Results are written as
+JSON to `benchmarks/results/<commit>.json`; compare two runs with
+`python benchmarks/run_benchmarks.py --compare old.json new.json`.
+
+Synthetic libraries are generated once per size and point density and kept in `benchmarks/.cache/`.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+import synthetic
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "pxrd_viewer"))
+
+import data_sources  # noqa: E402
+
+BENCHMARK_DIR = Path(__file__).parent
+CACHE_DIR = BENCHMARK_DIR / ".cache"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+
+def measure(func, repeat: int, setup=None) -> list[float]:
+    """
+    Runs `func` `repeat` times and returns the wall-clock durations. `setup` runs untimed before every call.
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def result(name: str, durations: list[float], size: int = None, **extra) -> dict:
+    entry = {
+        "benchmark": name,
+        "size": size,
+        "median_s": statistics.median(durations),
+        "min_s": min(durations),
+        "repeat": len(durations),
+    }
+    entry.update(extra)
+    print(f"{name:<40} {'' if size is None else size:>8} {entry['median_s'] * 1000:>12.3f} ms")
+    return entry
+
+
+def library_dir(size: int, points: int) -> Path:
+    """
+    Returns a synthetic library with `size` spectra, generating it on first use.
+    """
+    path = CACHE_DIR / f"library-{size}-{points}"
+    if sum(1 for _ in path.glob("*.meta")) != size:
+        print(f"Generating a library of {size} spectra in {path} ...")
+        # Left over from an interrupted generation, including the .thumbnails directory
+        shutil.rmtree(path, ignore_errors=True)
+        synthetic.populate_library(path, size, points)
+    return path
+
+
+def bench_parsers(points: int, repeat: int) -> list[dict]:
+    rng = np.random.default_rng(0)
+    two_theta = np.linspace(5.0, 90.0, points)
+    counts = synthetic.synthetic_pattern(two_theta, rng)
+    results = []
+    for machine in ("POLY II", "Powdat"):
+        raw = synthetic.raw_file_bytes(counts, 5.0, 90.0, machine=machine)
+        durations = measure(lambda: data_sources.read_raw_file(io.BytesIO(raw)), repeat)
+        results.append(result(f"read_raw_file[{machine}]", durations, points=points, bytes=len(raw)))
+        durations = measure(lambda: data_sources.load_raw_file(io.BytesIO(raw)), repeat)
+        results.append(result(f"load_raw_file[{machine}]", durations, points=points, bytes=len(raw)))
+    xyd = synthetic.xyd_file_bytes(two_theta, counts)
+    durations = measure(lambda: data_sources.load_xyd_file(io.BytesIO(xyd)), repeat)
+    results.append(result("load_xyd_file", durations, points=points, bytes=len(xyd)))
+    return results
+
+
+def bench_counts_codec(points: int, repeat: int) -> list[dict]:
+    """
+    Compares the stored counts of `counts_codec` with the compressed float32 arrays in size and read time.
+    """
+    import counts_codec
+
+    rng = np.random.default_rng(0)
+    two_theta = np.linspace(5.0, 90.0, points)
+    results = []
+    for machine, max_counts in (("POLY II", 20000.0), ("Powdat", 200000.0)):
+        counts = synthetic.synthetic_pattern(two_theta, rng, max_counts=max_counts)
+        raw = synthetic.raw_file_bytes(counts, 5.0, 90.0, machine=machine)
+        info = data_sources.read_raw_file(io.BytesIO(raw))
+        raw_counts = counts_codec.RawCounts(
+            np.array(info["data"], dtype=info["data_type"]), info["theta_start"], info["theta_end"], info["radiation"]
+        )
+        x, y = raw_counts.to_xy()
+        arrays, stored = io.BytesIO(), io.BytesIO()
+        np.savez_compressed(arrays, x=x, y=y)
+        raw_counts.save(stored)
+        for name, data in (("npz", arrays.getvalue()), ("counts", stored.getvalue())):
+            durations = measure(lambda: data_sources.read_npz(io.BytesIO(data)), repeat)
+            results.append(result(f"read_npz[{name}, {machine}]", durations, points=points, bytes=len(data)))
+        durations = measure(lambda: raw_counts.save(io.BytesIO()), repeat)
+        results.append(result(f"RawCounts.save[{machine}]", durations, points=points))
+    return results
+
+
+def bench_library(size: int, points: int, repeat: int) -> list[dict]:
+    data_sources.DATA_DIR = library_dir(size, points)
+    results = []
+    # Scans are expensive on large libraries, so they are repeated less often
+    scan_repeat = max(1, min(repeat, 1_000_000 // (size * 10)))
+
+    def invalidate():
+        data_sources._catalog_cache["generation"] = None
+
+    durations = measure(data_sources.list_available_spectra, scan_repeat, setup=invalidate)
+    results.append(result("list_available_spectra[cold]", durations, size))
+    durations = measure(data_sources.list_available_spectra, repeat)
+    results.append(result("list_available_spectra[warm]", durations, size))
+
+    spectra = data_sources.list_available_spectra()
+    sample = random.Random(0).sample(spectra, min(50, len(spectra)))
+
+    def load_arrays():
+        for spectrum in sample:
+            fresh = data_sources.Spectrum(spectrum.name, spectrum.source_file)
+            fresh.x, fresh.y
+
+    durations = measure(load_arrays, repeat)
+    results.append(result("Spectrum.load_arrays[per spectrum]", [d / len(sample) for d in durations], size))
+
+    import search_index
+
+    durations = measure(lambda: search_index.CatalogIndex(spectra), scan_repeat)
+    results.append(result("CatalogIndex.build", durations, size))
+    index = search_index.CatalogIndex(spectra)
+    durations = measure(lambda: index.search("synthetic_00012"), repeat)
+    results.append(result("CatalogIndex.search", durations, size))
+
+    import fulltext
+
+    durations = measure(lambda: fulltext.TextIndex(spectra), scan_repeat)
+    results.append(result("TextIndex.build", durations, size))
+    text_index = fulltext.TextIndex(spectra)
+    # Every synthetic description is the same sentence: the worst case, where a word matches the whole library
+    durations = measure(lambda: text_index.search("synthetic spec", limit=50), repeat)
+    results.append(result("TextIndex.search", durations, size))
+
+    rng = np.random.default_rng(1)
+    x = np.linspace(0.5, 6.0, points)
+    saved = []
+
+    def save():
+        name = f"benchmark_save_{len(saved)}"
+        saved.append(data_sources.save_new_spectrum(name, (x, rng.random(points)), {"Cu"}, ["benchmark"]))
+
+    durations = measure(save, repeat)
+    for spectrum in saved:
+        data_sources.delete_spectrum(spectrum)
+    results.append(result("save_new_spectrum", durations, size, points=points))
+    return results
+
+
+def bench_figure(points: int, repeat: int) -> list[dict]:
+    import plotly.graph_objects as go
+    from nicegui import json as nicegui_json
+
+    from app import Line, line_trace
+
+    data_sources.DATA_DIR = library_dir(100, points)
+    spectra = data_sources.list_available_spectra()
+    results = []
+    for num_lines in (1, 10):
+        lines = [Line.from_spectrum(s) for s in spectra[:num_lines]]
+        payload = {}
+
+        def build():
+            fig = go.Figure()
+            for line in lines:
+                fig.add_trace(line_trace(line))
+            payload["json"] = nicegui_json.dumps(fig.to_plotly_json())
+
+        durations = measure(build, repeat)
+        results.append(
+            result(
+                f"update_figure.payload[{num_lines} lines]",
+                durations,
+                points=points,
+                payload_bytes=len(payload["json"]),
+            )
+        )
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes: list[int], points: int, repeat: int, output: Path = None) -> Path:
+    commit = git_commit()
+    results = bench_parsers(points, repeat)
+    results += bench_counts_codec(points, repeat)
+    for size in sizes:
+        results += bench_library(size, points, repeat)
+    results += bench_figure(points, repeat)
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "points": points,
+        "results": results,
+    }
+    output = output or RESULTS_DIR / f"{commit[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+    return output
+
+
+def compare(old_file: Path, new_file: Path, threshold: float = 1.1) -> None:
+    """
+    Prints the median ratio new/old of every benchmark both runs have in common and flags regressions.
+    """
+    old = json.loads(old_file.read_text())
+    new = json.loads(new_file.read_text())
+    old_results = {(r["benchmark"], r["size"]): r for r in old["results"]}
+    print(f"{old['commit'][:12]} -> {new['commit'][:12]}")
+    for entry in new["results"]:
+        key = (entry["benchmark"], entry["size"])
+        if key not in old_results:
+            continue
+        ratio = entry["median_s"] / old_results[key]["median_s"]
+        flag = "  REGRESSION" if ratio > threshold else ("  faster" if ratio < 1 / threshold else "")
+        print(f"{entry['benchmark']:<40} {'' if entry['size'] is None else entry['size']:>8} {ratio:>8.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,10000,100000", help="Comma separated library sizes")
+    parser.add_argument("--points", type=int, default=4000, help="Points per spectrum")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="Compare two result files")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run([int(size) for size in args.sizes.split(",")], args.points, args.repeat, args.output)
@@ -0,0 +1,154 @@
+"""
+Generates synthetic but realistic PXRD files for benchmarks and load tests.
+
+The .raw files follow the layout documented in the README and read by `data_sources.read_raw_file`:
+POLY II files store int16 counts after a DataInfo block at 0x600, Powdat files int32 counts after 0x800.
+
+Run as `python benchmarks/synthetic.py <target dir> --count 100 --points 4000` to write source files, or use
+`populate_library` to fill a DATA_DIR directly.
+"""
+
+import argparse
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "pxrd_viewer"))
+
+CU_K_ALPHA = 1.5406  # Å
+
+
+def synthetic_pattern(
+    two_theta: np.ndarray, rng: np.random.Generator, max_counts: float = 20000.0, num_peaks: int = None
+) -> np.ndarray:
+    """
+    Simulates counts of a powder pattern: a decaying background, pseudo-Voigt peaks with widths growing with
+    the angle, and Poisson counting noise.
+    """
+    num_peaks = num_peaks if num_peaks is not None else int(rng.integers(8, 40))
+    background = 200.0 * np.exp(-two_theta / 40.0) + 30.0
+    centers = rng.uniform(two_theta[0], two_theta[-1], num_peaks)
+    heights = rng.pareto(1.5, num_peaks) + 0.05
+    heights *= (max_counts - background.max()) / heights.max()
+    fwhm = 0.05 + 0.002 * centers
+    eta = rng.uniform(0.2, 0.8, num_peaks)
+    dx = two_theta[:, None] - centers[None, :]
+    gauss = np.exp(-4 * np.log(2) * dx**2 / fwhm**2)
+    lorentz = 1.0 / (1.0 + 4 * dx**2 / fwhm**2)
+    peaks = (heights * (eta * lorentz + (1 - eta) * gauss)).sum(axis=1)
+    return rng.poisson(background + peaks).astype(np.int64)
+
+
+def raw_file_bytes(
+    counts: np.ndarray,
+    theta_start: float,
+    theta_end: float,
+    machine: str = "POLY II",
+    wavelength: float = CU_K_ALPHA,
+    title: str = "synthetic",
+) -> bytes:
+    """
+    Encodes counts as a POLY II or Powdat .raw file.
+    """
+    if machine not in ("POLY II", "Powdat"):
+        raise ValueError(f"Unsupported machine type {machine}.")
+    num_points = len(counts)
+    if num_points > 0xFFFF:
+        raise ValueError("The .raw format stores the number of points as u16.")
+    info_offset = 0x600 if machine == "POLY II" else 0x800
+    data_offset = info_offset + 0x200
+    dtype = "<i2" if machine == "POLY II" else "<i4"
+    counts = np.clip(counts, 0, np.iinfo(dtype).max).astype(dtype)
+
+    header = bytearray(data_offset)
+    struct.pack_into("8s", header, 0x00, b"RAW1.01")
+    struct.pack_into("8s", header, 0x08, machine.encode("ascii"))
+    struct.pack_into("16s", header, 0x10, b"01-Jan-2024")
+    struct.pack_into("32s", header, 0x20, title.encode("ascii")[:32])
+    struct.pack_into("32s", header, 0x70, b"generated for benchmarks")
+    struct.pack_into("<HHff", header, 0x13E, 40, 30, wavelength, wavelength)
+    struct.pack_into("16s16s", header, info_offset, b"01-Jan-2024", b"01-Jan-2024")
+    struct.pack_into("<H", header, info_offset + 0x22, num_points)
+    struct.pack_into("<f", header, info_offset + 0x2C, theta_start)
+    struct.pack_into("<f", header, info_offset + 0x34, theta_end)
+    struct.pack_into("<f", header, info_offset + 0x3C, (theta_end - theta_start) / max(num_points - 1, 1))
+    struct.pack_into("<f", header, info_offset + 0x44, 1.0)
+    struct.pack_into("<II", header, info_offset + 0x78, int(counts.min()), int(counts.max()))
+    return bytes(header) + counts.tobytes()
+
+
+def xyd_file_bytes(two_theta: np.ndarray, counts: np.ndarray) -> bytes:
+    """
+    Encodes a pattern as a two-column .xyd text file.
+    """
+    return "".join(f"{x:.4f} {int(y)}\n" for x, y in zip(two_theta, counts)).encode("ascii")
+
+
+def write_source_files(
+    target_dir: Path, count: int, points: int = 4000, kind: str = "mixed", seed: int = 0
+) -> list[Path]:
+    """
+    Writes `count` synthetic files to `target_dir`. `kind` is "poly", "powdat", "xyd" or "mixed" (round robin).
+    """
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    kinds = ["poly", "powdat", "xyd"] if kind == "mixed" else [kind]
+    paths = []
+    for i in range(count):
+        file_kind = kinds[i % len(kinds)]
+        two_theta = np.linspace(5.0, 90.0, points)
+        max_counts = 20000.0 if file_kind == "poly" else 200000.0
+        counts = synthetic_pattern(two_theta, rng, max_counts=max_counts)
+        if file_kind == "xyd":
+            path = target_dir / f"synthetic_{i:06d}.xyd"
+            path.write_bytes(xyd_file_bytes(two_theta, counts))
+        else:
+            path = target_dir / f"synthetic_{i:06d}.raw"
+            machine = "POLY II" if file_kind == "poly" else "Powdat"
+            path.write_bytes(raw_file_bytes(counts, 5.0, 90.0, machine=machine))
+        paths.append(path)
+    return paths
+
+
+def populate_library(data_dir: Path, count: int, points: int = 4000, seed: int = 0, batch_size: int = 1000) -> None:
+    """
+    Fills `data_dir` with `count` synthetic spectra through `save_new_spectra`, converted to Q like .raw imports.
+    """
+    import data_sources
+
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    previous_data_dir, data_sources.DATA_DIR = data_sources.DATA_DIR, data_dir
+    try:
+        rng = np.random.default_rng(seed)
+        two_theta = np.linspace(5.0, 90.0, points)
+        q = (4 * np.pi / CU_K_ALPHA) * np.sin(np.radians(two_theta) / 2)
+        tags = ["synthetic", "oxide", "reference", "in-situ", "batch-a", "batch-b"]
+        for start in range(0, count, batch_size):
+            uploads = {}
+            for i in range(start, min(start + batch_size, count)):
+                counts = synthetic_pattern(two_theta, rng).astype(np.float32)
+                uploads[f"synthetic_{i:06d}"] = (q, counts / counts.max())
+            data_sources.save_new_spectra(
+                uploads,
+                contained_elements={"Cu", "O"},
+                tags=[tags[start // batch_size % len(tags)]],
+                description="Synthetic spectrum generated for benchmarks.",
+            )
+    finally:
+        data_sources.DATA_DIR = previous_data_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic .raw/.xyd files.")
+    parser.add_argument("target_dir", type=Path)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--points", type=int, default=4000)
+    parser.add_argument("--kind", choices=["poly", "powdat", "xyd", "mixed"], default="mixed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = write_source_files(args.target_dir, args.count, args.points, args.kind, args.seed)
+    print(f"Wrote {len(paths)} files to {args.target_dir}")
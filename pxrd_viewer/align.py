@@ -0,0 +1,194 @@
+"""
+Aligns spectra that only differ by an offset of the x axis, e.g. from a sample-height error or the changed lattice
+of a solid solution, by FFT cross-correlation on a common Q grid.
+
+A zero offset moves all reflections by the same ΔQ ("shift"). A changed lattice scales every d-spacing and thus
+every Q by the same factor ("scale"), which becomes a constant shift on a logarithmic Q grid. Either way the best
+correction is the lag with the largest cross-correlation, and the correlations of every lag are one FFT product.
+"""
+
+import logging
+from typing import NamedTuple
+
+import numpy as np
+
+import derived
+import units
+from data_sources import Spectrum
+
+logger = logging.getLogger(__name__)
+
+SHIFT = "shift"
+SCALE = "scale"
+
+MODES = {SHIFT: "Q shift", SCALE: "Q scale factor"}
+
+# Largest correction searched for: ΔQ in Å⁻¹ for shifts, the relative change of Q for scale factors
+DEFAULT_MAX_CORRECTION = {SHIFT: 0.2, SCALE: 0.05}
+
+DEFAULT_BINS = 4096
+
+
+class Alignment(NamedTuple):
+    name: str
+    correction: float  # ΔQ to add for SHIFT, factor to multiply Q with for SCALE
+    similarity: float  # Correlation of the aligned spectra
+    unaligned_similarity: float  # Correlation without the correction
+
+
+def alignment_grid(ranges: list[tuple[float, float]], mode: str, bins: int = DEFAULT_BINS) -> np.ndarray:
+    """
+    Returns a grid over the union of the Q `ranges`, evenly spaced for SHIFT and geometric for SCALE.
+    """
+    start = min(r[0] for r in ranges)
+    stop = max(r[1] for r in ranges)
+    if mode == SHIFT:
+        return np.linspace(start, stop, bins)
+    if mode == SCALE:
+        # A geometric grid needs a positive start; Q < 0.01 Å⁻¹ carries no reflections anyway
+        return np.geomspace(max(start, 0.01), max(stop, 0.02), bins)
+    raise ValueError(f"Unknown mode '{mode}', expected one of {', '.join(MODES)}.")
+
+
+def profile(q: np.ndarray, y: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """
+    Interpolates a spectrum onto `grid` (0 outside of its range), removes its mean and scales it to unit length,
+    so the dot product of two profiles is their correlation coefficient.
+    """
+    q, y = derived.ascending(q, y)
+    row = np.interp(grid, q, y, left=np.nan, right=np.nan)
+    inside = np.isfinite(row)
+    if inside.any():
+        row[inside] -= row[inside].mean()
+    row[~inside] = 0.0
+    norm = np.linalg.norm(row)
+    return row / norm if norm > 0 else row
+
+
+def max_lag(grid: np.ndarray, mode: str, max_correction: float = None) -> int:
+    """
+    Converts the largest correction searched for into a number of grid steps.
+    """
+    max_correction = DEFAULT_MAX_CORRECTION[mode] if max_correction is None else max_correction
+    if mode == SHIFT:
+        step = grid[1] - grid[0]
+        lag = max_correction / step
+    else:
+        step = np.log(grid[1] / grid[0])
+        lag = np.log1p(max_correction) / step
+    return int(np.clip(np.ceil(lag), 1, len(grid) - 1))
+
+
+def cross_correlate(reference: np.ndarray, profiles: np.ndarray, lag: int) -> np.ndarray:
+    """
+    Correlates every row of `profiles` with `reference` for lags -lag..lag in one batched FFT.
+
+    Returns:
+        np.ndarray: (len(profiles), 2 * lag + 1) correlations; column `lag + k` holds sum_n row[n + k] · ref[n],
+        i.e. the correlation when the row is shifted by k bins towards smaller Q.
+    """
+    # Zero padding to twice the length turns the circular correlation of the FFT into a linear one
+    n = 1 << int(np.ceil(np.log2(2 * profiles.shape[1])))
+    spectrum = np.fft.rfft(profiles, n, axis=1) * np.conj(np.fft.rfft(reference, n))
+    correlation = np.fft.irfft(spectrum, n, axis=1)
+    return np.concatenate([correlation[:, n - lag :], correlation[:, : lag + 1]], axis=1)
+
+
+def _refine_peak(correlation: np.ndarray, index: int) -> float:
+    """
+    Sub-bin position of the maximum at `index` from a parabola through it and its neighbours.
+    """
+    if index == 0 or index == len(correlation) - 1:
+        return float(index)
+    left, center, right = correlation[index - 1 : index + 2]
+    curvature = left - 2 * center + right
+    return index + (0.5 * (left - right) / curvature if curvature < 0 else 0.0)
+
+
+def best_alignments(
+    reference: np.ndarray, profiles: np.ndarray, grid: np.ndarray, mode: str, max_correction: float = None
+) -> list[tuple[float, float, float]]:
+    """
+    Finds the correction of every row of `profiles` that best aligns it with `reference`.
+
+    Returns:
+        list[tuple[float, float, float]]: (correction, aligned correlation, unaligned correlation) per row.
+    """
+    lag = max_lag(grid, mode, max_correction)
+    correlations = cross_correlate(reference, profiles, lag)
+    results = []
+    for row in correlations:
+        index = int(np.argmax(row))
+        # The row is shifted by `bins` towards smaller Q, so its x axis has to move the other way
+        bins = lag - _refine_peak(row, index)
+        if mode == SHIFT:
+            correction = bins * (grid[1] - grid[0])
+        else:
+            correction = float(np.exp(bins * np.log(grid[1] / grid[0])))
+        results.append((float(correction), float(row[index]), float(row[lag])))
+    return results
+
+
+def align(
+    reference: tuple[np.ndarray, np.ndarray],
+    spectrum: tuple[np.ndarray, np.ndarray],
+    mode: str = SHIFT,
+    max_correction: float = None,
+    bins: int = DEFAULT_BINS,
+) -> tuple[float, float]:
+    """
+    Finds the correction of the Q axis of `spectrum` that best aligns it with `reference`; both are (Q, y) arrays.
+
+    Returns:
+        tuple[float, float]: The correction (see Alignment) and the correlation of the aligned spectra.
+    """
+    axes = [derived.ascending(q, y) for q, y in (reference, spectrum)]
+    grid = alignment_grid([(q[0], q[-1]) for q, _ in axes], mode, bins)
+    reference_profile = profile(*axes[0], grid)
+    ((correction, similarity, _),) = best_alignments(
+        reference_profile, profile(*axes[1], grid)[np.newaxis], grid, mode, max_correction
+    )
+    return correction, similarity
+
+
+def rank_library(
+    reference: tuple[np.ndarray, np.ndarray],
+    spectra: list[Spectrum],
+    mode: str = SHIFT,
+    max_correction: float = None,
+    bins: int = DEFAULT_BINS,
+    block_size: int = 256,
+) -> list[Alignment]:
+    """
+    Computes the best-shift-corrected similarity of every spectrum in `spectra` to the (Q, y) `reference`.
+
+    All candidates share one grid over the Q range of the reference, so every block of `block_size` spectra is a
+    single batched FFT and memory stays bounded for large libraries. Arrays are read without being cached on the
+    spectra, so this can run in a worker process. Spectra that cannot be read (e.g. a changed archive file) are
+    skipped with a warning, so they are missing from the result.
+
+    Returns:
+        list[Alignment]: The alignments, best match first.
+    """
+    reference_q, reference_y = derived.ascending(*reference)
+    grid = alignment_grid([(reference_q[0], reference_q[-1])], mode, bins)
+    reference_profile = profile(reference_q, reference_y, grid)
+    alignments = []
+    for start in range(0, len(spectra), block_size):
+        block, profiles = [], []
+        for spectrum in spectra[start : start + block_size]:
+            try:
+                x, y = spectrum.read_data()
+                q = units.to_q(x, spectrum.x_unit, spectrum.wavelength)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping spectrum %s: %s", spectrum.name, e)
+                continue
+            block.append(spectrum)
+            profiles.append(profile(q, y, grid))
+        if not block:
+            continue
+        results = best_alignments(reference_profile, np.array(profiles), grid, mode, max_correction)
+        for spectrum, result in zip(block, results):
+            alignments.append(Alignment(spectrum.name, *result))
+    alignments.sort(key=lambda alignment: -alignment.similarity)
+    return alignments
@@ -1,5 +1,10 @@
+import inspect
 from typing import Callable
+import numpy as np
 from nicegui import ui
+import jobs
+import search_index
+import thumbnails
 
 
 def tag_select(options, label, **kwargs):
@@ -31,3 +36,135 @@ def slider(
     s = ui.slider(min=min, max=max, **kwargs).props("label-always")
     s.bind_value_to(s.props, "label-value", display_value)
     return s
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds < 3600:
+        return f"{seconds // 60} min {seconds % 60} s"
+    return f"{seconds // 3600} h {seconds % 3600 // 60} min"
+
+
+def notify_when_finished(job: jobs.Job, on_finished: Callable = None) -> ui.timer:
+    """
+    Shows a notification in the current page once a background job has finished and calls (or awaits) `on_finished`
+    with it.
+    """
+
+    async def check():
+        # The job may run in another worker process
+        jobs.queue.refresh()
+        if not job.is_finished:
+            return
+        timer.cancel()
+        if job.state == jobs.DONE:
+            ui.notify(f"{job.title} finished" + (f": {job.result}" if job.result else ""), color="positive")
+        elif job.state == jobs.FAILED:
+            ui.notify(f"{job.title} failed: {job.error}", color="negative")
+        else:
+            ui.notify(f"{job.title} was cancelled", color="warning")
+        if on_finished is not None:
+            result = on_finished(job)
+            if inspect.isawaitable(result):
+                await result
+
+    timer = ui.timer(0.5, check)
+    return timer
+
+
+def sparkline(x, y, width: int = 160, height: int = 40, color: str = "currentColor"):
+    """
+    A tiny inline SVG preview of a spectrum, decimated like the gallery thumbnails (see `thumbnails`).
+    """
+    path = thumbnails.sparkline_path(np.asarray(x, dtype=float), np.asarray(y, dtype=float), width, height)
+    return ui.html(
+        f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+        f'<path fill="none" stroke="{color}" stroke-width="1" d="{path}"/></svg>',
+        sanitize=False,
+    )
+
+
+def spectrum_label(spectrum) -> str:
+    if spectrum.display_name and spectrum.display_name != spectrum.name:
+        return f"{spectrum.display_name} ({spectrum.name})"
+    return spectrum.name
+
+
+class SpectrumPicker(ui.select):
+    """
+    A search-as-you-type spectrum select. Only one page of matches from the server-side catalog index is sent
+    to the browser, and further pages are loaded when the option list is scrolled to its end.
+    The value is the spectrum name, or a list of names if `multiple` is set.
+    The options can be narrowed to a subset of the library with `set_scope`.
+    """
+
+    def __init__(self, label: str, value=None, on_change=None, page_size: int = 50, **kwargs):
+        self.page_size = page_size
+        self.query = ""
+        self.scope = None
+        spectra, self._total = self._search("", 0)
+        options = {s.name: spectrum_label(s) for s in spectra}
+        for name in value if isinstance(value, list) else [value]:
+            if name is not None and name not in options:
+                options[name] = self._label_for(name)
+        super().__init__(options, label=label, value=value, on_change=on_change, with_input=True, **kwargs)
+        self.props("input-debounce=150")
+        self.on("input-value", lambda e: self.search(e.args or ""))
+        self.on("virtual-scroll", self._load_next_page, ["to"])
+
+    @property
+    def selected_names(self) -> list[str]:
+        if self.value is None:
+            return []
+        return list(self.value) if isinstance(self.value, list) else [self.value]
+
+    def _search(self, query: str, offset: int, limit: int = None) -> tuple[list, int]:
+        limit = self.page_size if limit is None else limit
+        return search_index.catalog_index().search(query, offset, limit, scope=self.scope)
+
+    def set_scope(self, names: list[str] | None) -> None:
+        """
+        Only offers the spectra in `names` (e.g. the matches of a full-text search), or all spectra if None.
+        """
+        self.scope = None if names is None else set(names)
+        self.refresh()
+
+    def search(self, query: str) -> None:
+        self.query = query
+        spectra, self._total = self._search(query, 0)
+        self.set_options({s.name: spectrum_label(s) for s in spectra})
+
+    def refresh(self) -> None:
+        """
+        Re-runs the current query, e.g. after the library changed.
+        """
+        self.search(self.query)
+
+    def matching_names(self) -> list[str]:
+        """
+        Returns the names of all spectra matching the current query, not only the loaded page.
+        """
+        return [s.name for s in self._search(self.query, 0, len(search_index.catalog_index().spectra))[0]]
+
+    def _load_next_page(self, e) -> None:
+        loaded = len(self.options)
+        if e.args.get("to", 0) < loaded - 1 or loaded >= self._total:
+            return
+        spectra, self._total = self._search(self.query, loaded)
+        self.set_options({**self.options, **{s.name: spectrum_label(s) for s in spectra}})
+
+    def update(self) -> None:
+        # Keep the selected spectra among the options, otherwise the select would drop them. Values set
+        # programmatically (e.g. by a binding) may not be on the current page either; setting a value updates the
+        # element, so they are added here as well.
+        missing = [name for name in self.selected_names if name not in self.options]
+        if missing:
+            self.options = {**self.options, **{name: self._label_for(name) for name in missing}}
+        super().update()
+
+    @staticmethod
+    def _label_for(name: str) -> str:
+        spectrum = search_index.catalog_index().by_name.get(name)
+        return spectrum_label(spectrum) if spectrum else name
@@ -0,0 +1,338 @@
+"""
+Headless HTTP API for analysis scripts.
+
+    GET  /api/spectra                  paged catalog, filtered by `q` (search), `tag` and `element`
+    GET  /api/spectra/{name}           metadata of one spectrum
+    GET  /api/spectra/{name}/data      x/y of one spectrum, revalidated through its content-hash ETag
+    GET  /api/data/{content_hash}      the same bytes under an immutable, content-addressed URL
+    GET  /api/spectra/{name}/counts    the detector counts of a .raw measurement as an .npy of its integer type,
+                                       for counting statistics (σ = √counts); 404 for spectra without counts
+    GET  /api/bulk?name=a&name=b       many spectra in one response (POST with a JSON body for long lists)
+    GET  /api/thumbnails/{hash}.svg    sparkline preview of a spectrum, immutable like /api/data/{content_hash}
+    GET  /api/export                   the spectra matching `q`, `tag` and `element` (or the given `name`s) as one
+                                       downloadable file, streamed while it is written (POST for long name lists)
+
+Array formats (`format=`):
+    f32  raw little-endian float32, x followed by y; the number of points is sent in the X-Points header
+    npy  a NumPy .npy file holding a (2, points) float32 array of x and y
+
+Bulk responses use `npz` (default; one (2, points) array per spectrum name) or `f32`, where every spectrum is
+framed as a little-endian uint32 point count followed by its x and y, in the order of the requested names. They are
+streamed while the spectra are read; a request for spectra whose data file is missing fails with 404, and one for
+changed archive files with 409. A spectrum that becomes unreadable while the response is sent is left out of the
+`npz` and has 0 points in `f32`.
+
+Exports use `xy-zip` (default) or `npz`, see `export.py`.
+"""
+
+import hashlib
+import io
+import struct
+import urllib.parse
+import zipfile
+from typing import Iterator
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Path, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+import data_sources
+import export
+import search_index
+from data_sources import Spectrum
+
+router = APIRouter(prefix="/api", tags=["spectra"])
+
+DATA_MEDIA_TYPES = {"f32": "application/octet-stream", "npy": "application/x-npy"}
+BULK_MEDIA_TYPES = {"npz": "application/x-npz", "f32": "application/octet-stream"}
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SPECTRA = 10_000
+
+# Responses addressed by name can change on edits, so caches must revalidate them (cheap thanks to the ETag).
+# Content-addressed responses never change.
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class BulkRequest(BaseModel):
+    names: list[str]
+    format: str = "npz"
+
+
+class ExportRequest(BaseModel):
+    names: list[str]
+    format: str = "xy-zip"
+
+
+_hash_by_name = {"index": None, "hashes": {}}
+
+
+def _content_hash(spectrum: Spectrum) -> str:
+    if spectrum.content_hash:
+        return spectrum.content_hash
+    # Spectra saved before content hashes were stored in the .meta file are only in the hash index.
+    index = data_sources.hash_index()
+    if _hash_by_name["index"] is not index:
+        _hash_by_name["hashes"] = {name: h for h, names in index["content"].items() for name in names}
+        _hash_by_name["index"] = index
+    return _hash_by_name["hashes"].get(spectrum.name) or data_sources.content_hash(*spectrum.read_data())
+
+
+def _summary(spectrum: Spectrum) -> dict:
+    h = _content_hash(spectrum)
+    return {
+        "name": spectrum.name,
+        "display_name": spectrum.display_name,
+        "readable_name": spectrum.readable_name,
+        "contained_elements": sorted(spectrum.contained_elements),
+        "tags": spectrum.tags,
+        "description": spectrum.description,
+        "content_hash": h,
+        "x_unit": spectrum.x_unit,
+        "wavelength": spectrum.wavelength,
+        "data_url": f"/api/data/{h}",
+    }
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def _get_spectrum(name: str) -> Spectrum:
+    spectrum = search_index.catalog_index().by_name.get(name)
+    if spectrum is None:
+        raise HTTPException(status_code=404, detail=f"Spectrum '{name}' not found.")
+    return spectrum
+
+
+def _check_format(format: str, formats: dict) -> str:
+    if format not in formats:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', use one of {', '.join(formats)}.")
+    return format
+
+
+def encode_arrays(x: np.ndarray, y: np.ndarray, format: str) -> bytes:
+    """
+    Encodes the arrays of one spectrum as `f32` or `npy`, see the module docstring.
+    """
+    stacked = np.stack([x, y]).astype("<f4", copy=False)
+    if format == "f32":
+        return stacked.tobytes()
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, stacked, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _data_response(request: Request, spectrum: Spectrum, format: str, cache_control: str) -> Response:
+    _check_format(format, DATA_MEDIA_TYPES)
+    headers = {"ETag": f'"{_content_hash(spectrum)}-{format}"', "Cache-Control": cache_control}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        x, y = spectrum.read_data()
+    except data_sources.LinkedFileChangedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    headers["X-Points"] = str(len(x))
+    return Response(content=encode_arrays(x, y, format), media_type=DATA_MEDIA_TYPES[format], headers=headers)
+
+
+@router.get("/spectra")
+def list_spectra(
+    request: Request,
+    q: str = "",
+    tag: list[str] = Query(default=[]),
+    element: list[str] = Query(default=[]),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Lists the catalog page by page. `q` searches names, display names and tags; every given `tag` and
+    `element` must be present.
+    """
+    # Read before listing, so a concurrent change at worst costs the client one extra download
+    generation = data_sources.read_generation()
+    etag = f'W/"catalog-{generation}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+    spectra = search_index.catalog_index().filter(q, tag, element)
+    page = spectra[offset : offset + limit]
+    return JSONResponse(
+        {"total": len(spectra), "offset": offset, "limit": limit, "spectra": [_summary(s) for s in page]},
+        headers={"ETag": etag, "Cache-Control": REVALIDATE},
+    )
+
+
+@router.get("/spectra/{name}")
+def get_spectrum(name: str):
+    return _summary(_get_spectrum(name))
+
+
+@router.get("/spectra/{name}/data")
+def get_spectrum_data(request: Request, name: str, format: str = "f32"):
+    return _data_response(request, _get_spectrum(name), format, REVALIDATE)
+
+
+def _get_spectrum_by_hash(content_hash: str) -> Spectrum:
+    names = data_sources.hash_index()["content"].get(content_hash, [])
+    spectrum = search_index.catalog_index().by_name.get(names[0]) if names else None
+    if spectrum is None:
+        raise HTTPException(status_code=404, detail=f"No spectrum with content hash '{content_hash}'.")
+    return spectrum
+
+
+@router.get("/spectra/{name}/counts")
+def get_spectrum_counts(request: Request, name: str):
+    spectrum = _get_spectrum(name)
+    headers = {"ETag": f'"{_content_hash(spectrum)}-counts"', "Cache-Control": REVALIDATE}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        raw_counts = spectrum.read_counts()
+    except data_sources.LinkedFileChangedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if raw_counts is None:
+        raise HTTPException(status_code=404, detail=f"Spectrum '{name}' has no detector counts.")
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, raw_counts.counts, allow_pickle=False)
+    headers["X-Wavelength"] = str(raw_counts.wavelength)
+    return Response(content=buffer.getvalue(), media_type=DATA_MEDIA_TYPES["npy"], headers=headers)
+
+
+@router.get("/data/{content_hash}")
+def get_data_by_hash(request: Request, content_hash: str, format: str = "f32"):
+    return _data_response(request, _get_spectrum_by_hash(content_hash), format, IMMUTABLE)
+
+
+def thumbnail_url(spectrum: Spectrum) -> str:
+    return f"{router.prefix}/thumbnails/{_content_hash(spectrum)}.svg"
+
+
+@router.get("/thumbnails/{content_hash}.svg")
+def get_thumbnail(content_hash: str = Path(pattern="^[0-9a-f]{32}$")):
+    """
+    Serves the thumbnail written when the spectrum was saved, rendering it first if it is missing
+    (e.g. for spectra saved before thumbnails existed, until the backfill has reached them).
+    """
+    path = data_sources.thumbnail_file(content_hash)
+    if not path.exists():
+        spectrum = _get_spectrum_by_hash(content_hash)
+        path = data_sources.write_thumbnail(content_hash, *spectrum.read_data())
+    return FileResponse(path, media_type="image/svg+xml", headers={"Cache-Control": IMMUTABLE})
+
+
+def _bulk_response(request: Request, names: list[str], format: str) -> Response:
+    _check_format(format, BULK_MEDIA_TYPES)
+    if len(names) > MAX_BULK_SPECTRA:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SPECTRA} spectra per request.")
+    by_name = search_index.catalog_index().by_name
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise HTTPException(status_code=404, detail={"missing": missing})
+    spectra = [by_name[name] for name in names]
+
+    h = hashlib.blake2b(digest_size=16)
+    for spectrum in spectra:
+        h.update(f"{spectrum.name}:{_content_hash(spectrum)}\n".encode())
+    headers = {"ETag": f'"bulk-{h.hexdigest()}-{format}"', "Cache-Control": REVALIDATE}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # Checked up front, as the status cannot change once the body is being sent
+    unavailable, changed = [], []
+    for spectrum in spectra:
+        try:
+            spectrum.check_source()
+        except data_sources.LinkedFileChangedError:
+            changed.append(spectrum.name)
+        except FileNotFoundError:
+            unavailable.append(spectrum.name)
+    if changed:
+        raise HTTPException(status_code=409, detail={"changed": changed})
+    if unavailable:
+        raise HTTPException(status_code=404, detail={"unavailable": unavailable})
+    return StreamingResponse(_stream_bulk(spectra, format), media_type=BULK_MEDIA_TYPES[format], headers=headers)
+
+
+def _stream_bulk(spectra: list[Spectrum], format: str) -> Iterator[bytes]:
+    """
+    Yields the body of a bulk response, reading the spectra a chunk at a time like the exports.
+    """
+    buffer = export.StreamBuffer()
+    if format == "npz":
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for spectrum, x, y, error in export.read_chunked(spectra):
+                if error is None:
+                    with archive.open(f"{spectrum.name}.npy", "w", force_zip64=True) as f:
+                        f.write(encode_arrays(x, y, "npy"))
+                if buffer.size >= export.FLUSH_SIZE:
+                    yield buffer.take()
+    else:
+        for spectrum, x, y, error in export.read_chunked(spectra):
+            buffer.write(struct.pack("<I", 0 if error else len(x)))
+            if error is None:
+                buffer.write(encode_arrays(x, y, "f32"))
+            if buffer.size >= export.FLUSH_SIZE:
+                yield buffer.take()
+    yield buffer.take()
+
+
+@router.get("/bulk")
+def bulk_get(request: Request, name: list[str] = Query(), format: str = "npz"):
+    return _bulk_response(request, name, format)
+
+
+@router.post("/bulk")
+def bulk_post(request: Request, bulk: BulkRequest):
+    return _bulk_response(request, bulk.names, bulk.format)
+
+
+def export_url(query: str = "", tags: list[str] = (), elements: list[str] = (), format: str = "xy-zip") -> str:
+    """
+    Returns the URL of the export of the spectra matching the filters, as used by the gallery.
+    """
+    params = [("format", format)] + [("q", query)] * bool(query) + [("tag", t) for t in tags]
+    params += [("element", e) for e in elements]
+    return f"{router.prefix}/export?{urllib.parse.urlencode(params)}"
+
+
+def _export_response(spectra: list[Spectrum], format: str) -> StreamingResponse:
+    _check_format(format, export.FORMATS)
+    file_name = f"pxrd-export-{len(spectra)}{export.FORMATS[format]}"
+    return StreamingResponse(
+        export.stream(spectra, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"', "X-Spectra": str(len(spectra))},
+    )
+
+
+@router.get("/export")
+def export_get(
+    q: str = "",
+    tag: list[str] = Query(default=[]),
+    element: list[str] = Query(default=[]),
+    name: list[str] = Query(default=[]),
+    format: str = "xy-zip",
+):
+    """
+    Exports the spectra named by `name`, or else all spectra matching `q`, `tag` and `element` as in
+    `/api/spectra`. The file is generated while it is sent, so there is no limit on the number of spectra.
+    """
+    if name:
+        return export_post(ExportRequest(names=name, format=format))
+    return _export_response(search_index.catalog_index().filter(q, tag, element), format)
+
+
+@router.post("/export")
+def export_post(request: ExportRequest):
+    by_name = search_index.catalog_index().by_name
+    missing = [name for name in request.names if name not in by_name]
+    if missing:
+        raise HTTPException(status_code=404, detail={"missing": missing})
+    return _export_response([by_name[name] for name in request.names], request.format)
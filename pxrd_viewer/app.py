@@ -1,10 +1,29 @@
+import startup  # first, so the startup timing includes all imports below
 from menutheme import register_nav_page, menutheme
-from nicegui import ui, app, binding
+from nicegui import ui, app, binding, context, background_tasks, run, Client
+from nicegui import json as nicegui_json
+from fastapi.responses import PlainTextResponse
 import plotly.graph_objects as go
-from data_sources import list_available_spectra, Spectrum
+from contextlib import contextmanager
+from dataclasses import field
+import numpy as np
+from data_sources import fulltext_index, list_available_spectra, Spectrum
+import align
 import altui
+import api
+import derived
+import jobs
+import library_watcher
+import metrics
+import peaks
+import search_index
+import similarity
+import units
+import views
+import logging
 import os
-from pages import add_spectrum, edit_spectra  # noqa: F401
+from urllib.parse import urlencode
+from pages import add_spectrum, clusters, edit_spectra, gallery, jobs as jobs_page  # noqa: F401
 
 
 @binding.bindable_dataclass
@@ -18,6 +37,9 @@ class Line:
     can_be_deleted: bool = True
     inverse: bool = True
     _display_name: str = None
+    # Correction of the Q axis (Q · q_scale + q_shift), e.g. for a zero offset or a changed lattice
+    q_shift: float = 0.0
+    q_scale: float = 1.0
 
     @property
     def display_name(self):
@@ -85,6 +107,7 @@ class Line:
                 on_change=update_figure,
             ).bind_value(self, "width")
             ui.checkbox("Invert spectrum", on_change=update_figure).bind_value(self, "inverse")
+            self.analysis_controls()
 
             def delete_line():
                 app.storage.client["active_lines"].remove(self)
@@ -94,6 +117,317 @@ class Line:
             ui.button("Delete", on_click=delete_line).bind_visibility_from(self, "can_be_deleted")
         return expansion
 
+    def analysis_controls(self):
+        self.alignment_controls()
+        fit_button = ui.button("Fit peaks", icon="query_stats").props("flat")
+        fit_button.on_click(lambda: self.fit_peaks(fit_button))
+
+    async def fit_peaks(self, button: ui.button):
+        """
+        Fits all peaks of this line in a worker process and adds the fit as a line with a table of the peaks.
+        """
+        q, y = derived.ascending(self.x_in(units.Q), self.spectrum.y)
+        button.props("loading")
+        try:
+            fit = await run.cpu_bound(peaks.fit_spectrum, q, y)
+        except ValueError as e:
+            ui.notify(f"Cannot fit {self.display_name}: {e}", color="negative")
+            return
+        finally:
+            button.props(remove="loading")
+        line = FitLine(
+            spectrum=None,
+            color="#000000",
+            opacity=0.8,
+            dash="dot",
+            width=1.5,
+            inverse=self.inverse,
+            source=self,
+            fit=fit,
+            q=q,
+        )
+        app.storage.client["active_lines"].append(line)
+        add_line_controller(line)
+
+    def alignment_controls(self):
+        with ui.row().classes("items-center"):
+            ui.number("Q shift (Å⁻¹)", step=0.001, format="%.4f", on_change=update_figure).bind_value(
+                self, "q_shift"
+            ).classes("w-32")
+            ui.number("Q scale", min=0.5, max=2.0, step=0.001, format="%.5f", on_change=update_figure).bind_value(
+                self, "q_scale"
+            ).classes("w-32")
+            with ui.dropdown_button("Auto-align", icon="align_horizontal_center", auto_close=True).props("flat"):
+                for mode, label in align.MODES.items():
+                    ui.item(f"Best {label}", on_click=lambda mode=mode: self.auto_align(mode))
+
+    def auto_align(self, mode: str):
+        """
+        Sets the Q correction of this line that best aligns it with the selected spectrum.
+        """
+        reference = app.storage.client["selected_line"].spectrum
+        if self.spectrum is reference:
+            ui.notify("Select a different spectrum to align this line with.", color="warning")
+            return
+        correction, similarity = align.align(
+            (reference.x_in(units.Q), reference.y), (self.spectrum.x_in(units.Q), self.spectrum.y), mode
+        )
+        self.q_shift, self.q_scale = (correction, 1.0) if mode == align.SHIFT else (0.0, correction)
+        update_figure()
+        ui.notify(f"Aligned {self.display_name} with {reference.readable_name} (correlation {similarity:.3f})")
+
+    def x_in(self, unit: str = units.Q, wavelength: float = None) -> np.ndarray:
+        """
+        Returns the x values of the spectrum in `unit`, with the Q correction of this line applied.
+        """
+        if self.q_shift == 0 and self.q_scale == 1:
+            return self.spectrum.x_in(unit, wavelength)
+        return units.from_q(self.spectrum.x_in(units.Q) * self.q_scale + self.q_shift, unit, wavelength)
+
+    def xy(self, unit: str = units.Q, wavelength: float = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the x values in `unit` and the y values as drawn.
+        """
+        y = self.spectrum.y
+        return self.x_in(unit, wavelength), -y if self.inverse else y
+
+    def view_style(self) -> dict:
+        return {
+            "color": self.color,
+            "opacity": self.opacity,
+            "dash": self.dash,
+            "width": self.width,
+            "inverse": self.inverse,
+            "q_shift": self.q_shift,
+            "q_scale": self.q_scale,
+            "name": self._display_name,
+        }
+
+    def view_entry(self, indices: dict[int, int]) -> dict | None:
+        """
+        Returns the entry of this line in a saved view (see `views`), or None if it cannot be saved.
+        `indices` maps the ids of the lines saved before this one to their index in the view.
+        """
+        return {"spectrum": self.spectrum.name, **self.view_style()}
+
+
+@binding.bindable_dataclass
+class DerivedLine(Line):
+    """
+    A line computed from other lines on a shared grid, e.g. the difference of a measurement and a reference.
+
+    The result is cached and only recomputed when the spectrum of an input line, the operation or the axis
+    changes, so style changes that redraw the figure do not recompute it.
+    """
+
+    inputs: list[Line] = field(default_factory=list)
+    operation: str = "difference"
+    scales: list[float] = None
+
+    @property
+    def display_name(self):
+        if self._display_name is not None:
+            return self._display_name
+        names = [line.display_name for line in self.inputs]
+        if self.operation == "scaled_sum":
+            names = [f"{scale:g}·{name}" for scale, name in zip(self.scales, names)]
+        symbol = {"difference": " − ", "ratio": " / "}.get(self.operation, " + ")
+        return symbol.join(names)
+
+    @display_name.setter
+    def display_name(self, value):
+        self._display_name = value
+
+    def analysis_controls(self):
+        pass
+
+    def view_entry(self, indices: dict[int, int]) -> dict | None:
+        if any(id(line) not in indices for line in self.inputs):
+            return None
+        return {
+            "inputs": [indices[id(line)] for line in self.inputs],
+            "operation": self.operation,
+            "scales": self.scales,
+            **self.view_style(),
+        }
+
+    def xy(self, unit: str = units.Q, wavelength: float = None) -> tuple[np.ndarray, np.ndarray]:
+        if unit != units.TWO_THETA:
+            wavelength = None
+        spectra = [line.spectrum for line in self.inputs]
+        corrections = tuple((line.q_shift, line.q_scale) for line in self.inputs)
+        # Spectra are compared by identity: edits and library updates replace the Spectrum objects
+        key = (tuple(map(id, spectra)), corrections, self.operation, tuple(self.scales or ()), unit, wavelength)
+        cached = getattr(self, "_cached", None)
+        if cached is None or cached[0] != key:
+            axes = [derived.ascending(line.x_in(unit, wavelength), line.spectrum.y) for line in self.inputs]
+            grid = derived.shared_grid([x for x, _ in axes])
+            # The stored axis of a spectrum can be corrected without changing its content hash
+            ys = [
+                derived.resample(
+                    x,
+                    y,
+                    grid,
+                    key=(
+                        s.content_hash or str(s.source_file),
+                        s.x_unit,
+                        s.wavelength,
+                        correction,
+                        unit,
+                        wavelength,
+                        *grid[[0, -1]],
+                        len(grid),
+                    ),
+                )
+                for s, correction, (x, y) in zip(spectra, corrections, axes)
+            ]
+            # The spectra are kept with the result, so their ids cannot be reused while the key is in use
+            cached = self._cached = (key, spectra, grid, derived.combine(ys, self.operation, self.scales))
+        _, _, grid, y = cached
+        return grid, -y if self.inverse else y
+
+
+@binding.bindable_dataclass
+class FitLine(Line):
+    """
+    The peak fit of another line: the fitted model, followed by every single peak on top of the background
+    (as separate segments of the same trace), with a table of the fitted peaks in its controller.
+    """
+
+    source: Line = None
+    fit: peaks.PeakFit = None
+    # The corrected Q values of the source the fit was made on
+    q: np.ndarray = None
+
+    @property
+    def display_name(self):
+        if self._display_name is not None:
+            return self._display_name
+        return f"Fit of {self.source.display_name}"
+
+    @display_name.setter
+    def display_name(self, value):
+        self._display_name = value
+
+    def analysis_controls(self):
+        fit = self.fit
+        ui.label(
+            f"{len(fit.centers)} peaks, R² = {fit.r_squared:.4f}" + ("" if fit.converged else " (not converged)")
+        ).classes("text-sm")
+        ui.table(
+            columns=[
+                {"name": name, "label": label, "field": name, "sortable": name in ("q", "area", "size")}
+                for name, label in [
+                    ("q", "Q (Å⁻¹)"),
+                    ("d", "d (Å)"),
+                    ("fwhm", "FWHM (Å⁻¹)"),
+                    ("eta", "η"),
+                    ("area", "Area"),
+                    ("size", "Scherrer size (nm)"),
+                ]
+            ],
+            rows=self.table_rows(),
+            row_key="q",
+            pagination=10,
+        ).props("dense").classes("w-full")
+        ui.label("Scherrer sizes do not correct for instrumental broadening.").classes("text-xs")
+        batch_button = ui.button("Fit these peaks in all spectra", icon="stacked_line_chart").props("flat")
+        batch_button.on_click(lambda: self.fit_in_all_spectra(batch_button))
+
+    def view_entry(self, indices: dict[int, int]) -> dict | None:
+        # Fits are not saved; refitting takes a moment
+        return None
+
+    def table_rows(self) -> list[dict]:
+        fit = self.fit
+        return [
+            {
+                "q": f"{center:.4f} ± {center_error:.4f}",
+                "d": f"{2 * np.pi / center:.4f}",
+                "fwhm": f"{fwhm:.4f} ± {fwhm_error:.4f}",
+                "eta": f"{eta:.2f}",
+                "area": f"{area:.4g} ± {area_error:.2g}",
+                "size": f"{size / 10:.1f}",
+            }
+            for center, center_error, fwhm, fwhm_error, eta, area, area_error, size in zip(
+                fit.centers,
+                fit.center_errors,
+                fit.fwhm,
+                fit.fwhm_errors,
+                fit.eta,
+                fit.areas,
+                fit.area_errors,
+                fit.crystallite_sizes(),
+            )
+        ]
+
+    async def fit_in_all_spectra(self, button: ui.button):
+        """
+        Fits the peaks of this fit in every spectrum of the current list (one batch) and shows the results.
+        """
+        spectra = app.storage.client["spectra"]
+        window = (self.q[0], self.q[-1])
+        button.props("loading")
+        try:
+            # The worker reads the arrays itself, so they are neither sent to it nor cached on the spectra
+            fits = await run.cpu_bound(peaks.fit_spectra, spectra, self.fit.centers, window, block_size=16)
+        finally:
+            button.props(remove="loading")
+        rows = [
+            {
+                "id": f"{spectrum.name}-{i}",
+                "spectrum": spectrum.readable_name,
+                "peak": i + 1,
+                "q": round(float(fit.centers[i]), 4),
+                "fwhm": round(float(fit.fwhm[i]), 4),
+                "area": float(f"{fit.areas[i]:.4g}"),
+                "size": round(float(fit.crystallite_sizes()[i]) / 10, 1),
+            }
+            for spectrum, fit in zip(spectra, fits)
+            if fit is not None
+            for i in range(len(fit.centers))
+        ]
+        with ui.dialog() as dialog, ui.card().classes("w-[48rem] max-w-full"):
+            ui.label(f"Peaks of {self.source.display_name} in {len(spectra)} spectra").classes("text-lg font-semibold")
+            ui.table(
+                columns=[
+                    {"name": name, "label": label, "field": name, "sortable": True, "align": "left"}
+                    for name, label in [
+                        ("spectrum", "Spectrum"),
+                        ("peak", "Peak"),
+                        ("q", "Q (Å⁻¹)"),
+                        ("fwhm", "FWHM (Å⁻¹)"),
+                        ("area", "Area"),
+                        ("size", "Scherrer size (nm)"),
+                    ]
+                ],
+                rows=rows,
+                row_key="id",
+                pagination=20,
+            ).props("dense").classes("w-full")
+            ui.button("Close", on_click=dialog.close).props("flat")
+        dialog.on("hide", dialog.delete)
+        dialog.open()
+
+    def xy(self, unit: str = units.Q, wavelength: float = None) -> tuple[np.ndarray, np.ndarray]:
+        if unit != units.TWO_THETA:
+            wavelength = None
+        cached = getattr(self, "_cached", None)
+        if cached is None or cached[0] != (unit, wavelength):
+            fit, q = self.fit, self.q
+            background = fit.background[0] + fit.background[1] * (q - fit.reference_x)
+            profiles = fit.profiles(q)
+            xs, ys = [q], [background + profiles.sum(axis=0)]
+            for center, fwhm, profile in zip(fit.centers, fit.fwhm, profiles):
+                # Only the part of a peak that stands out is drawn; NaN separates the segments
+                near = np.abs(q - center) <= 3 * fwhm
+                xs += [[np.nan], q[near]]
+                ys += [[np.nan], (background + profile)[near]]
+            x = units.from_q(np.concatenate(xs), unit, wavelength)
+            cached = self._cached = ((unit, wavelength), x, np.concatenate(ys))
+        _, x, y = cached
+        return x, -y if self.inverse else y
+
 
 def next_spectrum(spectrum: Spectrum | None = None) -> Spectrum:
     """
@@ -123,23 +457,141 @@ def all_active_lines():
     yield from app.storage.client.get("active_lines", [])
 
 
-def update_figure(*args, **kwargs):
-    fig = app.storage.client["fig"]
-    fig.data = tuple()
+def current_view() -> dict:
+    """
+    Returns the lines in view with their styles and the x axis as a saved view, see `views`.
+    """
+    roles = {
+        id(app.storage.client.get("selected_line")): "selected",
+        id(app.storage.client.get("rotation_line")): "rotation",
+    }
+    entries, indices = [], {}
     for line in all_active_lines():
-        fig.add_trace(
-            go.Scatter(
-                x=line.spectrum.x,
-                y=-line.spectrum.y if line.inverse else line.spectrum.y,
-                mode="lines",
-                name=line.display_name,
-                line=dict(color=line.color, width=line.width, dash=line.dash),
-                opacity=line.opacity,
-                hoverinfo="none",
-            )
+        entry = line.view_entry(indices)
+        if entry is None:
+            continue
+        indices[id(line)] = len(entries)
+        entries.append(views.compact_line({"role": roles.get(id(line), "pinned"), **entry}))
+    return {
+        "v": views.VERSION,
+        "x_unit": app.storage.client.get("x_unit", units.Q),
+        "wavelength": app.storage.client.get("wavelength"),
+        "lines": entries,
+    }
+
+
+def lines_from_view(view: dict, by_name: dict[str, Spectrum]) -> tuple[Line | None, Line | None, list[Line]]:
+    """
+    Builds the lines of a saved view. Lines of spectra that are not in `by_name` are left out, as are derived
+    lines of left out inputs.
+
+    Returns:
+        tuple[Line | None, Line | None, list[Line]]: The selected line, the rotation line and the pinned lines.
+    """
+    lines = []
+    for entry in map(views.expand_line, view["lines"]):
+        style = dict(
+            color=entry["color"],
+            opacity=entry["opacity"],
+            dash=entry["dash"],
+            width=entry["width"],
+            inverse=entry["inverse"],
+            q_shift=entry["q_shift"],
+            q_scale=entry["q_scale"],
+            _display_name=entry["name"],
         )
-    fig.update_layout(uirevision="constant")
-    app.storage.client["plot"].update()
+        line = None
+        if "inputs" in entry:
+            inputs = [lines[i] for i in entry["inputs"]]
+            if all(line is not None for line in inputs):
+                line = DerivedLine(
+                    spectrum=None,
+                    inputs=inputs,
+                    operation=entry.get("operation", "difference"),
+                    scales=entry.get("scales"),
+                    **style,
+                )
+        elif entry["spectrum"] in by_name:
+            line = Line(spectrum=by_name[entry["spectrum"]], **style)
+            if entry["role"] == "selected":
+                line.title, line.can_be_deleted = "(Selected)", False
+            elif entry["role"] == "rotation":
+                line.title, line.can_be_deleted = "(Rot)", False
+        lines.append(line)
+    by_role = {}
+    for entry, line in zip(map(views.expand_line, view["lines"]), lines):
+        if line is not None:
+            by_role.setdefault(entry["role"], []).append(line)
+    return by_role.get("selected", [None])[0], by_role.get("rotation", [None])[0], by_role.get("pinned", [])
+
+
+async def restore_view(view: dict, spectra: list[Spectrum]) -> tuple[Line | None, Line | None, list[Line], list[str]]:
+    """
+    Builds the lines of a saved view after reading the arrays of all its spectra concurrently, so the page renders
+    the whole view at once.
+
+    Returns:
+        tuple[Line | None, Line | None, list[Line], list[str]]: The lines (see `lines_from_view`) and the names of
+            the spectra of the view that are missing or cannot be read.
+    """
+    by_name = {spectrum.name: spectrum for spectrum in spectra}
+    names = views.referenced_spectra(view)
+    referenced = [by_name[name] for name in names if name in by_name]
+    failed = await run.io_bound(views.preload, referenced)
+    available = {spectrum.name: spectrum for spectrum in referenced if spectrum.name not in failed}
+    return *lines_from_view(view, available), [name for name in names if name not in available]
+
+
+def line_trace(line: Line, unit: str = units.Q, wavelength: float = None) -> go.Scatter:
+    x, y = line.xy(unit, wavelength)
+    return go.Scatter(
+        x=x,
+        y=y,
+        mode="lines",
+        name=line.display_name,
+        line=dict(color=line.color, width=line.width, dash=line.dash),
+        opacity=line.opacity,
+        hoverinfo="none",
+    )
+
+
+@contextmanager
+def batched_figure_updates():
+    """
+    Collects the figure updates requested inside the block, e.g. by the change events that binding the controls of
+    a line fires, into one update at its end.
+    """
+    outermost = "figure_update_pending" not in app.storage.client
+    if outermost:
+        app.storage.client["figure_update_pending"] = False
+    try:
+        yield
+    finally:
+        if outermost and app.storage.client.pop("figure_update_pending"):
+            update_figure()
+
+
+def update_figure(*args, **kwargs):
+    if "figure_update_pending" in app.storage.client:
+        app.storage.client["figure_update_pending"] = True
+        return
+    fig = app.storage.client["fig"]
+    unit = app.storage.client.get("x_unit", units.Q)
+    wavelength = app.storage.client.get("wavelength", None)
+    with metrics.timer(metrics.FIGURE_BUILD_SECONDS):
+        fig.data = tuple()
+        for line in all_active_lines():
+            try:
+                fig.add_trace(line_trace(line, unit, wavelength))
+            except ValueError as e:
+                ui.notify(f"Cannot show {line.display_name} in {units.UNITS[unit]}: {e}", color="negative")
+        # The zoom is kept while the unit stays the same, but must be reset when the axis changes
+        fig.update_layout(uirevision=f"{unit}-{wavelength}", xaxis_title=units.UNITS[unit])
+    plot = app.storage.client["plot"]
+    with metrics.timer(metrics.FIGURE_SERIALIZE_SECONDS):
+        plot.update()
+    if metrics.sample_payload():
+        metrics.FIGURE_PAYLOAD_BYTES.observe(len(nicegui_json.dumps(plot.props["options"])))
 
 
 def on_select_spectrum(e):
@@ -150,35 +602,73 @@ def on_select_spectrum(e):
 
 def add_line_controller(line: Line, move_to_top: bool = False):
     line_controls = app.storage.client.get("line_controls", None)
-    if line_controls:
-        with line_controls:
-            element = line.controller()
-            app.storage.client["line_controllers"][id(line)] = element
-            if move_to_top:
-                element.move(target_index=2)  # todo: make dynamic based on number of static elements
-    update_figure()
+    with batched_figure_updates():
+        if line_controls:
+            with line_controls:
+                element = line.controller()
+                app.storage.client["line_controllers"][id(line)] = element
+                if move_to_top:
+                    element.move(target_index=2)  # todo: make dynamic based on number of static elements
+        update_figure()
 
 
 @register_nav_page("/", display_name="Spectrum Viewer", favicon="📈")
-def main():
+async def main(order: str = None, view: str = None):
     with menutheme("Spectrum Viewer"):
         spectra = list_available_spectra()
+        if order == "clusters":
+            # Similar spectra follow each other in the rotation, see the clusters page. The order is stored by the
+            # similarity job; if the matrix changed since, it is computed again in a worker process.
+            stored_order = similarity.stored_order()
+            try:
+                if stored_order is None:
+                    stored_order = await run.cpu_bound(similarity.update_order)
+            except ValueError as e:
+                ui.notify(str(e), color="warning")
+            else:
+                spectra = similarity.cluster_order(spectra, stored_order)
         app.storage.client["spectra"] = spectra
-        spectrum_names = [s.name for s in spectra]
 
         app.storage.client["active_lines"] = []
+        app.storage.client["x_unit"] = units.Q
+        app.storage.client["wavelength"] = units.CU_K_ALPHA
+        app.storage.client["rotation_line"] = None
+        saved_view = None
+        if view is not None:
+            try:
+                saved_view = views.decode(view)
+            except ValueError as e:
+                ui.notify(f"Cannot open the view: {e}", color="negative")
 
         if not spectra:
             ui.label("No spectra available. Please add spectra first.").classes("text-red")
+
+            def reload_on_first_spectrum(delta: library_watcher.LibraryDelta):
+                if delta.added:
+                    with client:
+                        ui.navigate.reload()
+
+            client = context.client
+            client.on_delete(library_watcher.watcher.subscribe(reload_on_first_spectrum))
         else:
-            selected_obj = spectra[0]
-            selected_line = Line.from_spectrum(
-                selected_obj,
-                color="#FF0000",
-                can_be_deleted=False,
-                title="(Selected)",
-                inverse=False,
-            )
+            selected_line = None
+            if saved_view is not None:
+                # All lines of the view exist before the figure is built, so it is rendered once
+                selected_line, rotation_line, pinned_lines, unavailable = await restore_view(saved_view, spectra)
+                app.storage.client["rotation_line"] = rotation_line
+                app.storage.client["active_lines"] = pinned_lines
+                app.storage.client["x_unit"] = saved_view.get("x_unit", units.Q)
+                app.storage.client["wavelength"] = saved_view.get("wavelength") or units.CU_K_ALPHA
+                if unavailable:
+                    ui.notify(f"Not found or not readable: {', '.join(unavailable)}", color="warning")
+            if selected_line is None:
+                selected_line = Line.from_spectrum(
+                    spectra[0],
+                    color="#FF0000",
+                    can_be_deleted=False,
+                    title="(Selected)",
+                    inverse=False,
+                )
             app.storage.client["selected_line"] = selected_line
 
             fig = go.Figure()
@@ -195,18 +685,54 @@ def main():
             plot = ui.plotly(fig).style("height: 450px;").classes("w-full h-full")
             app.storage.client["plot"] = plot
 
-            update_figure()
+            # x axis unit of the view; converted axes are cached on the spectra, so switching back is instant
+            def set_unit(e):
+                app.storage.client["x_unit"] = e.value
+                update_figure()
+
+            def set_wavelength(e):
+                if e.value:
+                    app.storage.client["wavelength"] = e.value
+                    update_figure()
+
+            with ui.row().classes("items-center"):
+                ui.select(units.UNITS, label="x axis", value=app.storage.client["x_unit"], on_change=set_unit).classes(
+                    "w-32"
+                )
+                with (
+                    ui.row()
+                    .classes("items-center")
+                    .bind_visibility_from(app.storage.client, "x_unit", lambda unit: unit == units.TWO_THETA)
+                ):
+                    wavelength_input = ui.number(
+                        "Wavelength (Å)",
+                        value=app.storage.client["wavelength"],
+                        min=0.01,
+                        step=0.0001,
+                        format="%.5f",
+                        on_change=set_wavelength,
+                    ).classes("w-32")
+                    with ui.button(icon="expand_more").props("flat dense"):
+                        with ui.menu():
+                            for anode, value in units.ANODE_WAVELENGTHS.items():
+                                ui.menu_item(
+                                    f"{anode} ({value} Å)", on_click=lambda v=value: wavelength_input.set_value(v)
+                                )
 
             # Controls
-            ui.select(
-                spectrum_names,
-                label="Select a spectrum to view",
-                value=spectrum_names[0],
-                on_change=on_select_spectrum,
-            ).classes("w-1/2")
+            with ui.row().classes("w-full items-center"):
+                spectrum_select = altui.SpectrumPicker(
+                    "Select a spectrum to view",
+                    value=selected_line.spectrum.name,
+                    on_change=on_select_spectrum,
+                ).classes("w-1/2")
+                text_search = ui.input("Search descriptions, notes and tags").props("clearable debounce=200")
+                text_search.classes("w-1/4")
+                text_matches = ui.label()
 
             # Rotation interface
             def next_spectrum(spectrum=None):
+                spectra = app.storage.client["spectra"]
                 if not spectra:
                     return None
                 if spectrum is None:
@@ -217,7 +743,6 @@ def main():
                 return spectra[0]
 
             # Rotation
-            app.storage.client["rotation_line"] = None
             with ui.row().classes("items-center"):
 
                 def activate_rotation():
@@ -247,12 +772,15 @@ def main():
                     rot_line = app.storage.client.get("rotation_line", None)
                     if rot_line:
                         rot_line.spectrum = next_spectrum(rot_line.spectrum)
+                        # A correction found for one spectrum does not carry over to the next
+                        rot_line.q_shift, rot_line.q_scale = 0.0, 1.0
                         update_figure()
 
                 def set_selected_spectrum(e):
                     rot_line = app.storage.client.get("rotation_line", None)
-                    if rot_line:
-                        selected_obj = next(s for s in spectra if s.name == e.value)
+                    # Also called when the picker follows a change of the rotation line
+                    if rot_line and rot_line.spectrum.name != e.value:
+                        selected_obj = next(s for s in app.storage.client["spectra"] if s.name == e.value)
                         rot_line.spectrum = selected_obj
                         update_figure()
 
@@ -264,28 +792,325 @@ def main():
                     .classes("items-center")
                     .bind_visibility_from(app.storage.client, "rotation_line", lambda x: x is not None)
                 ):
-                    ui.select(
-                        spectrum_names,
-                        label="Rotating Spectrum",
-                        on_change=set_selected_spectrum,
-                    ).bind_value_from(
-                        app.storage.client,
-                        "rotation_line",
-                        backward=lambda x: x.spectrum.name if x else None,
-                    ).classes("w-1/4")
+                    rotation_select = (
+                        altui.SpectrumPicker(
+                            "Rotating Spectrum",
+                            on_change=set_selected_spectrum,
+                        )
+                        .bind_value_from(
+                            app.storage.client,
+                            "rotation_line",
+                            backward=lambda x: x.spectrum.name if x else None,
+                        )
+                        .classes("w-1/4")
+                    )
                     ui.button("Delete", on_click=delete_rotation)
                     ui.button("Next", on_click=next_rotation)
                     ui.button("Pin", on_click=pin_rotation)
 
             app.storage.client["line_controllers"] = {}
-            with ui.column().classes("w-full") as line_controls:
+            # The figure is drawn once, after the controls of all lines (of a restored view) exist
+            with ui.column().classes("w-full") as line_controls, batched_figure_updates():
                 ui.label("Spectra in View").classes("text-lg font-semibold mt-4")
                 for line in all_active_lines():
                     element = line.controller()
                     app.storage.client["line_controllers"][id(line)] = element
                 app.storage.client["line_controls"] = line_controls
+                update_figure()
+
+            # Derived lines: arithmetic of the spectra in view on a shared grid
+            candidates = {}
+            with ui.dialog() as derived_dialog, ui.card().classes("w-96"):
+                ui.label("Add derived line").classes("text-lg font-semibold")
+                operation = ui.select(derived.OPERATIONS, value="difference", label="Operation").classes("w-full")
+                derived_inputs = ui.select({}, label="Lines (in order)", multiple=True).classes("w-full")
+                scale_input = (
+                    ui.input("Scale factors", placeholder="1, -0.5")
+                    .classes("w-full")
+                    .bind_visibility_from(operation, "value", value="scaled_sum")
+                )
+
+                def add_derived_line():
+                    inputs = [candidates[i] for i in derived_inputs.value]
+                    if len(inputs) < 2:
+                        ui.notify("Please select at least two lines.", color="negative")
+                        return
+                    scales = None
+                    if operation.value == "scaled_sum":
+                        try:
+                            scales = [float(v) for v in scale_input.value.split(",") if v.strip()]
+                        except ValueError:
+                            scales = []
+                        if len(scales) != len(inputs):
+                            ui.notify(f"Please enter {len(inputs)} comma separated numbers.", color="negative")
+                            return
+                    line = DerivedLine(
+                        spectrum=None,
+                        color="#008000",
+                        opacity=0.8,
+                        dash="solid",
+                        width=2.0,
+                        inverse=False,
+                        inputs=inputs,
+                        operation=operation.value,
+                        scales=scales,
+                    )
+                    try:
+                        line.xy(app.storage.client["x_unit"], app.storage.client["wavelength"])
+                    except ValueError as e:
+                        ui.notify(f"Cannot compute {line.display_name}: {e}", color="negative")
+                        return
+                    app.storage.client["active_lines"].append(line)
+                    add_line_controller(line)
+                    derived_dialog.close()
+
+                with ui.row():
+                    ui.button("Add", on_click=add_derived_line)
+                    ui.button("Cancel", on_click=derived_dialog.close).props("flat")
+
+            def open_derived_dialog():
+                candidates.clear()
+                candidates.update(
+                    enumerate(line for line in all_active_lines() if not isinstance(line, (DerivedLine, FitLine)))
+                )
+                derived_inputs.set_options({i: line.display_name for i, line in candidates.items()}, value=[])
+                derived_dialog.open()
+
+            ui.button("Add derived line", icon="functions", on_click=open_derived_dialog).props("flat")
+
+            # Library-wide search for spectra that match the selected one after the best Q correction
+            with ui.dialog() as match_dialog, ui.card().classes("w-[40rem] max-w-full"):
+                ui.label("Find aligned matches").classes("text-lg font-semibold")
+                with ui.row().classes("items-center"):
+                    match_mode = ui.select(align.MODES, value=align.SHIFT, label="Correction").classes("w-40")
+                    match_button = ui.button("Search", icon="manage_search")
+                match_table = ui.table(
+                    columns=[
+                        {"name": "name", "label": "Spectrum", "field": "name", "align": "left"},
+                        {"name": "correction", "label": "Correction", "field": "correction"},
+                        {"name": "similarity", "label": "Aligned", "field": "similarity", "sortable": True},
+                        {"name": "unaligned", "label": "Unaligned", "field": "unaligned", "sortable": True},
+                    ],
+                    rows=[],
+                    row_key="name",
+                    pagination=15,
+                ).classes("w-full")
+                ui.label("Click a row to show the spectrum, aligned, as the rotating line.").classes("text-sm")
+
+            async def find_matches():
+                reference = app.storage.client["selected_line"].spectrum
+                candidates = [s for s in app.storage.client["spectra"] if s != reference]
+                mode = match_mode.value
+                match_button.props("loading")
+                try:
+                    alignments = await run.cpu_bound(
+                        align.rank_library, (reference.x_in(units.Q), reference.y), candidates, mode
+                    )
+                finally:
+                    match_button.props(remove="loading")
+                if len(alignments) < len(candidates):
+                    skipped = len(candidates) - len(alignments)
+                    ui.notify(f"Skipped {skipped} spectra that could not be read.", color="warning")
+                match_table.rows = [
+                    {
+                        "name": a.name,
+                        "correction": f"{a.correction:+.4f} Å⁻¹" if mode == align.SHIFT else f"{a.correction:.5f}×",
+                        "mode": mode,
+                        "value": a.correction,
+                        "similarity": round(a.similarity, 4),
+                        "unaligned": round(a.unaligned_similarity, 4),
+                    }
+                    for a in alignments
+                ]
+                match_table.update()
+
+            def show_match(e):
+                row = e.args[1]
+                spectrum = next((s for s in app.storage.client["spectra"] if s.name == row["name"]), None)
+                if spectrum is None:
+                    return
+                if app.storage.client.get("rotation_line") is None:
+                    activate_rotation()
+                rot_line = app.storage.client["rotation_line"]
+                rot_line.spectrum = spectrum
+                rot_line.q_shift, rot_line.q_scale = (
+                    (row["value"], 1.0) if row["mode"] == align.SHIFT else (0.0, row["value"])
+                )
+                update_figure()
+
+            match_button.on_click(find_matches)
+            match_table.on("rowClick", show_match)
+            ui.button("Find aligned matches", icon="manage_search", on_click=match_dialog.open).props("flat")
+
+            # Saved views: the lines in view with their styles, restorable from a link
+            def view_url(token: str) -> str:
+                return "/?" + urlencode({"order": order, "view": token} if order else {"view": token})
+
+            def save_current_view():
+                name = (view_name.value or "").strip()
+                if not name:
+                    ui.notify("Please enter a name.", color="negative")
+                    return
+                token = views.save_view(name, current_view())
+                ui.navigate.history.replace(view_url(token))
+                saved_view_items.refresh()
+                save_dialog.close()
+                ui.notify(f"View '{name}' saved", color="positive")
+
+            def copy_view_link():
+                ui.navigate.history.replace(view_url(views.encode(current_view())))
+                ui.run_javascript("navigator.clipboard.writeText(window.location.href)")
+                ui.notify("Link to this view copied")
+
+            def delete_saved_view(name: str):
+                views.delete_view(name)
+                saved_view_items.refresh()
+
+            with ui.dialog() as save_dialog, ui.card().classes("w-96"):
+                ui.label("Save view").classes("text-lg font-semibold")
+                view_name = ui.input("Name").classes("w-full").on("keydown.enter", save_current_view)
+                with ui.row():
+                    ui.button("Save", on_click=save_current_view)
+                    ui.button("Cancel", on_click=save_dialog.close).props("flat")
+
+            @ui.refreshable
+            def saved_view_items():
+                stored = views.saved_views()
+                if not stored:
+                    ui.item("No saved views yet").props("disable")
+                for name, token in stored.items():
+                    with ui.item(on_click=lambda token=token: ui.navigate.to(view_url(token))):
+                        with ui.item_section():
+                            ui.item_label(name)
+                        with ui.item_section().props("side"):
+                            ui.button(icon="delete").props("flat dense round").on(
+                                "click.stop", lambda name=name: delete_saved_view(name)
+                            )
+
+            with ui.row().classes("items-center"):
+                ui.button("Save view", icon="bookmark_add", on_click=save_dialog.open).props("flat")
+                ui.button("Copy link to view", icon="link", on_click=copy_view_link).props("flat")
+                with ui.dropdown_button("Saved views", icon="bookmarks").props("flat"):
+                    saved_view_items()
+
+            # The full-text search narrows the spectrum pickers and the rotation to the matches, best match first
+            def apply_text_search():
+                query = (text_search.value or "").strip()
+                spectra = list_available_spectra()
+                names = None
+                if query:
+                    names, total = fulltext_index().search(query)
+                    text_matches.text = f"{total} match{'es' if total > 1 else ''}" if total else "No matches"
+                    if names:
+                        by_name = search_index.catalog_index().by_name
+                        spectra = [by_name[name] for name in names if name in by_name]
+                    else:
+                        names = None
+                else:
+                    text_matches.text = ""
+                app.storage.client["spectra"] = spectra
+                spectrum_select.set_scope(names)
+                rotation_select.set_scope(names)
+
+            text_search.on_value_change(lambda: apply_text_search())
+
+            # Keep this page in sync with changes made in other tabs or worker processes
+            def on_library_change(delta: library_watcher.LibraryDelta):
+                with client:
+                    if (text_search.value or "").strip():
+                        # Edits may change which spectra match
+                        apply_text_search()
+                    else:
+                        spectra = library_watcher.apply_delta(app.storage.client["spectra"], delta)
+                        app.storage.client["spectra"] = spectra
+                        spectrum_select.refresh()
+                        rotation_select.refresh()
+                    changed = {s.name: s for s in delta.changed}
+                    # A rename is reported as the removal of the old name and the addition of the same data
+                    renamed = {s.content_hash: s for s in delta.added if s.content_hash}
+                    removed = set(delta.removed)
+                    gone = []
+                    for line in all_active_lines():
+                        if line.spectrum is None:
+                            continue
+                        if line.spectrum.name in changed:
+                            line.spectrum = changed[line.spectrum.name]
+                        elif line.spectrum.name in removed:
+                            if line.spectrum.content_hash in renamed:
+                                line.spectrum = renamed[line.spectrum.content_hash]
+                            else:
+                                gone.append(line)
+                    with batched_figure_updates():
+                        if gone:
+                            remove_deleted_lines(gone)
+                        if changed or removed:
+                            update_figure()
+
+            def remove_deleted_lines(gone: list[Line]):
+                """
+                Drops the lines whose spectrum was deleted elsewhere, with the derived lines and fits built on them.
+                The selected line moves on to another spectrum, as it cannot be removed.
+                """
+                gone = {id(line) for line in gone}
+                active = app.storage.client["active_lines"]
+                while True:
+                    dependent = {
+                        id(line)
+                        for line in active
+                        if any(id(source) in gone for source in getattr(line, "inputs", []))
+                        or id(getattr(line, "source", None)) in gone
+                    }
+                    if dependent <= gone:
+                        break
+                    gone |= dependent
+                removed_lines = [line for line in active if id(line) in gone]
+                for line in removed_lines:
+                    active.remove(line)
+                    controller = app.storage.client["line_controllers"].pop(id(line), None)
+                    if controller is not None:
+                        controller.delete()
+                rotation_line = app.storage.client.get("rotation_line")
+                if rotation_line is not None and id(rotation_line) in gone:
+                    delete_rotation()
+                selected_line = app.storage.client["selected_line"]
+                if id(selected_line) in gone and app.storage.client["spectra"]:
+                    selected_line.spectrum = app.storage.client["spectra"][0]
+                    spectrum_select.value = selected_line.spectrum.name
+                if removed_lines:
+                    ui.notify(f"Removed {len(removed_lines)} lines of deleted spectra.", color="warning")
+
+            client = context.client
+            client.on_delete(library_watcher.watcher.subscribe(on_library_change))
+
+
+app.on_startup(library_watcher.watcher.start)
+app.on_startup(jobs.queue.start)
+app.on_startup(lambda: background_tasks.create(startup.warm_up(), name="warm up"))
+app.on_shutdown(library_watcher.watcher.stop)
+app.on_shutdown(jobs.queue.stop)
+app.include_router(api.router)
+
+if metrics.ENABLED:
+    metrics.Gauge(
+        "pxrd_active_clients",
+        "Number of browser tabs connected to the server.",
+        lambda: sum(1 for client in Client.instances.values() if client.has_socket_connection),
+    )
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 
+startup.timer.mark("imports")
 
 if __name__ in {"__main__", "__mp_main__"}:
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    startup.logger.setLevel(logging.INFO)
     is_production = os.environ.get("PXRD_PRODUCTION", "0") == "1"
-    ui.run(title="PXRD Viewer", favicon="📈", reload=not is_production)
+    ui.run(
+        title="PXRD Viewer",
+        favicon="📈",
+        reload=not is_production,
+        port=int(os.environ.get("PXRD_PORT", "8080")),
+    )
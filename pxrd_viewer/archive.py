@@ -0,0 +1,118 @@
+"""
+Links the .raw/.xyd files of an instrument archive into the library without copying them.
+
+    python pxrd_viewer/archive.py link /mnt/xrd-share [--tag archive] [--element Si] [--xyd-unit 2theta]
+    python pxrd_viewer/archive.py validate
+
+Only the headers are read while linking; the counts are decoded when a spectrum is first viewed. `validate` re-indexes
+spectra whose files changed and reports missing ones (the server also does this after every start).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import data_sources
+from data_sources import Spectrum
+
+ARCHIVE_SUFFIXES = (".raw", ".xyd")
+
+# Header reads on network shares wait on I/O, so threads are enough to overlap them
+SCAN_THREADS = 16
+
+
+def find_archive_files(root: Path) -> list[Path]:
+    """
+    Returns all .raw/.xyd files below `root` (any case of the suffix), sorted by path.
+    """
+    return sorted(path for path in Path(root).rglob("*") if path.suffix.lower() in ARCHIVE_SUFFIXES and path.is_file())
+
+
+def scan(
+    paths: list[Path],
+    x_unit: str = None,
+    wavelength: float = None,
+    threads: int = SCAN_THREADS,
+    progress: Callable[[int, int], None] = None,
+) -> tuple[dict[Path, dict], dict[Path, str]]:
+    """
+    Scans the headers of `paths` in parallel, see `data_sources.linked_file_meta`. `progress` is called with the
+    number of scanned and of all files; if it raises, the remaining files are not scanned.
+
+    Returns:
+        tuple[dict[Path, dict], dict[Path, str]]: The .meta data fields per readable file, and the error per other file.
+    """
+
+    def scan_one(path):
+        try:
+            return path, data_sources.linked_file_meta(path, x_unit, wavelength), None
+        except (OSError, ValueError) as e:
+            return path, None, str(e)
+
+    scanned, errors = {}, {}
+    executor = ThreadPoolExecutor(threads)
+    try:
+        for i, (path, meta, error) in enumerate(executor.map(scan_one, paths)):
+            if error is None:
+                scanned[path] = meta
+            else:
+                errors[path] = error
+            if progress is not None:
+                progress(i + 1, len(paths))
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return scanned, errors
+
+
+def link_directory(
+    root: Path,
+    contained_elements: set[str] = (),
+    tags: list[str] = (),
+    x_unit: str = None,
+    wavelength: float = None,
+    threads: int = SCAN_THREADS,
+    progress: Callable[[int, int], None] = None,
+) -> tuple[list[Spectrum], dict[Path, str]]:
+    """
+    Links every .raw/.xyd file below `root` that is not linked yet. `progress` is called with the number of
+    scanned and of all files.
+
+    Returns:
+        tuple[list[Spectrum], dict[Path, str]]: The new spectra, and why each other file was skipped.
+    """
+    paths = find_archive_files(root)
+    scanned, errors = scan(paths, x_unit, wavelength, threads, progress)
+    spectra, skipped = data_sources.link_spectra(
+        list(scanned), contained_elements, tags, x_unit=x_unit, wavelength=wavelength, scanned=scanned
+    )
+    return spectra, {**errors, **skipped}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import units
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    link = commands.add_parser("link", help="Link all .raw/.xyd files below a directory")
+    link.add_argument("root", type=Path)
+    link.add_argument("--tag", action="append", default=[], help="Tag of all linked spectra (repeatable)")
+    link.add_argument("--element", action="append", default=[], help="Contained element (repeatable)")
+    link.add_argument("--xyd-unit", choices=units.UNITS, default=units.TWO_THETA, help="x axis of .xyd files")
+    link.add_argument("--wavelength", type=float, default=units.CU_K_ALPHA, help="Wavelength (Å) of .xyd files")
+    link.add_argument("--threads", type=int, default=SCAN_THREADS, help="Parallel header reads")
+    commands.add_parser("validate", help="Re-index changed files and report missing ones")
+    args = parser.parse_args()
+
+    if args.command == "link":
+        spectra, skipped = link_directory(
+            args.root, set(args.element), args.tag, args.xyd_unit, args.wavelength, args.threads
+        )
+        print(f"Linked {len(spectra)} spectra, skipped {len(skipped)} files.")
+        for path, reason in skipped.items():
+            print(f"  {path}: {reason}")
+    else:
+        report = data_sources.validate_linked_spectra()
+        for state, names in report.items():
+            print(f"{len(names)} {state}" + (": " + ", ".join(names) if names else ""))
@@ -0,0 +1,145 @@
+"""
+Lossless storage of the integer detector counts of .raw measurements.
+
+Spectra imported from .raw files keep their counts (int16 for POLY II, int32 for Powdat) instead of only the
+normalized float32 intensities, so absolute intensities and the counting statistics of every point (Poisson,
+σ = √counts) survive the import. The normalized arrays are derived on read, bit for bit equal to those of
+`data_sources.raw_info_to_normalized_numpy`, so content hashes do not depend on how a spectrum is stored.
+
+Encoding of the counts:
+    1. delta: neighbouring counts differ much less than they are large
+    2. zig-zag: maps the signed deltas to unsigned integers, small magnitudes to small numbers
+    3. the narrowest unsigned width that holds all deltas, with the byte planes transposed (all low bytes, then all
+       high bytes), which deflate compresses far better than interleaved bytes
+    4. zlib at level 1, the fastest level; higher levels save a few percent at several times the cost
+
+A stored spectrum is an uncompressed .npz holding `counts` (the encoded bytes, see HEADER) and `axis`
+(start and end angle 2θ in degrees and the wavelength in Å), about an eighth of the size of the compressed float
+arrays. See `bench_counts_codec` in benchmarks/run_benchmarks.py.
+"""
+
+import struct
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+# Magic, item size of the counts (2 or 4 bytes), item size of the stored deltas and number of points
+HEADER = struct.Struct("<4sBBI")
+MAGIC = b"PXC1"
+COMPRESS_LEVEL = 1
+
+COUNT_DTYPES = {2: "<i2", 4: "<i4"}
+_DELTA_DTYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+
+def encode(counts: np.ndarray) -> bytes:
+    """
+    Encodes int16 or int32 counts losslessly, see the module docstring.
+
+    Raises:
+        ValueError: If `counts` is not a 1-D int16 or int32 array.
+    """
+    counts = np.asarray(counts)
+    if counts.ndim != 1 or counts.dtype.kind != "i" or counts.dtype.itemsize not in COUNT_DTYPES:
+        raise ValueError(f"Expected 1-D int16 or int32 counts, got {counts.dtype} of shape {counts.shape}.")
+    deltas = np.diff(counts.astype(np.int64), prepend=0)
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).view(np.uint64)
+    largest = int(zigzag.max()) if len(zigzag) else 0
+    delta_dtype = next(dtype for dtype in _DELTA_DTYPES if largest <= np.iinfo(dtype).max)
+    delta_size = np.dtype(delta_dtype).itemsize
+    planes = zigzag.astype(f"<u{delta_size}").view(np.uint8).reshape(-1, delta_size).T
+    header = HEADER.pack(MAGIC, counts.dtype.itemsize, delta_size, len(counts))
+    return header + zlib.compress(planes.tobytes(), COMPRESS_LEVEL)
+
+
+def decode(data: bytes) -> np.ndarray:
+    """
+    Decodes the counts written by `encode`, in their original dtype.
+
+    Raises:
+        ValueError: If `data` is not an encoding of counts or is corrupt.
+    """
+    data = bytes(data)
+    if len(data) < HEADER.size:
+        raise ValueError("The encoded counts are truncated.")
+    magic, count_size, delta_size, points = HEADER.unpack_from(data)
+    if magic != MAGIC or count_size not in COUNT_DTYPES or delta_size not in (1, 2, 4, 8):
+        raise ValueError("The data is not an encoding of detector counts.")
+    try:
+        planes = zlib.decompress(data[HEADER.size :])
+    except zlib.error as e:
+        raise ValueError(f"The encoded counts are corrupt: {e}")
+    if len(planes) != points * delta_size:
+        raise ValueError(f"The encoded counts hold {len(planes)} bytes, expected {points * delta_size}.")
+    zigzag = np.frombuffer(planes, dtype=np.uint8).reshape(delta_size, points).T.copy()
+    zigzag = zigzag.view(f"<u{delta_size}").ravel().astype(np.int64)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    return np.cumsum(deltas).astype(COUNT_DTYPES[count_size])
+
+
+def q_axis(theta_start: float, theta_end: float, points: int, wavelength: float) -> np.ndarray:
+    """
+    Returns the Q axis (Å⁻¹) of a scan of `points` equidistant steps from `theta_start` to `theta_end` (2θ, degrees).
+    """
+    two_theta = np.linspace(theta_start, theta_end, points)
+    return (4 * np.pi / wavelength) * np.sin(np.radians(two_theta) / 2)
+
+
+def normalize(counts: np.ndarray) -> np.ndarray:
+    """
+    Scales counts to a maximum of 1.0 as float32, the intensities the viewer works with.
+    """
+    y = np.array(counts, dtype=np.float32)
+    y /= np.max(y)
+    return y
+
+
+@dataclass
+class RawCounts:
+    """
+    The counts of a .raw measurement and the scan they were measured on.
+    """
+
+    counts: np.ndarray
+    theta_start: float
+    theta_end: float
+    wavelength: float
+
+    def x(self) -> np.ndarray:
+        return q_axis(self.theta_start, self.theta_end, len(self.counts), self.wavelength)
+
+    def y(self) -> np.ndarray:
+        return normalize(self.counts)
+
+    def to_xy(self) -> tuple[np.ndarray, np.ndarray]:
+        return self.x(), self.y()
+
+    def sigma(self) -> np.ndarray:
+        """
+        Returns the standard deviation of every point of `y` from the counting statistics (√counts, normalized
+        like the intensities), for error bars.
+        """
+        counts = np.maximum(self.counts, 0).astype(np.float32)
+        return np.sqrt(counts) / np.float32(np.max(self.counts))
+
+    def save(self, file) -> None:
+        """
+        Writes the counts as an .npz file (path or binary file object), see the module docstring.
+        """
+        axis = np.array([self.theta_start, self.theta_end, self.wavelength], dtype=np.float64)
+        np.savez(file, counts=np.frombuffer(encode(self.counts), dtype=np.uint8), axis=axis)
+
+    @staticmethod
+    def from_npz(data) -> "RawCounts":
+        """
+        Reads the counts from an opened .npz written by `save`.
+
+        Raises:
+            ValueError: If the counts or the axis are corrupt.
+        """
+        axis = data["axis"]
+        if axis.shape != (3,):
+            raise ValueError(f"The scan axis has the shape {axis.shape}, expected (3,).")
+        theta_start, theta_end, wavelength = (float(value) for value in axis)
+        return RawCounts(decode(data["counts"]), theta_start, theta_end, wavelength)
@@ -1,17 +1,75 @@
 from pathlib import Path
+import contextlib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
 import struct
+import tempfile
+import threading
+from typing import Callable
 import numpy as np
 import io
 import yaml
-import functools
 
-DATA_DIR = Path(__file__).parent / "spectra"
-DATA_DIR.mkdir(exist_ok=True)
+import counts_codec
+import fulltext
+import metrics
+import thumbnails
+import units
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process mode only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Created on the first write, see library_lock; importing this module has no side effects.
+# PXRD_DATA_DIR points the app at another library, e.g. a synthetic one for load tests.
+DATA_DIR = Path(os.environ.get("PXRD_DATA_DIR") or Path(__file__).parent / "spectra")
+
+# Bookkeeping files shared by all worker processes using the same DATA_DIR.
+LOCK_FILE_NAME = ".lock"
+GENERATION_FILE_NAME = ".generation"
+HASH_INDEX_FILE_NAME = ".hash_index.json"
+# Version 2 lists every spectrum with a hash instead of only the newest one
+HASH_INDEX_VERSION = 2
+THUMBNAIL_DIR_NAME = ".thumbnails"
+
+
+class DuplicateSpectrumError(FileExistsError):
+    """
+    Raised when a new spectrum has the same content as a spectrum that is already in the library.
+    """
+
+    def __init__(self, name: str, existing_name: str):
+        super().__init__(f"Spectrum '{name}' is a duplicate of the existing spectrum '{existing_name}'.")
+        self.name = name
+        self.existing_name = existing_name
+
+
+class LinkedFileChangedError(ValueError):
+    """
+    Raised when the archive file of a linked spectrum changed since it was indexed. `validate_linked_spectra`
+    re-indexes it.
+    """
+
+    def __init__(self, name: str, path: Path):
+        super().__init__(f"The file {path} of spectrum '{name}' changed since it was linked; please re-validate.")
+        self.name = name
+        self.path = path
 
 
 class Spectrum:
     """
     Represents a measured spectrum.
+
+    The data of a spectrum is a .npz file in DATA_DIR (the x/y arrays, or for .raw imports the detector counts, see
+    `counts_codec`), or, for spectra linked from an instrument archive, the original .raw/.xyd file, which is
+    decoded on first access.
     """
 
     def __init__(
@@ -22,6 +80,12 @@ class Spectrum:
         tags: list[str] = None,
         description: str = "",
         display_name: str = None,
+        content_hash: str = None,
+        raw_hash: str = None,
+        x_unit: str = units.Q,
+        wavelength: float = None,
+        linked: bool = False,
+        source_stat: tuple[int, int] = None,
     ):
         self.name = name
         self.source_file = source_file
@@ -34,6 +98,14 @@ class Spectrum:
         self.tags = tags if tags is not None else []
         self.description = description
         self.display_name = display_name
+        self.content_hash = content_hash
+        self.raw_hash = raw_hash
+        self.x_unit = x_unit
+        self.wavelength = wavelength
+        self.linked = linked
+        # Size and modification time (ns) of a linked file when it was indexed
+        self.source_stat = source_stat
+        self._converted_x = {}
 
     @staticmethod
     def from_meta(meta: dict, meta_file: Path) -> "Spectrum":
@@ -53,15 +125,59 @@ class Spectrum:
             tags=tags,
             description=description,
             display_name=display_name,
+            content_hash=meta.get("content_hash", None),
+            raw_hash=meta.get("raw_hash", None),
+            # Spectra saved before the unit was recorded were imported as Q
+            x_unit=meta.get("x_unit", units.Q),
+            wavelength=meta.get("wavelength", None),
+            linked=meta.get("linked", False),
+            source_stat=(meta["source_size"], meta["source_mtime_ns"]) if meta.get("linked") else None,
         )
 
+    @metrics.timed(metrics.SPECTRUM_LOAD_SECONDS)
     def _load_data(self):
         """
         Loads the spectrum data from the source file.
         """
-        data = np.load(self.source_file)
-        self._x = data["x"]
-        self._y = data["y"]
+        self._x, self._y = self._read_source()
+
+    def _read_source(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.linked:
+            return read_linked_file(self)
+        return read_npz(self.source_file)
+
+    def check_source(self) -> None:
+        """
+        Checks that the data of the spectrum can be read, without reading it (a stat of its file).
+
+        Raises:
+            FileNotFoundError: If the data file does not exist.
+            LinkedFileChangedError: If the archive file of a linked spectrum changed since it was indexed.
+        """
+        if self.linked:
+            _check_linked_file(self)
+        elif not self.source_file.exists():
+            raise FileNotFoundError(f"The data file {self.source_file} of spectrum '{self.name}' does not exist.")
+
+    def read_counts(self) -> counts_codec.RawCounts | None:
+        """
+        Returns the detector counts of a spectrum imported or linked from a .raw file, e.g. for error bars.
+        Spectra from .xyd files, and those saved before the counts were kept, only have normalized intensities
+        and return None.
+        """
+        if self.linked:
+            return read_linked_counts(self)
+        with np.load(self.source_file) as data:
+            return counts_codec.RawCounts.from_npz(data) if "counts" in data.files else None
+
+    def read_data(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the x/y arrays without keeping them on the instance, for one-off reads such as API requests
+        that would otherwise pin the arrays of the whole library in memory. Already loaded arrays are reused.
+        """
+        if hasattr(self, "_x"):
+            return self._x, self._y
+        return self._read_source()
 
     @property
     def x(self):
@@ -69,12 +185,35 @@ class Spectrum:
             self._load_data()
         return self._x
 
+    def x_in(self, unit: str, wavelength: float = None) -> np.ndarray:
+        """
+        Returns the x axis converted to `unit`, computed on first use and cached per (unit, wavelength).
+        `wavelength` (Å) is the wavelength of the view and only matters for 2θ.
+
+        Raises:
+            ValueError: If the conversion needs the wavelength of the measurement and it is unknown.
+        """
+        if unit != units.TWO_THETA:
+            wavelength = None
+        key = (unit, wavelength)
+        if key not in self._converted_x:
+            self._converted_x[key] = units.convert(self.x, self.x_unit, self.wavelength, unit, wavelength)
+        return self._converted_x[key]
+
     @property
     def y(self):
         if not hasattr(self, "_y"):
             self._load_data()
         return self._y
 
+    def __getstate__(self):
+        # Spectra sent to worker processes carry only their metadata; the arrays are read again where needed
+        state = self.__dict__.copy()
+        state.pop("_x", None)
+        state.pop("_y", None)
+        state["_converted_x"] = {}
+        return state
+
     def __eq__(self, value):
         if not isinstance(value, Spectrum):
             return False
@@ -216,11 +355,17 @@ def load_xyd_file(uploaded_file: io.BytesIO) -> tuple[np.ndarray, np.ndarray]:
     return x, y
 
 
-def read_raw_file(data_source: io.BytesIO) -> dict:
-    data = data_source.read()
+RAW_MACHINES = ("POLY II", "Powdat")
+
+
+def _parse_raw_header(data) -> dict:
+    """
+    Parses the file header and the DataInfo block of a .raw file from a bytes-like object (bytes or an mmap),
+    without touching the counts after it.
+    """
 
     def read_str(offset, length):
-        return data[offset : offset + length].decode("ascii", errors="ignore").rstrip("\x00")
+        return bytes(data[offset : offset + length]).decode("ascii", errors="ignore").rstrip("\x00")
 
     def read_u16(offset):
         return struct.unpack_from("<H", data, offset)[0]
@@ -228,12 +373,6 @@ def read_raw_file(data_source: io.BytesIO) -> dict:
     def read_u32(offset):
         return struct.unpack_from("<I", data, offset)[0]
 
-    def read_s16_array(offset, count):
-        return struct.unpack_from(f"<{count}h", data, offset)
-
-    def read_s32_array(offset, count):
-        return struct.unpack_from(f"<{count}i", data, offset)
-
     def read_float(offset):
         return struct.unpack_from("<f", data, offset)[0]
 
@@ -250,7 +389,7 @@ def read_raw_file(data_source: io.BytesIO) -> dict:
         "radiation_false": read_float(0x146),
     }
 
-    if result["machine"] not in ["POLY II", "Powdat"]:
+    if result["machine"] not in RAW_MACHINES:
         raise ValueError(f"Unsupported machine type. Got {result['machine']}, expected 'POLY II' or 'Powdat'.")
     # DataInfo struct at 0x600 for POLY II, 0x800 for Powdat
     info_offset = 0x600 if result["machine"] == "POLY II" else 0x800
@@ -263,21 +402,66 @@ def read_raw_file(data_source: io.BytesIO) -> dict:
     result["time_per_step"] = read_float(info_offset + 0x44)
     result["min_cnt"] = read_u32(info_offset + 0x78)
     result["max_cnt"] = read_u32(info_offset + 0x7C)
+    result["data_offset"] = info_offset + 0x200
+    result["data_type"] = "<i2" if result["machine"] == "POLY II" else "<i4"
+    return result
+
 
-    data_offset = info_offset + 0x200
+def read_raw_file(data_source: io.BytesIO) -> dict:
+    data = data_source.read()
+    result = _parse_raw_header(data)
+    count = result["num_points"]
     if result["machine"] == "POLY II":
-        result["data"] = read_s16_array(data_offset, result["num_points"])
+        result["data"] = struct.unpack_from(f"<{count}h", data, result["data_offset"])
     elif result["machine"] == "Powdat":
-        result["data"] = read_s32_array(data_offset, result["num_points"])
+        result["data"] = struct.unpack_from(f"<{count}i", data, result["data_offset"])
     return result
 
 
+def read_raw_header(path: Path) -> dict:
+    """
+    Reads only the header of a .raw file on disk: the file is memory mapped, so just the pages up to the DataInfo
+    block are read, which keeps scans of large archives on network shares cheap.
+
+    Raises:
+        ValueError: If the file is not a supported .raw file or is shorter than its header says.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 0x800:
+            raise ValueError(f"{path} is too short for a .raw file.")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header = _parse_raw_header(data)
+    end = header["data_offset"] + header["num_points"] * np.dtype(header["data_type"]).itemsize
+    if size < end:
+        raise ValueError(f"{path} is truncated: {size} bytes, but its header describes {end}.")
+    return header
+
+
+def load_raw_counts(path: Path) -> counts_codec.RawCounts:
+    """
+    Reads the counts of a .raw file on disk in their original integer type, straight from a memory map.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        info = _parse_raw_header(data)
+        # A copy, so no view of the map outlives it
+        counts = np.frombuffer(
+            data, dtype=info["data_type"], count=info["num_points"], offset=info["data_offset"]
+        ).copy()
+    return counts_codec.RawCounts(counts, info["theta_start"], info["theta_end"], info["radiation"])
+
+
+def load_raw_path(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes a .raw file on disk like `load_raw_file`, reading the counts straight from a memory map.
+    """
+    return load_raw_counts(path).to_xy()
+
+
 def raw_info_to_normalized_numpy(info):
-    x = np.linspace(info["theta_start"], info["theta_end"], info["num_points"])
-    x = (4 * np.pi / info["radiation"]) * np.sin(np.radians(x) / 2)  # Convert to Q
-    y = np.array(info["data"], dtype=np.float32)
-    y /= np.max(y)  # Normalize to max of 1.0
-    return x, y
+    # Converted to Q and normalized to a maximum of 1.0, like stored counts on read
+    x = counts_codec.q_axis(info["theta_start"], info["theta_end"], info["num_points"], info["radiation"])
+    return x, counts_codec.normalize(info["data"])
 
 
 def load_raw_file(uploaded_file: io.BytesIO) -> tuple[np.ndarray, np.ndarray]:
@@ -286,25 +470,464 @@ def load_raw_file(uploaded_file: io.BytesIO) -> tuple[np.ndarray, np.ndarray]:
     return x, y
 
 
-@functools.cache
-def list_available_spectra() -> list[Spectrum]:
+def load_spectrum_file(path: Path) -> tuple[np.ndarray, np.ndarray]:
     """
-    Lists all available spectra.
+    Parses a .raw or .xyd file from disk. Module level, so it can run in a worker process.
+    """
+    return parse_spectrum_file(path)[:2]
 
-    Returns:
-        list[Spectrum]: A list of Spectrum objects representing available spectra.
+
+def parse_spectrum_file(path: Path) -> tuple[np.ndarray, np.ndarray, counts_codec.RawCounts | None]:
+    """
+    Parses a .raw or .xyd file from disk like `load_spectrum_file`, also returning the counts of a .raw file
+    (None for .xyd files) for `save_new_spectra` to keep. Module level, so it can run in a worker process.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".raw":
+        raw_counts = load_raw_counts(path)
+        return *raw_counts.to_xy(), raw_counts
+    if path.suffix.lower() == ".xyd":
+        with open(path, "rb") as f:
+            return *load_xyd_file(f), None
+    raise ValueError("Unsupported file format")
+
+
+def read_npz(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the x/y arrays of a stored spectrum: saved as arrays, or as counts that are normalized here.
+
+    Raises:
+        ValueError: If the stored counts are corrupt.
+    """
+    with np.load(path) as data:
+        if "counts" in data.files:
+            return counts_codec.RawCounts.from_npz(data).to_xy()
+        return data["x"], data["y"]
+
+
+def read_npz_x(path: Path) -> np.ndarray:
+    """
+    Reads only the x array of a stored spectrum, without decoding its intensities.
     """
+    with np.load(path) as data:
+        if "counts" in data.files:
+            theta_start, theta_end, wavelength = data["axis"]
+            points = counts_codec.HEADER.unpack_from(data["counts"])[3]
+            return counts_codec.q_axis(float(theta_start), float(theta_end), points, float(wavelength))
+        return data["x"]
+
+
+def _data_writer(x: np.ndarray, y: np.ndarray, raw_counts: counts_codec.RawCounts | None) -> Callable:
+    if raw_counts is not None:
+        return raw_counts.save
+    return lambda f: np.savez_compressed(f, x=x, y=y)
+
+
+def spectrum_file_axis(path: Path) -> tuple[str | None, float | None]:
+    """
+    Returns the x unit and wavelength (Å) of the data `load_spectrum_file` returns for `path`.
+    .raw files are converted to Q and record their wavelength; .xyd files carry neither, so (None, None) is returned.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".raw":
+        with open(path, "rb") as f:
+            header = f.read(0x14A)
+        return units.Q, round(struct.unpack_from("<f", header, 0x142)[0], 6)
+    return None, None
+
+
+def content_hash(x: np.ndarray, y: np.ndarray) -> str:
+    """
+    Hashes the normalized x/y arrays of a spectrum. Both arrays are compared at float32 precision,
+    so the same measurement hashes equally whether it was parsed to float32 or float64.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for array in (x, y):
+        h.update(np.ascontiguousarray(array, dtype="<f4").tobytes())
+    return h.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """
+    Hashes the raw bytes of an uploaded file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_lock_state = threading.local()
+
+
+@contextlib.contextmanager
+def library_lock():
+    """
+    Exclusive lock around mutations of DATA_DIR, shared by all processes and threads.
+
+    The lock is reentrant within a thread, so batch operations may call the single-spectrum helpers.
+    """
+    depth = getattr(_lock_state, "depth", 0)
+    if depth > 0:
+        _lock_state.depth = depth + 1
+        try:
+            yield
+        finally:
+            _lock_state.depth -= 1
+        return
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(DATA_DIR / LOCK_FILE_NAME, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_state.depth = 1
+        try:
+            yield
+        finally:
+            _lock_state.depth = 0
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _stage_write(path: Path, write, mode: str = "w") -> str:
+    """
+    Writes the content for `path` into a temporary file next to it and returns the temporary file name.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_name)
+        raise
+    return tmp_name
+
+
+def _atomic_write(path: Path, write, mode: str = "w") -> None:
+    """
+    Writes a file via a temporary file in the same directory followed by a rename,
+    so readers in other processes never see a partially written file.
+    """
+    tmp_name = _stage_write(path, write, mode)
+    try:
+        os.replace(tmp_name, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_name)
+        raise
+
+
+def _write_meta(meta_file: Path, meta_data: dict) -> None:
+    _atomic_write(meta_file, lambda f: yaml.dump(meta_data, f))
+
+
+def read_generation() -> int:
+    """
+    Returns the library generation, a counter that is incremented by every mutation of DATA_DIR.
+
+    Reading it is cheap, so every process can poll it to notice changes made by other workers.
+    """
+    try:
+        return int((DATA_DIR / GENERATION_FILE_NAME).read_text() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _bump_generation() -> int:
+    """
+    Increments the library generation, invalidating the catalog cache of every process.
+    """
+    with library_lock():
+        generation = read_generation() + 1
+        _atomic_write(DATA_DIR / GENERATION_FILE_NAME, lambda f: f.write(str(generation)))
+    _catalog_cache["generation"] = None
+    return generation
+
+
+_catalog_cache = {"generation": None, "spectra": []}
+
+
+def read_meta(meta_file: Path) -> dict:
+    """
+    Reads and parses a .meta file.
+
+    Raises:
+        ValueError: If the file is not valid YAML or lacks the 'name' or 'source_file' field.
+    """
+    with open(meta_file, "r") as f:
+        try:
+            meta = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Meta file {meta_file} is not valid YAML: {e}") from e
+    if not isinstance(meta, dict):
+        raise ValueError(f"Meta file {meta_file} does not hold a mapping.")
+    for field in ("name", "source_file"):
+        if field not in meta:
+            raise ValueError(f"Meta file {meta_file} is missing the '{field}' field.")
+    return meta
+
+
+def load_spectrum(meta_file: Path) -> Spectrum:
+    """
+    Loads a single spectrum from its .meta file.
+
+    Raises:
+        ValueError: If the .meta file is malformed, see `read_meta`.
+        FileNotFoundError: If the .meta file or the data file it points to does not exist.
+    """
+    return Spectrum.from_meta(read_meta(meta_file), meta_file)
+
+
+def _scan_spectra() -> list[Spectrum]:
     spectra = []
     for meta_file in DATA_DIR.glob("*.meta"):
-        with open(meta_file, "r") as f:
-            meta = yaml.safe_load(f)
-        assert "name" in meta, f"Meta file {meta_file} is missing 'name' field."
-        assert "source_file" in meta, f"Meta file {meta_file} is missing 'source_file' field."
-        spectrum = Spectrum.from_meta(meta, meta_file)
+        try:
+            spectrum = load_spectrum(meta_file)
+        except (OSError, ValueError) as e:
+            # Deleted or renamed by another process while we were scanning
+            if not meta_file.exists():
+                continue
+            # A broken entry must not hide the rest of the library; `integrity.py` reports and quarantines it
+            logger.warning("Skipping spectrum %s: %s", meta_file.name, e)
+            continue
         spectra.append(spectrum)
     return spectra
 
 
+@metrics.timed(metrics.CATALOG_LIST_SECONDS)
+def list_available_spectra() -> list[Spectrum]:
+    """
+    Lists all available spectra.
+
+    The result is cached per library generation, so changes made by other processes are picked up
+    on the next call.
+
+    Returns:
+        list[Spectrum]: A list of Spectrum objects representing available spectra.
+    """
+    generation = read_generation()
+    if _catalog_cache["generation"] != generation:
+        metrics.CATALOG_CACHE_REQUESTS.inc(result="miss")
+        _catalog_cache["spectra"] = _scan_spectra()
+        _catalog_cache["generation"] = generation
+    else:
+        metrics.CATALOG_CACHE_REQUESTS.inc(result="hit")
+    return _catalog_cache["spectra"]
+
+
+_fulltext_cache = {"generation": None, "index": None}
+
+
+def fulltext_index() -> fulltext.TextIndex:
+    """
+    Returns the full-text index over names, display names, tags and descriptions of the library.
+
+    It is built from the catalog on first use and whenever another process changed the library; the saves, edits
+    and deletes of this process update it in place.
+    """
+    generation = read_generation()
+    if _fulltext_cache["generation"] != generation:
+        _fulltext_cache["index"] = fulltext.TextIndex(list_available_spectra())
+        _fulltext_cache["generation"] = generation
+    return _fulltext_cache["index"]
+
+
+def _update_fulltext_index(generation: int, added: list[Spectrum] = (), removed: list[str] = ()) -> None:
+    """
+    Applies a mutation to the full-text index of this process, if it is built and was current before the mutation.
+    Must be called while holding the library lock, with the generation the mutation was published as.
+    """
+    if _fulltext_cache["index"] is not None and _fulltext_cache["generation"] == generation - 1:
+        _fulltext_cache["index"].update(added=added, removed=removed)
+        _fulltext_cache["generation"] = generation
+
+
+_hash_index_cache = {"key": None, "index": None}
+
+
+def _read_hash_index() -> dict | None:
+    path = DATA_DIR / HASH_INDEX_FILE_NAME
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _hash_index_cache["key"] != key:
+        with open(path, "r") as f:
+            _hash_index_cache["index"] = json.load(f)
+        _hash_index_cache["key"] = key
+    if _hash_index_cache["index"].get("version") != HASH_INDEX_VERSION:
+        return None  # written by an older version, rebuilt on first use
+    return _hash_index_cache["index"]
+
+
+def _write_hash_index(index: dict) -> None:
+    _atomic_write(DATA_DIR / HASH_INDEX_FILE_NAME, lambda f: json.dump(index, f))
+
+
+def rebuild_hash_index() -> dict:
+    """
+    Rebuilds the hash index from the .meta files, hashing the arrays of spectra saved before hashes were recorded.
+
+    Returns:
+        dict: The index, mapping content hashes (key "content") and raw file hashes (key "raw") to the names of all
+            spectra with that hash, as duplicates can be saved on purpose.
+    """
+    with library_lock():
+        index = {"version": HASH_INDEX_VERSION, "content": {}, "raw": {}}
+        for spectrum in _scan_spectra():
+            h = spectrum.content_hash or content_hash(spectrum.x, spectrum.y)
+            index["content"].setdefault(h, []).append(spectrum.name)
+            if spectrum.raw_hash:
+                index["raw"].setdefault(spectrum.raw_hash, []).append(spectrum.name)
+        _write_hash_index(index)
+    return index
+
+
+def hash_index() -> dict:
+    """
+    Returns the hash index of the library, building it on first use. It is kept on disk and updated by every
+    save, edit and delete, so lookups never need to rescan the library.
+    """
+    index = _read_hash_index()
+    if index is None:
+        with library_lock():
+            index = _read_hash_index() or rebuild_hash_index()
+    return index
+
+
+def _update_hash_index(added: list[Spectrum] = (), removed: list[str] = (), renamed: dict[str, str] = None) -> None:
+    """
+    Applies a mutation to the hash index. Must be called while holding the library lock.
+    """
+    index = hash_index()
+    renamed = renamed or {}
+    removed = set(removed)
+    updated = {"version": HASH_INDEX_VERSION}
+    for kind in ("content", "raw"):
+        updated[kind] = {}
+        for h, names in index.get(kind, {}).items():
+            # Removing one copy of a duplicate keeps the hash for the others
+            names = [renamed.get(name, name) for name in names if name not in removed]
+            if names:
+                updated[kind][h] = names
+    for spectrum in added:
+        for kind, h in (("content", spectrum.content_hash), ("raw", spectrum.raw_hash)):
+            if h and spectrum.name not in updated[kind].setdefault(h, []):
+                updated[kind][h].append(spectrum.name)
+    _write_hash_index(updated)
+
+
+def find_duplicate(x: np.ndarray = None, y: np.ndarray = None, raw_hash: str = None) -> str | None:
+    """
+    Looks up whether a spectrum with the same raw file or the same x/y content is already in the library.
+
+    Returns:
+        str | None: The name of the existing spectrum, or None.
+    """
+    index = hash_index()
+    if raw_hash is not None and raw_hash in index["raw"]:
+        return index["raw"][raw_hash][0]
+    if x is not None and y is not None:
+        return index["content"].get(content_hash(x, y), [None])[0]
+    return None
+
+
+def thumbnail_file(content_hash: str) -> Path:
+    """
+    Returns the path of the thumbnail of the spectrum data with the given content hash.
+    """
+    return DATA_DIR / THUMBNAIL_DIR_NAME / f"{content_hash}.svg"
+
+
+def write_thumbnail(content_hash: str, x: np.ndarray, y: np.ndarray) -> Path:
+    """
+    Renders and stores the thumbnail of a spectrum, unless it already exists. Thumbnails are addressed by content,
+    so spectra with the same data share one file.
+    """
+    path = thumbnail_file(content_hash)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(path, lambda f: f.write(thumbnails.render_svg(x, y)))
+    return path
+
+
+def backfill_thumbnails(prune: bool = True, progress: Callable[[int, int], None] = None) -> tuple[int, int]:
+    """
+    Creates the missing thumbnails of the library, e.g. of spectra saved before thumbnails existed. Only the arrays
+    of spectra without a thumbnail are read.
+
+    Args:
+        prune (bool, optional): Whether to remove the thumbnails that no spectrum in the library uses anymore.
+        progress (Callable[[int, int], None], optional): Called with the number of checked and of all spectra.
+
+    Returns:
+        tuple[int, int]: The number of created and removed thumbnails.
+    """
+    hashes = {name: h for h, names in hash_index()["content"].items() for name in names}
+    created = 0
+    spectra = list_available_spectra()
+    for i, spectrum in enumerate(spectra):
+        if progress is not None:
+            progress(i, len(spectra))
+        h = spectrum.content_hash or hashes.get(spectrum.name)
+        # Thumbnails of linked spectra are rendered on request, so a backfill never decodes a whole archive
+        if h is not None and (spectrum.linked or thumbnail_file(h).exists()):
+            continue
+        x, y = spectrum.read_data()
+        write_thumbnail(h or content_hash(x, y), x, y)
+        created += 1
+    removed = 0
+    if prune and (DATA_DIR / THUMBNAIL_DIR_NAME).exists():
+        # Saves write the thumbnail and update the hash index under the lock, so the index knows every used one
+        with library_lock():
+            used = set(hash_index()["content"])
+            for path in (DATA_DIR / THUMBNAIL_DIR_NAME).glob("*.svg"):
+                if path.stem not in used:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+    return created, removed
+
+
+def _check_axis(x_unit: str, wavelength: float | None):
+    if x_unit not in units.UNITS:
+        raise ValueError(f"Unknown x unit '{x_unit}', expected one of {', '.join(units.UNITS)}.")
+    if x_unit == units.TWO_THETA and not wavelength:
+        raise ValueError("Spectra measured in 2θ need a wavelength.")
+
+
+def _new_meta(
+    name: str,
+    source_file: Path,
+    contained_elements,
+    tags,
+    description,
+    display_name,
+    x,
+    y,
+    raw_hash,
+    x_unit=units.Q,
+    wavelength=None,
+) -> dict:
+    _check_axis(x_unit, wavelength)
+    meta_data = {
+        "name": name,
+        "source_file": source_file.name,
+        "contained_elements": list(contained_elements),
+        "tags": tags,
+        "description": description,
+        "display_name": display_name,
+        "content_hash": content_hash(x, y),
+        "x_unit": x_unit,
+        "wavelength": float(wavelength) if wavelength else None,
+    }
+    if raw_hash is not None:
+        meta_data["raw_hash"] = raw_hash
+    return meta_data
+
+
+@metrics.timed(metrics.SAVE_SPECTRUM_SECONDS)
 def save_new_spectrum(
     name: str,
     uploaded_file: io.BytesIO,
@@ -312,32 +935,348 @@ def save_new_spectrum(
     tags: list[str],
     description: str = "",
     display_name: str = None,
+    raw_hash: str = None,
+    allow_duplicates: bool = False,
+    x_unit: str = units.Q,
+    wavelength: float = None,
+    raw_counts: counts_codec.RawCounts = None,
 ) -> Spectrum:
     source_file = DATA_DIR / f"{name}.npz"
-    if source_file.exists():
-        raise FileExistsError(f"Spectrum with name '{name}' already exists.")
-    x, y = uploaded_file
-    np.savez_compressed(source_file, x=x, y=y)
     meta_file = DATA_DIR / f"{name}.meta"
-    meta_data = {
-        "name": name,
-        "source_file": source_file.name,
-        "contained_elements": list(contained_elements),
-        "tags": tags,
+    x, y = uploaded_file
+    meta_data = _new_meta(
+        name, source_file, contained_elements, tags, description, display_name, x, y, raw_hash, x_unit, wavelength
+    )
+    with library_lock():
+        if source_file.exists() or meta_file.exists():
+            raise FileExistsError(f"Spectrum with name '{name}' already exists.")
+        if not allow_duplicates and (existing := find_duplicate(x, y, raw_hash)):
+            raise DuplicateSpectrumError(name, existing)
+        # The .meta file makes the spectrum visible, so it is written last.
+        _atomic_write(source_file, _data_writer(x, y, raw_counts), mode="wb")
+        write_thumbnail(meta_data["content_hash"], x, y)
+        _write_meta(meta_file, meta_data)
+        spectrum = Spectrum.from_meta(meta_data, meta_file)
+        _update_hash_index(added=[spectrum])
+        _update_fulltext_index(_bump_generation(), added=[spectrum])
+    return spectrum
+
+
+@metrics.timed(metrics.SAVE_SPECTRA_SECONDS)
+def save_new_spectra(
+    uploads: dict[str, tuple[np.ndarray, np.ndarray]],
+    contained_elements: set[str],
+    tags: list[str],
+    description: str = "",
+    display_names: dict[str, str] = None,
+    raw_hashes: dict[str, str] = None,
+    allow_duplicates: bool = False,
+    x_units: dict[str, str] = None,
+    wavelengths: dict[str, float] = None,
+    write_thumbnails: bool = True,
+    raw_counts: dict[str, counts_codec.RawCounts] = None,
+    elements: dict[str, set[str]] = None,
+    descriptions: dict[str, str] = None,
+) -> list[Spectrum]:
+    """
+    Saves several spectra with shared metadata in one batch.
+
+    Either all spectra are saved or none is: names and duplicates are checked up front, and files that were
+    already written are removed again if a later one fails. The catalog is invalidated only once.
+
+    Args:
+        uploads (dict[str, tuple[np.ndarray, np.ndarray]]): The x/y data per new spectrum name.
+        contained_elements (set[str]): Elements shared by all spectra.
+        tags (list[str]): Tags shared by all spectra.
+        description (str, optional): Description shared by all spectra.
+        display_names (dict[str, str], optional): Display names per spectrum name.
+        raw_hashes (dict[str, str], optional): Hashes of the uploaded files per spectrum name.
+        allow_duplicates (bool, optional): Whether to save spectra whose content is already in the library.
+        x_units (dict[str, str], optional): Units of the x axes per spectrum name (default Q), see `units.UNITS`.
+        wavelengths (dict[str, float], optional): Wavelengths (Å) of the measurements per spectrum name.
+        write_thumbnails (bool, optional): Whether to render the thumbnails right away. Otherwise they are left to
+            a later `backfill_thumbnails` (the thumbnail endpoint renders missing ones on request).
+        raw_counts (dict[str, counts_codec.RawCounts], optional): The detector counts per spectrum name of spectra
+            parsed from .raw files (see `parse_spectrum_file`). They are stored instead of the x/y arrays, which
+            must be the ones they normalize to.
+        elements (dict[str, set[str]], optional): Further elements per spectrum name, added to `contained_elements`.
+        descriptions (dict[str, str], optional): Descriptions per spectrum name, replacing `description`.
+
+    Returns:
+        list[Spectrum]: The saved spectra, in the order of `uploads`.
+    """
+    display_names = display_names or {}
+    raw_hashes = raw_hashes or {}
+    x_units = x_units or {}
+    wavelengths = wavelengths or {}
+    raw_counts = raw_counts or {}
+    elements = elements or {}
+    descriptions = descriptions or {}
+    metas = {
+        name: _new_meta(
+            name,
+            DATA_DIR / f"{name}.npz",
+            set(contained_elements) | set(elements.get(name, ())),
+            tags,
+            descriptions.get(name, description),
+            display_names.get(name),
+            x,
+            y,
+            raw_hashes.get(name),
+            x_units.get(name, units.Q),
+            wavelengths.get(name),
+        )
+        for name, (x, y) in uploads.items()
+    }
+    written = []
+    with library_lock():
+        seen = {}
+        for name, (x, y) in uploads.items():
+            if (DATA_DIR / f"{name}.npz").exists() or (DATA_DIR / f"{name}.meta").exists():
+                raise FileExistsError(f"Spectrum with name '{name}' already exists.")
+            if not allow_duplicates:
+                existing = find_duplicate(x, y, raw_hashes.get(name)) or seen.get(metas[name]["content_hash"])
+                if existing:
+                    raise DuplicateSpectrumError(name, existing)
+                seen[metas[name]["content_hash"]] = name
+        try:
+            for name, (x, y) in uploads.items():
+                source_file = DATA_DIR / f"{name}.npz"
+                _atomic_write(source_file, _data_writer(x, y, raw_counts.get(name)), mode="wb")
+                written.append(source_file)
+                if write_thumbnails:
+                    write_thumbnail(metas[name]["content_hash"], x, y)
+            for name, meta_data in metas.items():
+                meta_file = DATA_DIR / f"{name}.meta"
+                _write_meta(meta_file, meta_data)
+                written.append(meta_file)
+            spectra = [Spectrum.from_meta(meta_data, DATA_DIR / f"{name}.meta") for name, meta_data in metas.items()]
+            _update_hash_index(added=spectra)
+        except BaseException:
+            for path in reversed(written):
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+            raise
+        finally:
+            if written:
+                generation = _bump_generation()
+        if written:
+            _update_fulltext_index(generation, added=spectra)
+    return spectra
+
+
+def link_hash(path: Path, size: int, mtime_ns: int) -> str:
+    """
+    Identifies the data of a linked spectrum by the path, size and modification time of its file. It takes the place
+    of the content hash, so indexing an archive never decodes the counts, and changes whenever the file does.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{path}\0{size}\0{mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def linked_file_meta(path: Path, x_unit: str = None, wavelength: float = None) -> dict:
+    """
+    Scans the header of a .raw/.xyd file and returns the data fields of the .meta file of a spectrum linked to it.
+    Only the header of a .raw file is read and only the directory entry of a .xyd file.
+
+    Args:
+        path (Path): The file in the archive.
+        x_unit (str, optional): Unit of the x axis of .xyd files (default 2θ); .raw files are read as Q.
+        wavelength (float, optional): Wavelength (Å) of .xyd files (default Cu Kα); .raw files record their own.
+
+    Raises:
+        ValueError: If the file is not a readable .raw or .xyd file.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    suffix = path.suffix.lower()
+    description = ""
+    if suffix == ".raw":
+        header = read_raw_header(path)
+        x_unit, wavelength = units.Q, round(header["radiation"], 6)
+        description = " ".join(part for part in (header["title"], header["comment"]) if part)
+    elif suffix == ".xyd":
+        # The defaults of the upload page
+        x_unit = x_unit or units.TWO_THETA
+        wavelength = wavelength or units.CU_K_ALPHA
+    else:
+        raise ValueError(f"Unsupported file format of {path}, expected .raw or .xyd.")
+    _check_axis(x_unit, wavelength)
+    return {
+        "source_file": str(path),
+        "linked": True,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "content_hash": link_hash(path, stat.st_size, stat.st_mtime_ns),
+        "x_unit": x_unit,
+        "wavelength": float(wavelength) if wavelength and x_unit == units.TWO_THETA else None,
         "description": description,
-        "display_name": display_name,
     }
-    with open(meta_file, "w") as f:
-        yaml.dump(meta_data, f)
-    list_available_spectra.cache_clear()
-    return Spectrum(
-        name=name,
-        source_file=source_file,
-        contained_elements=contained_elements,
-        tags=tags,
-        description=description,
-        display_name=display_name,
-    )
+
+
+def read_linked_file(spectrum: Spectrum) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes the archive file of a linked spectrum, after checking that it is still the file that was indexed.
+
+    Raises:
+        LinkedFileChangedError: If the size or modification time of the file changed.
+    """
+    _check_linked_file(spectrum)
+    return load_spectrum_file(spectrum.source_file)
+
+
+def read_linked_counts(spectrum: Spectrum) -> counts_codec.RawCounts | None:
+    """
+    Reads the counts of a linked .raw file like `read_linked_file`; None for .xyd files.
+    """
+    _check_linked_file(spectrum)
+    if spectrum.source_file.suffix.lower() != ".raw":
+        return None
+    return load_raw_counts(spectrum.source_file)
+
+
+def _check_linked_file(spectrum: Spectrum):
+    stat = spectrum.source_file.stat()
+    if (stat.st_size, stat.st_mtime_ns) != tuple(spectrum.source_stat):
+        raise LinkedFileChangedError(spectrum.name, spectrum.source_file)
+
+
+def _free_name(path: Path, taken: set[str]) -> str:
+    for name in (path.stem, f"{path.parent.name}_{path.stem}"):
+        if name and name not in taken:
+            return name
+    i = 2
+    while f"{path.stem}_{i}" in taken:
+        i += 1
+    return f"{path.stem}_{i}"
+
+
+def link_spectra(
+    paths: list[Path],
+    contained_elements: set[str] = (),
+    tags: list[str] = (),
+    description: str = None,
+    x_unit: str = None,
+    wavelength: float = None,
+    scanned: dict[Path, dict] = None,
+) -> tuple[list[Spectrum], dict[Path, str]]:
+    """
+    Adds .raw/.xyd files to the library without copying them: only a .meta file pointing at the original is
+    written, built from a header-only scan. The counts are decoded when the spectrum is first viewed.
+
+    Spectra are named after their files, prefixed with the parent directory or numbered if the name is taken.
+
+    Args:
+        paths (list[Path]): The archive files.
+        contained_elements (set[str], optional): Elements shared by all spectra.
+        tags (list[str], optional): Tags shared by all spectra.
+        description (str, optional): Description of all spectra, by default the title and comment of .raw headers.
+        x_unit (str, optional): Unit of the x axis of .xyd files, see `linked_file_meta`.
+        wavelength (float, optional): Wavelength (Å) of .xyd files.
+        scanned (dict[Path, dict], optional): Results of `linked_file_meta` per path, e.g. from a parallel scan.
+
+    Returns:
+        tuple[list[Spectrum], dict[Path, str]]: The linked spectra, and why each other path was skipped.
+    """
+    scanned = scanned or {}
+    skipped = {}
+    metas = {}
+    for path in paths:
+        try:
+            metas[path] = scanned.get(path) or linked_file_meta(path, x_unit, wavelength)
+        except (OSError, ValueError) as e:
+            skipped[path] = str(e)
+    spectra = []
+    with library_lock():
+        linked = {h: names[0] for h, names in hash_index()["content"].items()}
+        taken = {p.stem for p in DATA_DIR.glob("*.meta")} | {p.stem for p in DATA_DIR.glob("*.npz")}
+        for path, data in metas.items():
+            if data["content_hash"] in linked:
+                skipped[path] = f"Already linked as '{linked[data['content_hash']]}'."
+                continue
+            name = _free_name(Path(data["source_file"]), taken)
+            taken.add(name)
+            linked[data["content_hash"]] = name
+            meta_data = {
+                "name": name,
+                "contained_elements": list(contained_elements),
+                "tags": list(tags),
+                "display_name": None,
+                **data,
+            }
+            if description is not None:
+                meta_data["description"] = description
+            meta_file = DATA_DIR / f"{name}.meta"
+            _write_meta(meta_file, meta_data)
+            spectra.append(Spectrum.from_meta(meta_data, meta_file))
+        if spectra:
+            _update_hash_index(added=spectra)
+            _update_fulltext_index(_bump_generation(), added=spectra)
+    return spectra, skipped
+
+
+def validate_linked_spectra(progress: Callable[[int, int], None] = None) -> dict[str, list[str]]:
+    """
+    Checks the files of all linked spectra, with one stat call each. Spectra whose file changed are re-indexed from
+    its header under a new link hash, so no cached data or thumbnail of the old file is served for them. Missing and
+    unreadable files are only reported, as the share may just not be mounted.
+
+    Args:
+        progress (Callable[[int, int], None], optional): Called with the number of checked and of all .meta files.
+
+    Returns:
+        dict[str, list[str]]: The names of the spectra whose files "changed", are "missing" or "unreadable".
+    """
+    report = {"changed": [], "missing": [], "unreadable": []}
+    changes = []
+    meta_files = list(DATA_DIR.glob("*.meta"))
+    for i, meta_file in enumerate(meta_files):
+        if progress is not None:
+            progress(i, len(meta_files))
+        try:
+            meta = read_meta(meta_file)
+        except (OSError, ValueError):
+            # Gone meanwhile, or broken, which the integrity check reports
+            continue
+        if not meta.get("linked"):
+            continue
+        path = Path(meta["source_file"])
+        try:
+            stat = path.stat()
+        except OSError:
+            report["missing"].append(meta["name"])
+            continue
+        if (stat.st_size, stat.st_mtime_ns) == (meta["source_size"], meta["source_mtime_ns"]):
+            continue
+        try:
+            data = linked_file_meta(path, meta["x_unit"], meta["wavelength"])
+        except (OSError, ValueError):
+            report["unreadable"].append(meta["name"])
+            continue
+        # The description may have been edited since the file was linked
+        del data["description"]
+        changes.append((meta_file, data))
+    if not changes:
+        return report
+    with library_lock():
+        spectra = []
+        for meta_file, data in changes:
+            # Re-read under the lock, so concurrent edits of the metadata are kept
+            try:
+                with open(meta_file, "r") as f:
+                    meta_data = yaml.safe_load(f)
+            except FileNotFoundError:
+                continue
+            meta_data.update(data)
+            _write_meta(meta_file, meta_data)
+            spectra.append(Spectrum.from_meta(meta_data, meta_file))
+        names = [spectrum.name for spectrum in spectra]
+        report["changed"] = names
+        if spectra:
+            _update_hash_index(added=spectra, removed=names)
+            _update_fulltext_index(_bump_generation(), added=spectra, removed=names)
+    return report
 
 
 def delete_spectrum(spectrum: Spectrum) -> None:
@@ -349,11 +1288,16 @@ def delete_spectrum(spectrum: Spectrum) -> None:
     """
     source_file = spectrum.source_file
     meta_file = DATA_DIR / f"{spectrum.name}.meta"
-    if not source_file.exists() or not meta_file.exists():
-        raise FileNotFoundError(f"Spectrum '{spectrum.name}' does not exist.")
-    source_file.unlink()
-    meta_file.unlink()
-    list_available_spectra.cache_clear()
+    with library_lock():
+        if not source_file.exists() or not meta_file.exists():
+            raise FileNotFoundError(f"Spectrum '{spectrum.name}' does not exist.")
+        # Remove the .meta file first so no reader ever sees a spectrum without data.
+        meta_file.unlink()
+        # The archive file of a linked spectrum is not ours to delete
+        if not spectrum.linked:
+            source_file.unlink()
+        _update_hash_index(removed=[spectrum.name])
+        _update_fulltext_index(_bump_generation(), removed=[spectrum.name])
 
 
 def edit_spectrum(
@@ -363,6 +1307,8 @@ def edit_spectrum(
     tags: list[str] = None,
     description: str = None,
     display_name: str = None,
+    x_unit: str = None,
+    wavelength: float = None,
 ) -> Spectrum:
     """
     Edits the metadata of an existing spectrum.
@@ -372,52 +1318,71 @@ def edit_spectrum(
         new_name (str, optional): The new name for the spectrum.
         contained_elements (set[str], optional): New set of contained elements.
         tags (list[str], optional): New list of tags.
+        x_unit (str, optional): Corrected unit of the stored x axis, see `units.UNITS`. The data is not converted.
+        wavelength (float, optional): Corrected wavelength (Å) of the measurement.
 
     Returns:
         Spectrum: The updated Spectrum object.
     """
     meta_file = DATA_DIR / f"{old_spectrum.name}.meta"
-    if not meta_file.exists():
-        raise FileNotFoundError(f"Spectrum '{old_spectrum.name}' does not exist.")
 
     updated_name = new_name if new_name is not None else old_spectrum.name
     updated_elements = contained_elements if contained_elements is not None else old_spectrum.contained_elements
     updated_tags = tags if tags is not None else old_spectrum.tags
     updated_description = description if description is not None else getattr(old_spectrum, "description", "")
     updated_display_name = display_name if display_name is not None else getattr(old_spectrum, "display_name", None)
+    updated_x_unit = x_unit if x_unit is not None else old_spectrum.x_unit
+    updated_wavelength = wavelength if wavelength is not None else old_spectrum.wavelength
+    _check_axis(updated_x_unit, updated_wavelength)
     source_file = old_spectrum.source_file
 
-    # If renaming, update file names
-    if new_name and new_name != old_spectrum.name:
-        new_source_file = DATA_DIR / f"{new_name}.npz"
-        new_meta_file = DATA_DIR / f"{new_name}.meta"
-        if new_source_file.exists() or new_meta_file.exists():
-            raise FileExistsError(f"Spectrum with name '{new_name}' already exists.")
-        source_file.rename(new_source_file)
-        meta_file.rename(new_meta_file)
-        source_file = new_source_file
-        meta_file = new_meta_file
+    with library_lock():
+        if not meta_file.exists():
+            raise FileNotFoundError(f"Spectrum '{old_spectrum.name}' does not exist.")
+        # Start from the stored metadata, so fields this function does not edit are kept
+        with open(meta_file, "r") as f:
+            meta_data = yaml.safe_load(f)
 
-    meta_data = {
-        "name": updated_name,
-        "source_file": source_file.name,
-        "contained_elements": list(updated_elements),
-        "tags": updated_tags,
-        "description": updated_description,
-        "display_name": updated_display_name,
-    }
-    with open(meta_file, "w") as f:
-        yaml.dump(meta_data, f)
-
-    list_available_spectra.cache_clear()
-    return Spectrum(
-        name=updated_name,
-        source_file=source_file,
-        contained_elements=set(updated_elements),
-        tags=updated_tags,
-        description=updated_description,
-        display_name=updated_display_name,
-    )
+        old_files = []
+        # If renaming, update file names. The data is linked to its new name before the new .meta file is
+        # written, so every visible .meta file always points to existing data.
+        if new_name and new_name != old_spectrum.name:
+            new_source_file = DATA_DIR / f"{new_name}.npz"
+            new_meta_file = DATA_DIR / f"{new_name}.meta"
+            if new_source_file.exists() or new_meta_file.exists():
+                raise FileExistsError(f"Spectrum with name '{new_name}' already exists.")
+            old_files = [meta_file]
+            # Linked spectra keep pointing at their archive file
+            if not old_spectrum.linked:
+                try:
+                    os.link(source_file, new_source_file)
+                except OSError:
+                    shutil.copy2(source_file, new_source_file)
+                old_files.append(source_file)
+                source_file = new_source_file
+            meta_file = new_meta_file
+
+        meta_data.update(
+            {
+                "name": updated_name,
+                "source_file": str(source_file) if old_spectrum.linked else source_file.name,
+                "contained_elements": list(updated_elements),
+                "tags": updated_tags,
+                "description": updated_description,
+                "display_name": updated_display_name,
+                "x_unit": updated_x_unit,
+                "wavelength": float(updated_wavelength) if updated_wavelength else None,
+            }
+        )
+        _write_meta(meta_file, meta_data)
+        for old_file in old_files:
+            old_file.unlink()
+        if old_files:
+            _update_hash_index(renamed={old_spectrum.name: updated_name})
+        spectrum = Spectrum.from_meta(meta_data, meta_file)
+        _update_fulltext_index(_bump_generation(), added=[spectrum], removed=[old_spectrum.name])
+
+    return spectrum
 
 
 def list_used_tags() -> set[str]:
@@ -425,3 +1390,76 @@ def list_used_tags() -> set[str]:
     for spectrum in list_available_spectra():
         tags.update(spectrum.tags)
     return tags
+
+
+def edit_spectra(
+    spectra: list[Spectrum],
+    contained_elements: set[str] = None,
+    add_elements: set[str] = None,
+    remove_elements: set[str] = None,
+    tags: list[str] = None,
+    add_tags: list[str] = None,
+    remove_tags: list[str] = None,
+    description: str = None,
+) -> list[Spectrum]:
+    """
+    Edits the metadata of several spectra in one transaction.
+
+    All new .meta files are staged first and then renamed into place. If anything fails, the already replaced
+    files are restored, so either all spectra are changed or none is. The catalog is invalidated only once.
+
+    Args:
+        spectra (list[Spectrum]): The spectra to edit.
+        contained_elements (set[str], optional): Replaces the contained elements.
+        add_elements (set[str], optional): Elements to add to the contained elements.
+        remove_elements (set[str], optional): Elements to remove from the contained elements.
+        tags (list[str], optional): Replaces the tags.
+        add_tags (list[str], optional): Tags to add.
+        remove_tags (list[str], optional): Tags to remove.
+        description (str, optional): Replaces the description.
+
+    Returns:
+        list[Spectrum]: The updated Spectrum objects, in the order of `spectra`.
+    """
+    with library_lock():
+        changes = []
+        for spectrum in spectra:
+            meta_file = DATA_DIR / f"{spectrum.name}.meta"
+            if not meta_file.exists():
+                raise FileNotFoundError(f"Spectrum '{spectrum.name}' does not exist.")
+            with open(meta_file, "r") as f:
+                old_meta = yaml.safe_load(f)
+            meta_data = dict(old_meta)
+            elements = set(contained_elements if contained_elements is not None else meta_data["contained_elements"])
+            elements = (elements | set(add_elements or ())) - set(remove_elements or ())
+            meta_data["contained_elements"] = sorted(elements)
+            updated_tags = list(tags if tags is not None else meta_data.get("tags", []))
+            updated_tags += [tag for tag in add_tags or () if tag not in updated_tags]
+            meta_data["tags"] = [tag for tag in updated_tags if tag not in set(remove_tags or ())]
+            if description is not None:
+                meta_data["description"] = description
+            changes.append((meta_file, old_meta, meta_data))
+
+        staged = []
+        replaced = []
+        try:
+            for meta_file, _, meta_data in changes:
+                staged.append(_stage_write(meta_file, lambda f: yaml.dump(meta_data, f)))
+            for (meta_file, old_meta, _), tmp_name in zip(changes, staged):
+                os.replace(tmp_name, meta_file)
+                replaced.append((meta_file, old_meta))
+        except BaseException:
+            for tmp_name in staged:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_name)
+            for meta_file, old_meta in replaced:
+                _write_meta(meta_file, old_meta)
+            raise
+        finally:
+            if replaced:
+                generation = _bump_generation()
+        edited = [Spectrum.from_meta(meta_data, meta_file) for meta_file, _, meta_data in changes]
+        if replaced:
+            _update_fulltext_index(generation, added=edited)
+
+    return edited
@@ -0,0 +1,122 @@
+"""
+Finds duplicate and near-duplicate spectra in the library.
+
+Run as `python pxrd_viewer/dedup.py [--threshold 0.995]`.
+"""
+
+import argparse
+import logging
+
+import numpy as np
+
+import units
+from data_sources import Spectrum, content_hash, list_available_spectra
+
+logger = logging.getLogger(__name__)
+
+
+def _read_curves(spectra: list[Spectrum]) -> tuple[list[Spectrum], list[str], list[tuple], list[str]]:
+    """
+    Reads every spectrum once, without caching the arrays on it, and converts its axis to Q (ascending), so spectra
+    stored in different units can be compared. Spectra that cannot be read (e.g. a changed archive file) or have no
+    finite Q values are skipped with a warning.
+
+    Returns:
+        tuple: The readable spectra, their content hashes, their finite (Q, y) arrays and the names of the skipped
+        spectra.
+    """
+    readable, hashes, curves, skipped = [], [], [], []
+    for spectrum in spectra:
+        try:
+            x, y = spectrum.read_data()
+            q = units.to_q(x, spectrum.x_unit, spectrum.wavelength)
+            finite = np.isfinite(q)
+            if not finite.any():
+                raise ValueError("no finite Q values")
+            h = spectrum.content_hash or content_hash(x, y)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping spectrum %s: %s", spectrum.name, e)
+            skipped.append(spectrum.name)
+            continue
+        q, y = q[finite], y[finite]
+        order = np.argsort(q, kind="stable")  # d-spacings descend on Q
+        readable.append(spectrum)
+        hashes.append(h)
+        curves.append((q[order], y[order]))
+    return readable, hashes, curves, skipped
+
+
+def fingerprints(curves: list[tuple[np.ndarray, np.ndarray]], bins: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Resamples ascending (Q, y) curves, see `_read_curves`, onto one shared Q grid and normalizes every row to unit
+    length, so the dot product of two rows is their cosine similarity.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The grid and the (len(curves), bins) float32 fingerprint matrix.
+    """
+    grid = np.linspace(min(q[0] for q, _ in curves), max(q[-1] for q, _ in curves), bins)
+    matrix = np.empty((len(curves), bins), dtype=np.float32)
+    for i, (q, y) in enumerate(curves):
+        matrix[i] = np.interp(grid, q, y, left=0.0, right=0.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms > 0, norms, 1.0)
+    return grid, matrix
+
+
+def find_duplicates(
+    spectra: list[Spectrum] = None, threshold: float = 0.995, bins: int = 1024, block_size: int = 1024
+) -> tuple[list[list[str]], list[tuple[str, str, float]], list[str]]:
+    """
+    Finds exact duplicates (equal content hash) and near duplicates (cosine similarity on a shared grid
+    of at least `threshold`) in one pass over the arrays of the library.
+
+    Similarities are computed in blocks of `block_size` rows, so memory stays bounded for large libraries.
+    Spectra that cannot be read are skipped, see `_read_curves`.
+
+    Returns:
+        tuple: The groups of exact duplicates, the (name, name, similarity) pairs of near duplicates and the names
+        of the skipped spectra.
+    """
+    spectra = list_available_spectra() if spectra is None else spectra
+    spectra, hashes, curves, skipped = _read_curves(spectra)
+    if len(spectra) < 2:
+        return [], [], skipped
+
+    by_hash = {}
+    for spectrum, h in zip(spectra, hashes):
+        by_hash.setdefault(h, []).append(spectrum.name)
+    exact = [names for names in by_hash.values() if len(names) > 1]
+    exact_pairs = {frozenset((a, b)) for names in exact for a in names for b in names if a != b}
+
+    _, matrix = fingerprints(curves, bins)
+    del curves
+    near = []
+    for start in range(0, len(spectra), block_size):
+        similarity = matrix[start : start + block_size] @ matrix.T
+        rows, columns = np.nonzero(similarity >= threshold)
+        for row, column in zip(rows, columns):
+            i = start + row
+            if column <= i:
+                continue
+            pair = (spectra[i].name, spectra[column].name)
+            if frozenset(pair) not in exact_pairs:
+                near.append((*pair, float(similarity[row, column])))
+    near.sort(key=lambda pair: -pair[2])
+    return exact, near, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=0.995, help="Minimum cosine similarity of near duplicates")
+    parser.add_argument("--bins", type=int, default=1024, help="Number of points of the shared comparison grid")
+    args = parser.parse_args()
+
+    exact, near, skipped = find_duplicates(threshold=args.threshold, bins=args.bins)
+    print(f"{len(exact)} groups of exact duplicates")
+    for names in exact:
+        print("  " + ", ".join(names))
+    print(f"{len(near)} near-duplicate pairs")
+    for a, b, similarity in near:
+        print(f"  {a} ~ {b}: {similarity:.4f}")
+    if skipped:
+        print(f"{len(skipped)} unreadable spectra skipped: {', '.join(skipped)}")
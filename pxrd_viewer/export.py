@@ -0,0 +1,214 @@
+"""
+Bulk export of spectra to a single file that is produced while it is sent.
+
+Formats:
+    xy-zip  a zip holding one two-column text file `<name>.xy` per spectrum, in the x unit it was measured in,
+            and `metadata.csv` with a row per spectrum
+    npz     a NumPy .npz holding `q` (a common Q grid), `y` (a float32 matrix with one row per spectrum,
+            interpolated onto the grid and NaN outside the measured range) and `metadata` (a structured array
+            with one record per row)
+
+The archives are written to a non-seekable stream, so they are generated chunk by chunk: spectra are read
+CHUNK_SIZE at a time and every full buffer is handed out, and memory use does not grow with the number of spectra.
+Spectra that cannot be read (e.g. a changed archive file) are left out of the zip and are NaN rows in the matrix;
+the error is recorded in their metadata.
+"""
+
+import csv
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import numpy as np
+
+import similarity
+import units
+from data_sources import Spectrum
+
+FORMATS = {"xy-zip": ".zip", "npz": ".npz"}
+MEDIA_TYPES = {"xy-zip": "application/zip", "npz": "application/x-npz"}
+
+# Spectra read at the same time; reading mostly waits for the disk or the archive share
+CHUNK_SIZE = 64
+READ_THREADS = 8
+# Bytes collected before they are handed out
+FLUSH_SIZE = 1024 * 1024
+
+# The common grid of the npz matrix spans the similarity grid with about one point per 0.001 Å⁻¹
+GRID_POINTS = 8192
+
+METADATA_FIELDS = [
+    "name",
+    "display_name",
+    "x_unit",
+    "wavelength",
+    "contained_elements",
+    "tags",
+    "description",
+    "content_hash",
+    "points",
+    "error",
+]
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    A write-only, non-seekable stream that collects the written bytes until they are taken. Responses that are
+    generated while they are sent (see api.py) write into it and hand out `take()` once `size` reaches FLUSH_SIZE.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts, self.size = [], 0
+        return data
+
+
+def _read(spectrum: Spectrum) -> tuple[np.ndarray | None, np.ndarray | None, str | None]:
+    try:
+        x, y = spectrum.read_data()
+    except (OSError, ValueError) as e:
+        return None, None, str(e)
+    return x, y, None
+
+
+def read_chunked(spectra: list[Spectrum], threads: int = READ_THREADS):
+    """
+    Yields (spectrum, x, y, error) in the order of `spectra`, reading one chunk of spectra concurrently at a time.
+    The arrays are not cached on the spectra; for a spectrum that cannot be read, x and y are None and `error` says
+    why.
+    """
+    with ThreadPoolExecutor(threads) as executor:
+        for start in range(0, len(spectra), CHUNK_SIZE):
+            chunk = spectra[start : start + CHUNK_SIZE]
+            for spectrum, (x, y, error) in zip(chunk, executor.map(_read, chunk)):
+                yield spectrum, x, y, error
+
+
+def _metadata_row(spectrum: Spectrum, points: int, error: str | None) -> dict:
+    return {
+        "name": spectrum.name,
+        "display_name": spectrum.display_name or "",
+        "x_unit": spectrum.x_unit,
+        "wavelength": spectrum.wavelength,
+        "contained_elements": " ".join(sorted(spectrum.contained_elements)),
+        "tags": ", ".join(spectrum.tags),
+        "description": spectrum.description or "",
+        "content_hash": spectrum.content_hash or "",
+        "points": points,
+        "error": error or "",
+    }
+
+
+def xy_text(spectrum: Spectrum, x: np.ndarray, y: np.ndarray) -> str:
+    """
+    Returns a spectrum as two whitespace separated columns, preceded by `#` comment lines naming its axis.
+    """
+    text = io.StringIO()
+    text.write(f"# {spectrum.name}\n# x: {units.UNITS.get(spectrum.x_unit, spectrum.x_unit)}")
+    if spectrum.wavelength:
+        text.write(f", wavelength {spectrum.wavelength} Å")
+    text.write("\n")
+    # One format operation for all rows, about ten times faster than np.savetxt
+    text.write(("%.7g %.7g\n" * len(x)) % tuple(np.column_stack([x, y]).ravel().tolist()))
+    return text.getvalue()
+
+
+def stream_xy_zip(spectra: list[Spectrum]) -> Iterator[bytes]:
+    """
+    Yields the bytes of a zip of .xy files and metadata.csv, see the module docstring.
+    """
+    buffer = StreamBuffer()
+    rows = []
+    # The fastest deflate level: the text still shrinks to about a third, at several times the speed of the default
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for spectrum, x, y, error in read_chunked(spectra):
+            rows.append(_metadata_row(spectrum, 0 if x is None else len(x), error))
+            if error is None:
+                archive.writestr(f"{spectrum.name}.xy", xy_text(spectrum, x, y))
+            if buffer.size >= FLUSH_SIZE:
+                yield buffer.take()
+        table = io.StringIO()
+        writer = csv.DictWriter(table, METADATA_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+        archive.writestr("metadata.csv", table.getvalue())
+    yield buffer.take()
+
+
+def resample(q: np.ndarray, y: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """
+    Interpolates a spectrum given on a Q axis onto `grid`, with NaN outside its measured range.
+    """
+    valid = np.isfinite(q) & np.isfinite(y)
+    q, y = q[valid], y[valid]
+    if len(q) < 2:
+        return np.full(len(grid), np.nan)
+    order = np.argsort(q, kind="stable")
+    return np.interp(grid, q[order], y[order], left=np.nan, right=np.nan)
+
+
+def _metadata_table(rows: list[dict]) -> np.ndarray:
+    dtype = []
+    for field in METADATA_FIELDS:
+        if field == "wavelength":
+            dtype.append((field, "<f8"))
+        elif field == "points":
+            dtype.append((field, "<i4"))
+        else:
+            dtype.append((field, f"<U{max([1] + [len(row[field]) for row in rows])}"))
+    records = [tuple(np.nan if row[field] is None else row[field] for field in METADATA_FIELDS) for row in rows]
+    return np.array(records, dtype=dtype)
+
+
+def stream_npz(spectra: list[Spectrum], points: int = GRID_POINTS) -> Iterator[bytes]:
+    """
+    Yields the bytes of an .npz with the spectra interpolated onto a common Q grid, see the module docstring.
+    """
+    grid = np.linspace(similarity.Q_MIN, similarity.Q_MAX, points)
+    buffer = StreamBuffer()
+    rows = []
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        with archive.open("q.npy", "w") as f:
+            np.lib.format.write_array(f, grid.astype("<f4"), allow_pickle=False)
+        with archive.open("y.npy", "w", force_zip64=True) as f:
+            header = {"descr": "<f4", "fortran_order": False, "shape": (len(spectra), points)}
+            np.lib.format.write_array_header_1_0(f, header)
+            for spectrum, x, y, error in read_chunked(spectra):
+                row = np.full(points, np.nan, dtype="<f4")
+                if error is None:
+                    try:
+                        row[:] = resample(units.to_q(x, spectrum.x_unit, spectrum.wavelength), y, grid)
+                    except ValueError as e:  # e.g. 2θ of an unknown wavelength
+                        error = str(e)
+                rows.append(_metadata_row(spectrum, 0 if x is None else len(x), error))
+                f.write(row.tobytes())
+                if buffer.size >= FLUSH_SIZE:
+                    yield buffer.take()
+        with archive.open("metadata.npy", "w") as f:
+            np.lib.format.write_array(f, _metadata_table(rows), allow_pickle=False)
+    yield buffer.take()
+
+
+def stream(spectra: list[Spectrum], format: str) -> Iterator[bytes]:
+    """
+    Yields the bytes of an export of `spectra` in `format` (one of FORMATS).
+    """
+    if format == "xy-zip":
+        return stream_xy_zip(spectra)
+    if format == "npz":
+        return stream_npz(spectra)
+    raise ValueError(f"Unknown export format '{format}', use one of {', '.join(FORMATS)}.")
@@ -0,0 +1,217 @@
+"""
+Ranked full-text search over the names, display names, tags and descriptions of the library.
+
+`TextIndex` is an inverted index: every token maps to a posting list of the spectra containing it and how often.
+Queries only touch the posting lists of their words and score the matches with BM25 in a few vectorized NumPy
+operations, so a search over 100k descriptions takes milliseconds. The index is updated in place when spectra are
+added, edited or removed (see `data_sources.fulltext_index`).
+"""
+
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+# Weight of a token occurrence per field, so that hits in names rank above hits in descriptions (BM25F)
+FIELD_WEIGHTS = {"name": 3.0, "display_name": 3.0, "tags": 2.0, "description": 1.0}
+
+# BM25 parameters: term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+# A short prefix such as "s" matches many tokens; only the most common ones are searched
+MAX_PREFIX_EXPANSIONS = 64
+
+# Updates with up to this many spectra extend the cached posting arrays instead of discarding them
+MAX_APPENDED_SPECTRA = 16
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits text into lowercase tokens without diacritics; underscores separate tokens as in "CuO_300K".
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return _TOKEN.findall(text)
+
+
+def _fields(spectrum) -> dict[str, str]:
+    return {
+        "name": spectrum.name,
+        "display_name": spectrum.display_name or "",
+        "tags": " ".join(spectrum.tags),
+        "description": spectrum.description or "",
+    }
+
+
+class TextIndex:
+    """
+    An inverted index over the text fields of spectra, see the module docstring.
+
+    Documents get ascending ids that are never reused. The posting dicts only hold current documents; the NumPy
+    copies used by queries are extended in place by small updates and may still contain removed documents, which
+    queries mask out until there are enough of them to rebuild the copies.
+    """
+
+    def __init__(self, spectra=()):
+        self._ids: dict[str, int] = {}
+        self._names = np.empty(1024, dtype=object)
+        self._size = 0
+        self._doc_tokens: list[tuple[str, ...]] = []
+        self._lengths = np.zeros(1024)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._total_length = 0.0
+        self._postings: dict[str, dict[int, float]] = {}
+        self._arrays: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._stale_entries = 0
+        self._vocabulary = None
+        # Saves update the index from worker threads while the event loop searches it
+        self._lock = threading.Lock()
+        self.update(added=spectra)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _remove(self, name: str) -> None:
+        doc = self._ids.pop(name, None)
+        if doc is None:
+            return
+        for token in self._doc_tokens[doc]:
+            posting = self._postings[token]
+            del posting[doc]
+            if not posting:
+                # The token stays in the sorted vocabulary; expansions skip tokens without postings
+                del self._postings[token]
+                self._arrays.pop(token, None)
+            elif token in self._arrays:
+                self._stale_entries += 1
+        self._total_length -= self._lengths[doc]
+        self._alive[doc] = False
+        self._names[doc] = None
+        self._doc_tokens[doc] = ()
+
+    def _add(self, spectrum, extend_arrays: bool) -> None:
+        self._remove(spectrum.name)
+        doc = self._size
+        if doc == len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros(doc)])
+            self._alive = np.concatenate([self._alive, np.zeros(doc, dtype=bool)])
+            self._names = np.concatenate([self._names, np.empty(doc, dtype=object)])
+        frequencies: dict[str, float] = {}
+        length = 0.0
+        for field, text in _fields(spectrum).items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+                length += weight
+        for token, frequency in frequencies.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                if self._vocabulary is not None and extend_arrays:
+                    bisect.insort(self._vocabulary, token)
+                else:
+                    self._vocabulary = None
+            posting[doc] = frequency
+            arrays = self._arrays.pop(token, None)
+            if arrays is not None and extend_arrays:
+                self._arrays[token] = (np.append(arrays[0], doc), np.append(arrays[1], frequency))
+        self._ids[spectrum.name] = doc
+        self._names[doc] = spectrum.name
+        self._size += 1
+        self._doc_tokens.append(tuple(frequencies))
+        self._lengths[doc] = length
+        self._alive[doc] = True
+        self._total_length += length
+
+    def update(self, added=(), removed: list[str] = ()) -> None:
+        """
+        Removes the spectra named in `removed` and adds the spectra in `added`, replacing entries of the same name.
+        """
+        added = list(added)
+        with self._lock:
+            for name in removed:
+                self._remove(name)
+            for spectrum in added:
+                self._add(spectrum, extend_arrays=len(added) <= MAX_APPENDED_SPECTRA)
+            if self._stale_entries > len(self._ids):
+                self._arrays.clear()
+                self._stale_entries = 0
+
+    def _posting_arrays(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(token)
+        if arrays is None:
+            posting = self._postings[token]
+            arrays = self._arrays[token] = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float64, count=len(posting)),
+            )
+        return arrays
+
+    def _expand(self, word: str) -> list[str]:
+        """
+        Returns the tokens starting with `word`, limited to the most common ones.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        start = end = bisect.bisect_left(vocabulary, word)
+        while end < len(vocabulary) and vocabulary[end].startswith(word):
+            end += 1
+            if end - start > 4 * MAX_PREFIX_EXPANSIONS:
+                break
+        tokens = [token for token in vocabulary[start:end] if token in self._postings]
+        if len(tokens) > MAX_PREFIX_EXPANSIONS:
+            tokens = heapq.nlargest(MAX_PREFIX_EXPANSIONS, tokens, key=lambda t: (t == word, len(self._postings[t])))
+        return tokens
+
+    def search(self, query: str, offset: int = 0, limit: int = None) -> tuple[list[str], int]:
+        """
+        Finds the spectra that contain every word of `query` as a prefix of a token in any field, best BM25 first.
+
+        Returns:
+            tuple[list[str], int]: The names of the requested page of matches and the number of matches.
+        """
+        words = tokenize(query)
+        with self._lock:
+            if not words or not self._ids:
+                return [], 0
+            return self._search(words, offset, limit)
+
+    def _search(self, words: list[str], offset: int, limit: int | None) -> tuple[list[str], int]:
+        size = self._size
+        lengths = self._lengths[:size]
+        count = len(self._ids)
+        normalization = K1 * (1 - B + B * lengths / (self._total_length / count or 1.0))
+        scores = np.zeros(size)
+        matched = self._alive[:size].copy()
+        for word in dict.fromkeys(words):
+            word_scores = np.zeros(size)
+            for token in self._expand(word):
+                docs, frequencies = self._posting_arrays(token)
+                document_frequency = len(self._postings[token])
+                idf = math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+                token_scores = idf * frequencies * (K1 + 1) / (frequencies + normalization[docs])
+                # A word counts once per document, with its best matching token
+                word_scores[docs] = np.maximum(word_scores[docs], token_scores)
+            matched &= word_scores > 0
+            scores += word_scores
+        candidates = np.flatnonzero(matched)
+        end = len(candidates) if limit is None else min(offset + limit, len(candidates))
+        if end <= offset:
+            return [], len(candidates)
+        candidate_scores = -scores[candidates]
+        if end < len(candidates):
+            # Only the requested page has to be sorted
+            top = np.argpartition(candidate_scores, end - 1)[:end]
+            order = top[np.argsort(candidate_scores[top], kind="stable")]
+        else:
+            order = np.argsort(candidate_scores, kind="stable")
+        return self._names[candidates[order[offset:end]]].tolist(), len(candidates)
@@ -0,0 +1,247 @@
+"""
+Integrity check of the library files, and quarantine of broken entries.
+
+Every .meta file is checked in worker processes: that it parses, that its data file exists, and for stored spectra
+that the .npz holds (or its stored counts decode to) two finite 1-D arrays of equal length whose content hash
+matches the recorded one. Linked spectra are only checked for a present, unchanged archive file, as decoding them is
+the job of `validate_linked_spectra`.
+The library as a whole is checked for data files without a .meta file (e.g. left behind by an interrupted rename),
+stale temporary files and a hash index that does not match the entries.
+
+`quarantine` moves the files of broken entries and orphans to DATA_DIR/.quarantine/<time>/, so they can be inspected
+and restored by hand, and rebuilds the hash index.
+
+Run as `python pxrd_viewer/integrity.py [--quarantine]`; the exit code is 1 if problems were found.
+"""
+
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+import data_sources
+import units
+
+QUARANTINE_DIR_NAME = ".quarantine"
+
+# .meta files per task of the worker processes
+CHUNK_SIZE = 64
+# Temporary files of atomic writes older than this were left behind by a crashed process
+STALE_TEMP_SECONDS = 3600
+
+
+@dataclass
+class Problem:
+    """
+    A problem found by the check. `files` are the files that `quarantine` moves; problems without files (such as
+    an out-of-date index or a changed archive file) are repaired otherwise.
+    """
+
+    entry: str
+    message: str
+    files: list[Path] = field(default_factory=list)
+
+
+@dataclass
+class Report:
+    checked: int = 0
+    problems: list[Problem] = field(default_factory=list)
+    # Whether the hash index needs to be rebuilt
+    index_stale: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def summary(self) -> str:
+        if self.ok:
+            return f"{self.checked} entries checked, no problems"
+        movable = sum(1 for problem in self.problems if problem.files)
+        return f"{self.checked} entries checked, {len(self.problems)} problems ({movable} to quarantine)"
+
+
+def check_entry(meta_file: Path) -> tuple[dict | None, list[str]]:
+    """
+    Checks one .meta file and its data. Module level, so it can run in a worker process.
+
+    Returns:
+        tuple[dict | None, list[str]]: The parsed metadata (None if unreadable) and the problems found.
+    """
+    try:
+        meta = data_sources.read_meta(meta_file)
+    except FileNotFoundError:
+        return None, []
+    except (OSError, ValueError) as e:
+        return None, [str(e)]
+    problems = []
+    if meta["name"] != meta_file.stem:
+        problems.append(f"The name '{meta['name']}' does not match the file name")
+    if meta.get("x_unit", units.Q) not in units.UNITS:
+        problems.append(f"Unknown x axis unit '{meta['x_unit']}'")
+    source_file = meta_file.parent / meta["source_file"]
+    if meta.get("linked"):
+        try:
+            stat = source_file.stat()
+        except OSError:
+            return meta, problems + [f"The linked file {source_file} is missing (is the share mounted?)"]
+        if (stat.st_size, stat.st_mtime_ns) != (meta.get("source_size"), meta.get("source_mtime_ns")):
+            problems.append(f"The linked file {source_file} changed; run 'Validate linked spectra'")
+        return meta, problems
+    try:
+        x, y = data_sources.read_npz(source_file)
+    except FileNotFoundError:
+        return meta, problems + [f"The data file {source_file.name} is missing"]
+    except (OSError, ValueError, KeyError) as e:
+        return meta, problems + [f"The data file {source_file.name} is unreadable: {e}"]
+    if x.ndim != 1 or x.shape != y.shape or len(x) < 2:
+        problems.append(f"The arrays have the shapes {x.shape} and {y.shape}")
+    elif not (np.isfinite(x).all() and np.isfinite(y).all()):
+        problems.append("The arrays contain NaN or infinite values")
+    elif meta.get("content_hash") and meta["content_hash"] != data_sources.content_hash(x, y):
+        problems.append("The arrays do not match the recorded content hash")
+    return meta, problems
+
+
+def check_entries(meta_files: list[Path]) -> list[tuple[Path, dict | None, list[str]]]:
+    """
+    Checks a chunk of .meta files. Used as the task of the worker processes.
+    """
+    return [(meta_file, *check_entry(meta_file)) for meta_file in meta_files]
+
+
+def _entry_files(meta_file: Path, meta: dict | None) -> list[Path]:
+    """
+    The files of a broken entry that `quarantine` moves: the .meta file and its .npz, never a linked archive file.
+    """
+    files = [meta_file]
+    if meta is None:
+        data_file = meta_file.with_suffix(".npz")
+    elif meta.get("linked"):
+        return files
+    else:
+        data_file = meta_file.parent / meta["source_file"]
+    if data_file.parent == meta_file.parent and data_file.exists():
+        files.append(data_file)
+    return files
+
+
+def check_library(processes: int = None, progress: Callable[[int, int], None] = None) -> Report:
+    """
+    Checks every entry of the library in `processes` worker processes (all cores by default) and the library as a
+    whole. `progress` is called with the number of checked and of all .meta files after every chunk.
+    """
+    data_dir = data_sources.DATA_DIR
+    meta_files = sorted(data_dir.glob("*.meta"))
+    report = Report(checked=len(meta_files))
+    chunks = [meta_files[i : i + CHUNK_SIZE] for i in range(0, len(meta_files), CHUNK_SIZE)]
+    if processes == 1 or len(chunks) <= 1:
+        results = map(check_entries, chunks)
+    else:
+        executor = ProcessPoolExecutor(processes)
+        results = executor.map(check_entries, chunks)
+
+    referenced = set()
+    names = set()
+    expected_hashes = {}
+    try:
+        for i, chunk_results in enumerate(results):
+            for meta_file, meta, problems in chunk_results:
+                if meta is not None and not meta.get("linked"):
+                    referenced.add((data_dir / meta["source_file"]).resolve())
+                if meta is not None:
+                    names.add(meta["name"])
+                    if meta.get("content_hash") and not problems:
+                        expected_hashes.setdefault(meta["content_hash"], set()).add(meta["name"])
+                for problem in problems:
+                    linked = meta is not None and meta.get("linked")
+                    files = [] if linked else _entry_files(meta_file, meta)
+                    report.problems.append(Problem(meta_file.stem, problem, files))
+            if progress is not None:
+                progress(min((i + 1) * CHUNK_SIZE, len(meta_files)), len(meta_files))
+    finally:
+        if processes != 1 and len(chunks) > 1:
+            executor.shutdown(cancel_futures=True)
+
+    # An entry with several problems is moved once
+    seen = set()
+    for problem in report.problems:
+        problem.files = [path for path in problem.files if path not in seen]
+        seen.update(problem.files)
+
+    for data_file in sorted(data_dir.glob("*.npz")):
+        if data_file.resolve() not in referenced and data_file not in seen:
+            report.problems.append(Problem(data_file.stem, "A data file without .meta file", [data_file]))
+    now = time.time()
+    for temp_file in sorted(data_dir.glob(".*.tmp")):
+        try:
+            stale = now - temp_file.stat().st_mtime > STALE_TEMP_SECONDS
+        except FileNotFoundError:
+            continue
+        if stale:
+            report.problems.append(Problem(temp_file.name, "A temporary file of an interrupted write", [temp_file]))
+
+    index = data_sources._read_hash_index()
+    if index is not None:
+        indexed = index.get("content", {})
+        stale = [h for h, hash_names in indexed.items() if not set(hash_names) <= names]
+        missing = [h for h, hash_names in expected_hashes.items() if not hash_names <= set(indexed.get(h, ()))]
+        if stale or missing:
+            report.index_stale = True
+            report.problems.append(
+                Problem("", f"The hash index has {len(stale)} stale and lacks {len(missing)} current entries")
+            )
+    return report
+
+
+def quarantine(report: Report) -> list[Path]:
+    """
+    Moves the files of the problems in `report` to a new directory below DATA_DIR/.quarantine and rebuilds the hash
+    index. Files that are gone meanwhile are skipped.
+
+    Returns:
+        list[Path]: The new paths of the moved files.
+    """
+    data_dir = data_sources.DATA_DIR
+    files = [path for problem in report.problems for path in problem.files]
+    if not files and not report.index_stale:
+        return []
+    moved = []
+    with data_sources.library_lock():
+        target = data_dir / QUARANTINE_DIR_NAME / time.strftime("%Y%m%d-%H%M%S")
+        for path in files:
+            meta_file = path.with_suffix(".meta")
+            # Gone meanwhile, or the .npz of a save that was still in progress during the check
+            if not path.exists() or (path.suffix == ".npz" and meta_file.exists() and meta_file not in files):
+                continue
+            target.mkdir(parents=True, exist_ok=True)
+            destination = target / path.name
+            shutil.move(path, destination)
+            moved.append(destination)
+        data_sources.rebuild_hash_index()
+        names = sorted({path.stem for path in moved if path.suffix == ".meta"})
+        data_sources._update_fulltext_index(data_sources._bump_generation(), removed=names)
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quarantine", action="store_true", help="Move broken entries to .quarantine")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes")
+    args = parser.parse_args()
+
+    report = check_library(args.processes)
+    for problem in report.problems:
+        print(f"{problem.entry or '(library)'}: {problem.message}")
+    print(report.summary())
+    if args.quarantine:
+        moved = quarantine(report)
+        print(f"Moved {len(moved)} files to {data_sources.DATA_DIR / QUARANTINE_DIR_NAME}.")
+    sys.exit(0 if report.ok else 1)
@@ -0,0 +1,520 @@
+"""
+Background jobs for long-running library operations, such as thumbnail backfills, similarity matrix updates and
+archive links.
+
+Pages submit a job by kind and JSON arguments (`queue.submit("similarity")`) instead of running the work in their
+request handler. The jobs run in a bounded thread pool and report their progress through a `JobContext`, which
+raises `JobCancelled` in the job once a cancellation was requested. Every state change is appended to a journal in
+DATA_DIR, so jobs that were queued or running when the server stopped are started again after a restart; job
+functions are therefore written to be safe to re-run. The worker processes of a server share the journal: each runs
+the jobs it claimed and shows those of the others.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import data_sources
+import units
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process mode only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE_NAME = ".jobs.jsonl"
+
+# Jobs running at the same time; the heavy ones (similarity, archive scans) parallelize internally
+WORKERS = int(os.environ.get("PXRD_JOB_WORKERS", "2"))
+
+# Started queues of the worker processes, one locked file each
+WORKER_DIR_NAME = ".job-workers"
+
+# Seconds between the checks of a running job for cancellations requested in other worker processes
+SYNC_INTERVAL = 1.0
+
+# Finished jobs kept in the journal and shown on the jobs page
+MAX_FINISHED_JOBS = 200
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job by `JobContext.progress` once the job was cancelled.
+    """
+
+
+@dataclass
+class JobKind:
+    name: str
+    title: str
+    function: Callable
+
+
+KINDS: dict[str, JobKind] = {}
+
+
+def job_kind(name: str, title: str):
+    """
+    Registers a job function under `name`. It is called as `function(context, **args)` and may return a short
+    summary of its result.
+    """
+
+    def decorator(function):
+        KINDS[name] = JobKind(name, title, function)
+        return function
+
+    return decorator
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    title: str
+    args: dict = field(default_factory=dict)
+    state: str = QUEUED
+    done: int = 0
+    total: int = 0
+    message: str = ""
+    result: str = None
+    error: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    cancel_requested: bool = False
+    # The queue that runs the job, see JobQueue._register
+    owner: str = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    @property
+    def fraction(self) -> float | None:
+        return min(self.done / self.total, 1.0) if self.total else None
+
+    @property
+    def eta(self) -> float | None:
+        """
+        The estimated remaining seconds of a running job, extrapolated from its progress so far.
+        """
+        if self.state != RUNNING or not self.done or not self.total or self.started is None:
+            return None
+        return (time.time() - self.started) / self.done * max(self.total - self.done, 0)
+
+
+class JobContext:
+    """
+    Passed to job functions to report progress and to check for cancellation.
+    """
+
+    def __init__(self, job: Job, sync: Callable = None):
+        self.job = job
+        # Reads cancellations requested in other worker processes from the journal
+        self._sync = sync
+        self._synced = time.monotonic()
+
+    def check(self) -> None:
+        if self._sync is not None and time.monotonic() - self._synced > SYNC_INTERVAL:
+            self._synced = time.monotonic()
+            self._sync()
+        if self.job.cancel_requested:
+            raise JobCancelled()
+
+    def progress(self, done: int, total: int = None, message: str = None) -> None:
+        """
+        Reports that `done` of `total` steps are finished and raises `JobCancelled` if the job was cancelled.
+        """
+        self.job.done = done
+        if total is not None:
+            self.job.total = total
+        if message is not None:
+            self.job.message = message
+        self.check()
+
+
+class JobQueue:
+    """
+    Runs submitted jobs in a pool of `workers` threads, in submission order, and journals their states.
+
+    Jobs submitted before `start` are queued and run once the queue is started. Every worker process of the server
+    has its own queue on the same journal: state changes are made under `data_sources.library_lock` after reading
+    the entries of the other processes, so a queued job is claimed by exactly one of them.
+    """
+
+    def __init__(self, workers: int = WORKERS, journal: Path = None):
+        self.workers = workers
+        self._journal = journal
+        self._jobs: dict[str, Job] = {}
+        self._running: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stopping = False
+        self._loaded = False
+        # The journal file and how much of it was read, see _sync
+        self._read_inode = None
+        self._read_offset = 0
+        # Identifies this queue in the journal while it is started, see _register
+        self._owner = None
+        self._owner_file = None
+        self._started = None
+
+    @property
+    def journal(self) -> Path:
+        return self._journal or data_sources.DATA_DIR / JOURNAL_FILE_NAME
+
+    @property
+    def _worker_dir(self) -> Path:
+        return self.journal.parent / WORKER_DIR_NAME
+
+    def _append(self, job: Job) -> None:
+        # Callers hold library_lock, so lines of different processes do not interleave
+        self.journal.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journal, "a") as f:
+            f.write(json.dumps(asdict(job)) + "\n")
+
+    def _sync(self) -> None:
+        """
+        Applies the journal entries written since the last call, by this or other worker processes. Jobs running
+        in this process only take over a requested cancellation. Call with `_lock` held.
+        """
+        try:
+            with open(self.journal, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                offset = self._read_offset if inode == self._read_inode else 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line that is still being written is read by the next call
+        end = data.rfind(b"\n") + 1
+        self._read_inode, self._read_offset = inode, offset + end
+        for line in data[:end].splitlines():
+            try:
+                entry = Job(**json.loads(line))
+            except (ValueError, TypeError):
+                # e.g. a line cut off by a crash while it was written
+                logger.warning("Skipping a broken line of the job journal")
+                continue
+            job = self._jobs.get(entry.id)
+            if job is None:
+                self._jobs[entry.id] = entry
+            elif entry.id in self._running:
+                job.cancel_requested = job.cancel_requested or entry.cancel_requested
+            else:
+                # Updated in place, pages keep references to the jobs they watch
+                vars(job).update(vars(entry))
+        self._trim()
+
+    def _live_workers(self) -> dict[str, float]:
+        """
+        Returns the start times of the started queues of all running worker processes by owner, and removes the
+        files of those that exited. Call with library_lock held.
+        """
+        workers = {self._owner: self._started} if self._owner is not None else {}
+        if fcntl is None or not self._worker_dir.exists():
+            return workers
+        for path in self._worker_dir.iterdir():
+            if path.name == self._owner:
+                continue
+            with open(path) as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Locked as long as its process lives
+                    workers[path.name] = float(f.read() or 0)
+                    continue
+                path.unlink()
+        return workers
+
+    def _register(self) -> None:
+        """
+        Creates the file of this queue in WORKER_DIR_NAME, locked until the process exits, so other processes can
+        tell whether the jobs it runs are still running. Call with library_lock held.
+        """
+        if self._owner is not None:
+            return
+        self._owner, self._started = uuid.uuid4().hex, time.time()
+        self._worker_dir.mkdir(parents=True, exist_ok=True)
+        self._owner_file = open(self._worker_dir / self._owner, "w")
+        if fcntl is not None:
+            fcntl.flock(self._owner_file, fcntl.LOCK_EX)
+        self._owner_file.write(str(self._started))
+        self._owner_file.flush()
+
+    def _load(self) -> None:
+        """
+        Reads the journal on first use and rewrites it with one entry per kept job. Jobs that were running in a
+        worker process that has exited are queued again.
+        """
+        if self._loaded:
+            return
+        with data_sources.library_lock(), self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            self._sync()
+            live = self._live_workers()
+            for job in self._jobs.values():
+                if job.is_finished or (job.state == RUNNING and job.owner in live):
+                    continue
+                if job.cancel_requested or job.kind not in KINDS:
+                    job.state, job.finished = CANCELLED, time.time()
+                    job.error = None if job.kind in KINDS else f"Unknown job kind '{job.kind}'"
+                elif job.state == RUNNING:
+                    job.state, job.done, job.started, job.owner = QUEUED, 0, None, None
+                    job.message = "Restarted after a server restart"
+            self._jobs = dict(sorted(self._jobs.items(), key=lambda item: item[1].created))
+            if self._jobs:
+                data_sources._atomic_write(
+                    self.journal, lambda f: f.writelines(json.dumps(asdict(job)) + "\n" for job in self._jobs.values())
+                )
+                stat = self.journal.stat()
+                self._read_inode, self._read_offset = stat.st_ino, stat.st_size
+
+    def start(self) -> None:
+        """
+        Loads the journal and starts the queued jobs.
+        """
+        self._load()
+        with data_sources.library_lock(), self._lock:
+            if self._executor is not None:
+                return
+            self._register()
+            self._sync()
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+            for job in self._jobs.values():
+                if job.state == QUEUED:
+                    self._executor.submit(self._run, job)
+
+    def stop(self) -> None:
+        """
+        Stops the running jobs at their next progress report. They stay queued in the journal and run again
+        after the next start.
+        """
+        with self._lock:
+            if self._executor is None:
+                return
+            self._stopping = True
+            for job in self._jobs.values():
+                if job.id in self._running:
+                    job.cancel_requested = True
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, kind: str, title: str = None, **args) -> Job:
+        """
+        Queues a job of a registered kind. If an identical job is still waiting to start, that job is returned
+        instead, so e.g. repeated saves do not pile up thumbnail backfills.
+
+        Args:
+            kind (str): The name of the job kind, see `job_kind`.
+            title (str, optional): The title shown to users (default: the title of the kind).
+            **args: The JSON-serializable arguments of the job function.
+        """
+        return self._submit(kind, title, args)
+
+    def submit_at_startup(self, kind: str, **args) -> Job:
+        """
+        Queues a job once per server start: if an identical job was submitted since the longest-running worker
+        process started its queue, that job is returned instead, whatever its state. See `submit`.
+        """
+        return self._submit(kind, None, args, startup=True)
+
+    def _submit(self, kind: str, title: str | None, args: dict, startup: bool = False) -> Job:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        args = json.loads(json.dumps(args))
+        self._load()
+        with data_sources.library_lock(), self._lock:
+            self._sync()
+            since = min(self._live_workers().values(), default=None) if startup else None
+            for job in self._jobs.values():
+                if job.kind != kind or job.args != args:
+                    continue
+                if (job.state == QUEUED and not job.cancel_requested) or (since is not None and job.created >= since):
+                    return job
+            job = Job(id=uuid.uuid4().hex, kind=kind, title=title or KINDS[kind].title, args=args)
+            self._jobs[job.id] = job
+            self._append(job)
+            if self._executor is not None:
+                self._executor.submit(self._run, job)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued job right away and a running one at its next progress report, also if it runs in
+        another worker process.
+
+        Returns:
+            bool: Whether the job was still unfinished.
+        """
+        with data_sources.library_lock(), self._lock:
+            self._sync()
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished:
+                return False
+            job.cancel_requested = True
+            if job.state == QUEUED:
+                job.state, job.finished = CANCELLED, time.time()
+            self._append(job)
+        return True
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def refresh(self) -> None:
+        """
+        Reads the state changes of other worker processes from the journal into the known jobs.
+        """
+        with self._lock:
+            self._sync()
+
+    def jobs(self) -> list[Job]:
+        """
+        Returns the known jobs of all worker processes, newest first.
+        """
+        self._load()
+        with self._lock:
+            self._sync()
+            return sorted(self._jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def _run(self, job: Job) -> None:
+        # Claims the job, unless another worker process did so or it was cancelled since it was queued
+        with data_sources.library_lock(), self._lock:
+            self._sync()
+            if job.state != QUEUED or self._stopping:
+                return
+            job.state, job.started, job.done, job.error, job.owner = RUNNING, time.time(), 0, None, self._owner
+            self._running.add(job.id)
+            self._append(job)
+        try:
+            result = KINDS[job.kind].function(JobContext(job, self.refresh), **job.args)
+            state = DONE
+            job.done = job.total
+            job.result = None if result is None else str(result)
+        except JobCancelled:
+            state = QUEUED if self._stopping else CANCELLED
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.title, job.id)
+            state = FAILED
+            job.error = f"{type(e).__name__}: {e}"
+        with data_sources.library_lock(), self._lock:
+            job.state = state
+            if state == QUEUED:
+                job.cancel_requested, job.done, job.started, job.owner = False, 0, None, None
+            else:
+                job.finished = time.time()
+            self._append(job)
+            self._running.discard(job.id)
+            self._trim()
+
+    def _trim(self) -> None:
+        finished = [job for job in self._jobs.values() if job.is_finished]
+        for job in sorted(finished, key=lambda job: job.created)[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+
+
+queue = JobQueue()
+
+
+@job_kind("thumbnails", "Create missing thumbnails")
+def _thumbnails(context: JobContext, prune: bool = False) -> str:
+    created, removed = data_sources.backfill_thumbnails(prune, progress=context.progress)
+    return f"{created} created, {removed} removed"
+
+
+@job_kind("validate-linked", "Validate linked spectra")
+def _validate_linked(context: JobContext) -> str:
+    report = data_sources.validate_linked_spectra(progress=context.progress)
+    for state, names in report.items():
+        if names:
+            logger.warning("%d linked spectra with %s files: %s", len(names), state, ", ".join(names))
+    return ", ".join(f"{len(names)} {state}" for state, names in report.items())
+
+
+@job_kind("integrity", "Check library integrity")
+def _integrity(context: JobContext, quarantine: bool = False) -> str:
+    import integrity
+
+    report = integrity.check_library(progress=context.progress)
+    for problem in report.problems:
+        logger.warning("Integrity check: %s: %s", problem.entry or "(library)", problem.message)
+    if not quarantine:
+        return report.summary()
+    context.check()
+    return f"{report.summary()}; {len(integrity.quarantine(report))} files quarantined"
+
+
+@job_kind("similarity", "Update similarity matrix")
+def _similarity(context: JobContext) -> str:
+    import similarity
+
+    added = similarity.update_matrix(progress=context.progress)
+    context.check()
+    # The viewer's cluster order is then read from disk instead of being computed on request
+    try:
+        similarity.update_order()
+    except ValueError as e:
+        return f"{added} spectra added; {e}"
+    return f"{added} spectra added"
+
+
+@job_kind("similarity-compact", "Compact similarity matrix")
+def _similarity_compact(context: JobContext) -> str:
+    import similarity
+
+    context.check()
+    return f"{similarity.compact()} rows removed"
+
+
+@job_kind("link-archive", "Link archive")
+def _link_archive(
+    context: JobContext,
+    root: str,
+    contained_elements: list[str] = (),
+    tags: list[str] = (),
+    x_unit: str = None,
+    wavelength: float = None,
+) -> str:
+    import archive
+
+    if not Path(root).is_dir():
+        raise NotADirectoryError(f"'{root}' is not a directory on the server")
+    spectra, skipped = archive.link_directory(
+        Path(root), set(contained_elements), list(tags), x_unit, wavelength, progress=context.progress
+    )
+    for path, reason in skipped.items():
+        logger.info("Not linked %s: %s", path, reason)
+    return f"{len(spectra)} linked, {len(skipped)} skipped"
+
+
+@job_kind("import-cif", "Import CIF structures")
+def _import_cif(context: JobContext, root: str, wavelength: float = None, tags: list[str] = ()) -> str:
+    import structures
+
+    if not Path(root).is_dir():
+        raise NotADirectoryError(f"'{root}' is not a directory on the server")
+    spectra, skipped = structures.import_directory(
+        Path(root), wavelength or units.CU_K_ALPHA, list(tags), progress=context.progress
+    )
+    for path, reason in skipped.items():
+        logger.info("Not imported %s: %s", path, reason)
+    return f"{len(spectra)} imported, {len(skipped)} skipped"
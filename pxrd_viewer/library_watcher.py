@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import data_sources
+from data_sources import Spectrum
+
+try:
+    import watchfiles
+except ImportError:  # watchfiles ships with uvicorn[standard]; without it we poll
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LibraryDelta:
+    """
+    The spectra that were added, changed or removed between two looks at DATA_DIR.
+    A rename shows up as the removal of the old name and the addition of the new one.
+    """
+
+    added: list[Spectrum] = field(default_factory=list)
+    changed: list[Spectrum] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+def snapshot_meta_files(data_dir: Path) -> dict[str, tuple[int, int, int]]:
+    """
+    Returns a cheap fingerprint of every .meta file in `data_dir`, keyed by file name.
+    Only the directory entries are stat'ed, no meta file is parsed.
+    """
+    snapshot = {}
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".meta"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    return snapshot
+
+
+def apply_delta(spectra: list[Spectrum], delta: LibraryDelta) -> list[Spectrum]:
+    """
+    Returns a new spectrum list with the delta applied, keeping the order of unchanged entries.
+    """
+    changed = {s.name: s for s in delta.changed}
+    removed = set(delta.removed)
+    updated = [changed.get(s.name, s) for s in spectra if s.name not in removed]
+    known = {s.name for s in updated}
+    updated.extend(s for s in delta.added if s.name not in known)
+    return updated
+
+
+class LibraryWatcher:
+    """
+    Watches DATA_DIR for changes made by any process (inotify via watchfiles, polling otherwise),
+    debounces bursts such as bulk imports and pushes the resulting delta to subscribers.
+    """
+
+    def __init__(self, debounce: float = 0.5, poll_interval: float = 1.0, force_polling: bool = None):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        if force_polling is None:
+            force_polling = os.environ.get("PXRD_WATCH_POLLING", "0") == "1"
+        self.force_polling = force_polling
+        self._subscribers: list[Callable[[LibraryDelta], None]] = []
+        self._snapshot = None
+        self._stop_event = None
+        self._task = None
+
+    def subscribe(self, callback: Callable[[LibraryDelta], None]) -> Callable[[], None]:
+        """
+        Registers a callback for library deltas and returns a function that unregisters it again.
+        """
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def refresh(self) -> LibraryDelta:
+        """
+        Compares DATA_DIR against the last snapshot, loads only the changed .meta files
+        and notifies all subscribers if anything changed.
+        """
+        delta = self.compute_delta()
+        self._notify(delta)
+        return delta
+
+    async def refresh_async(self) -> LibraryDelta:
+        """
+        Like `refresh`, but the directory scan and the parsing of the changed .meta files run in a thread, so a bulk
+        import of thousands of files does not block the event loop. Subscribers are still called on the loop.
+        """
+        delta = await asyncio.to_thread(self.compute_delta)
+        self._notify(delta)
+        return delta
+
+    def compute_delta(self) -> LibraryDelta:
+        """
+        Compares DATA_DIR against the last snapshot and loads only the changed .meta files, without notifying.
+        """
+        data_dir = data_sources.DATA_DIR
+        snapshot = snapshot_meta_files(data_dir)
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is None:
+            return LibraryDelta()
+
+        delta = LibraryDelta()
+        for meta_name, fingerprint in snapshot.items():
+            if previous.get(meta_name) == fingerprint:
+                continue
+            try:
+                spectrum = data_sources.load_spectrum(data_dir / meta_name)
+            except FileNotFoundError:
+                # Removed again before we got to it; the next refresh reports the removal.
+                continue
+            except ValueError as e:
+                logger.warning("Ignoring malformed %s: %s", meta_name, e)
+                continue
+            (delta.changed if meta_name in previous else delta.added).append(spectrum)
+        delta.removed = [meta_name.removesuffix(".meta") for meta_name in previous if meta_name not in snapshot]
+        return delta
+
+    def _notify(self, delta: LibraryDelta):
+        if delta:
+            for callback in list(self._subscribers):
+                try:
+                    callback(delta)
+                except Exception:
+                    logger.exception("Library change subscriber failed")
+
+    async def _watch_inotify(self):
+        async for _ in watchfiles.awatch(
+            data_sources.DATA_DIR,
+            watch_filter=lambda _, path: path.endswith(".meta"),
+            debounce=int(self.debounce * 1000),
+            stop_event=self._stop_event,
+            recursive=False,
+        ):
+            await self.refresh_async()
+
+    async def _watch_polling(self):
+        def directory_mtime():
+            return os.stat(data_sources.DATA_DIR).st_mtime_ns
+
+        # Every save, edit and delete renames files in DATA_DIR, which bumps the directory mtime.
+        last_seen = directory_mtime()
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self.poll_interval)
+            current = directory_mtime()
+            if current == last_seen:
+                continue
+            # Wait until the burst is over before computing the delta.
+            while True:
+                await asyncio.sleep(self.debounce)
+                last_seen, current = current, directory_mtime()
+                if current == last_seen:
+                    break
+            await self.refresh_async()
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        data_sources.DATA_DIR.mkdir(parents=True, exist_ok=True)
+        await self.refresh_async()
+        if watchfiles is not None and not self.force_polling:
+            try:
+                await self._watch_inotify()
+                return
+            except OSError:
+                logger.warning("Cannot watch %s with inotify, falling back to polling", data_sources.DATA_DIR)
+        await self._watch_polling()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop_event.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+watcher = LibraryWatcher()
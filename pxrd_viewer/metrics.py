@@ -0,0 +1,226 @@
+"""
+Lightweight in-process metrics, exposed in the Prometheus text format on `/metrics`.
+
+Metrics are on by default; set `PXRD_METRICS=0` to turn them off. Timed functions are then left unwrapped and
+`timer` returns a shared no-op context, so the instrumented hot paths cost nothing.
+"""
+
+import bisect
+import contextlib
+import functools
+import itertools
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("PXRD_METRICS", "1") == "1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+
+# Serializing a plot only to measure its size doubles the encoding work, so only every n-th payload is measured.
+PAYLOAD_SAMPLE_EVERY = 10
+
+_registry: dict[str, "_Metric"] = {}
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        )
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, optionally split by a fixed set of label names.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation)
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {} if label_names else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels[label] for label in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[label] for label in self.label_names), 0.0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """
+    A value that is read from `function` whenever the metrics are rendered.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_format_value(self.function())}"]
+
+
+class Histogram(_Metric):
+    """
+    Counts observations in cumulative buckets, like a Prometheus histogram.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+_disabled_timer = contextlib.nullcontext()
+
+
+def timer(histogram: Histogram):
+    """
+    Returns a context manager that observes its wall-clock duration in `histogram`. Also works around `await`.
+    """
+    if not ENABLED:
+        return _disabled_timer
+    return _Timer(histogram)
+
+
+def timed(histogram: Histogram):
+    """
+    Decorator observing the duration of every call in `histogram`. Returns the function unchanged if disabled.
+    """
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+_payload_counter = itertools.count()
+
+
+def sample_payload() -> bool:
+    """
+    Whether the current plot payload should be measured, see PAYLOAD_SAMPLE_EVERY.
+    """
+    return ENABLED and next(_payload_counter) % PAYLOAD_SAMPLE_EVERY == 0
+
+
+def render() -> str:
+    """
+    Renders all registered metrics in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in _registry.values()) + "\n"
+
+
+CATALOG_LIST_SECONDS = Histogram("pxrd_catalog_list_seconds", "Duration of listing the spectrum catalog.")
+CATALOG_CACHE_REQUESTS = Counter(
+    "pxrd_catalog_cache_requests_total", "Catalog listings by cache result.", label_names=("result",)
+)
+SEARCH_INDEX_CACHE_REQUESTS = Counter(
+    "pxrd_search_index_cache_requests_total", "Search index lookups by cache result.", label_names=("result",)
+)
+SPECTRUM_LOAD_SECONDS = Histogram("pxrd_spectrum_load_seconds", "Duration of loading the arrays of a spectrum.")
+UPLOAD_PARSE_SECONDS = Histogram("pxrd_upload_parse_seconds", "Duration of parsing an uploaded spectrum file.")
+SAVE_SPECTRUM_SECONDS = Histogram("pxrd_save_spectrum_seconds", "Duration of saving a single new spectrum.")
+SAVE_SPECTRA_SECONDS = Histogram("pxrd_save_spectra_seconds", "Duration of saving a batch of new spectra.")
+FIGURE_BUILD_SECONDS = Histogram("pxrd_figure_build_seconds", "Duration of building the traces of the viewer plot.")
+FIGURE_SERIALIZE_SECONDS = Histogram(
+    "pxrd_figure_serialize_seconds", "Duration of converting the viewer plot into its JSON payload."
+)
+FIGURE_PAYLOAD_BYTES = Histogram(
+    "pxrd_figure_payload_bytes",
+    f"Size of the serialized viewer plot, sampled every {PAYLOAD_SAMPLE_EVERY} updates.",
+    buckets=SIZE_BUCKETS,
+)
@@ -1,104 +1,238 @@
 from menutheme import register_nav_page, menutheme
-from nicegui import ui, events
+from nicegui import ui, events, run, context
 from pathlib import Path
 from data_sources import (
     ALL_ELEMENTS,
+    content_hash,
+    find_duplicate,
+    hash_file,
+    list_available_spectra,
     list_used_tags,
-    load_raw_file,
-    load_xyd_file,
-    save_new_spectrum,
+    parse_spectrum_file,
+    save_new_spectra,
+    spectrum_file_axis,
 )
-import io
+import os
+import re
+import shutil
+import tempfile
+import time
 import altui
+import jobs
+import metrics
+import units
 
-# Increase upload size limit to 5 MB (https://nicegui.io/documentation/upload#uploading_large_files)
-from starlette.formparsers import MultiPartParser
+# Uploads larger than starlette's spool size (1 MB) are streamed to a temporary file instead of being held in memory
+# (https://nicegui.io/documentation/upload#uploading_large_files), so files are only limited per file.
+MAX_FILE_SIZE = 200 * 1024 * 1024  # 200 MB
 
-MultiPartParser.spool_max_size = 1024 * 1024 * 5  # 5 MB
+NAME_PATTERN = re.compile(r'^[^<>:"/\\|?*\s]+$')
+NAME_MAX_LENGTH = 50
+
+
+def parse_timed(path: Path):
+    """
+    Parses a spectrum file in the worker process and returns the result with the duration of the parsing itself, so
+    the parse metric does not include the time spent waiting for a free worker.
+    """
+    start = time.perf_counter()
+    result = parse_spectrum_file(path)
+    return result, time.perf_counter() - start
+
+
+def infer_spectrum_name(file_name: str) -> str:
+    """
+    Derives a valid spectrum name from an uploaded file name.
+    """
+    name = re.sub(r'[<>:"/\\|?*\s]+', "_", Path(file_name).stem).strip("_")
+    return name[:NAME_MAX_LENGTH] or "spectrum"
+
+
+def name_error(name: str) -> str | None:
+    if not name:
+        return "Please enter a spectrum name."
+    if len(name) > NAME_MAX_LENGTH:
+        return f"Please use maximum {NAME_MAX_LENGTH} characters."
+    if not NAME_PATTERN.match(name):
+        return 'Name must not contain < > : " / \\ | ? * or spaces.'
+    return None
 
 
 @register_nav_page("/add-spectrum", display_name="Add Spectrum", favicon="📈")
 def add_spectrum_page():
-    with menutheme("Add a New Spectrum"):
-        ui.label("Add a New Spectrum").classes("text-2xl font-bold mb-4")
-        DATA_DIR = Path(__file__).parent.parent / "data"
-        if not DATA_DIR.exists():
-            DATA_DIR.mkdir(parents=True)
-        with ui.card().classes("w-full max-w-xl"):
-            spectrum_name = (
-                ui.input("Spectrum name (unique, no spaces)")
-                .classes("w-full")
-                .props(
-                    'required :rules="['
-                    "val => val.length <= 50 || 'Please use maximum 50 characters',"
-                    "val => /^[^<>:\\\"/\\\\\\\\|?*\\\\s]+$/.test(val) || 'Name must not contain < > : \\\" / \\\\ | ? * or spaces',"  # noqa: E501
-                    ']"'
-                )
-            )
+    with menutheme("Add New Spectra"):
+        ui.label("Add New Spectra").classes("text-2xl font-bold mb-4")
+        # Uploaded files are spooled here until they are saved or the page is closed
+        spool_dir = Path(tempfile.mkdtemp(prefix="pxrd-upload-"))
+        context.client.on_delete(lambda: shutil.rmtree(spool_dir, ignore_errors=True))
+        rows = {}
 
-            display_name = ui.input("Display name (optional)").classes("w-full")
+        with ui.card().classes("w-full max-w-4xl"):
+            ui.label("Shared metadata for all uploaded files").classes("text-lg")
             description = ui.textarea("Description").classes("w-full")
-            uploaded_file_content = {"file": None}
+            selected_elements = ui.select(ALL_ELEMENTS, label="Contained elements", multiple=True).classes("w-full")
+            tags = altui.tag_select(list(list_used_tags()), label="Tags").classes("w-full")
+            # .raw files record their wavelength and are converted to Q; .xyd files carry no axis information
+            with ui.row().classes("w-full"):
+                xyd_unit = ui.select(units.UNITS, value=units.TWO_THETA, label="x axis of .xyd files").classes("w-48")
+                xyd_wavelength = ui.number(
+                    "Wavelength of .xyd files (Å)", value=units.CU_K_ALPHA, min=0.01, step=0.0001, format="%.5f"
+                ).classes("w-48")
+
+            def validate_names():
+                existing = {s.name for s in list_available_spectra()}
+                counts = {}
+                first_with_content = {}
+                for row in rows.values():
+                    counts[row["name"].value] = counts.get(row["name"].value, 0) + 1
+                    if row["data"] is not None:
+                        first_with_content.setdefault(row["content_hash"], row)
+                for row in rows.values():
+                    if row["data"] is None:
+                        continue
+                    name = row["name"].value
+                    error = name_error(name)
+                    if row["duplicate_of"]:
+                        error = f"Duplicate of existing spectrum '{row['duplicate_of']}'."
+                    elif first_with_content[row["content_hash"]] is not row:
+                        error = f"Same content as '{first_with_content[row['content_hash']]['name'].value}'."
+                    elif error is None and name in existing:
+                        error = f"Spectrum '{name}' already exists."
+                    elif error is None and counts[name] > 1:
+                        error = f"Name '{name}' is used for several files."
+                    row["error"] = error
+                    row["status"].text = error or "Ready"
+                    row["status"].classes(replace="text-negative" if error else "text-positive")
+                valid = [row for row in rows.values() if row["data"] is not None and row["error"] is None]
+                save_button.text = f"Save {len(valid)} spectra" if len(valid) != 1 else "Save 1 spectrum"
+                save_button.set_enabled(bool(valid))
+
+            def add_row(file_name: str) -> dict:
+                with file_table:
+                    with ui.row().classes("w-full items-center no-wrap") as container:
+                        ui.label(file_name).classes("w-48 truncate").tooltip(file_name)
+                        name = ui.input("Name", value=infer_spectrum_name(file_name), on_change=validate_names)
+                        display_name = ui.input("Display name (optional)")
+                        status = ui.label("Parsing...").classes("w-56")
+                        preview = ui.element("div").classes("w-40")
+                        ui.button(icon="close", on_click=lambda: remove_row(row_id)).props("flat dense")
+                row_id = id(container)
+                rows[row_id] = {
+                    "container": container,
+                    "name": name,
+                    "display_name": display_name,
+                    "status": status,
+                    "preview": preview,
+                    "data": None,
+                    "raw_counts": None,
+                    "raw_hash": None,
+                    "x_unit": None,
+                    "wavelength": None,
+                    "content_hash": None,
+                    "duplicate_of": None,
+                    "error": None,
+                }
+                return rows[row_id]
+
+            def remove_row(row_id: int):
+                rows.pop(row_id)["container"].delete()
+                validate_names()
 
             async def handle_upload(e: events.UploadEventArguments):
-                file = e.file
-                file_bytes = io.BytesIO(await file.read())
+                row = add_row(e.file.name)
+                fd, spool_path = tempfile.mkstemp(dir=spool_dir, suffix=Path(e.file.name).suffix)
+                os.close(fd)
+                spool_file = Path(spool_path)
                 try:
-                    if file.name.endswith(".xyd"):
-                        spectra_content = load_xyd_file(file_bytes)
-                    elif file.name.endswith(".raw"):
-                        spectra_content = load_raw_file(file_bytes)
-                    else:
-                        raise ValueError("Unsupported file format")
+                    await e.file.save(spool_file)
+                    (x, y, raw_counts), parse_seconds = await run.cpu_bound(parse_timed, spool_file)
+                    metrics.UPLOAD_PARSE_SECONDS.observe(parse_seconds)
+                    raw_hash = await run.io_bound(hash_file, spool_file)
+                    x_unit, wavelength = await run.io_bound(spectrum_file_axis, spool_file)
                 except Exception as ex:
-                    ui.notify(f"Error loading file: {ex}", color="negative")
-                    uploaded_file.reset()
-                    print(ex)
+                    row["status"].text = f"Error: {ex}"
+                    row["status"].classes(replace="text-negative")
                     return
-                uploaded_file_content["file"] = spectra_content
+                finally:
+                    spool_file.unlink(missing_ok=True)
+                if not any(r is row for r in rows.values()):
+                    return  # removed while parsing
+                row["data"] = (x, y)
+                row["raw_counts"] = raw_counts
+                row["raw_hash"] = raw_hash
+                row["x_unit"], row["wavelength"] = x_unit, wavelength
+                row["content_hash"] = content_hash(x, y)
+                # Checked against the on-disk hash index, without scanning the library
+                row["duplicate_of"] = find_duplicate(x, y, raw_hash)
+                with row["preview"]:
+                    altui.sparkline(x, y)
+                validate_names()
 
-            uploaded_file = (
+            uploaded_files = (
                 ui.upload(
-                    label="Choose a spectrum file",
-                    multiple=False,
+                    label="Choose spectrum files",
+                    multiple=True,
                     on_upload=handle_upload,
                     auto_upload=True,
-                    max_total_size=5 * 1024 * 1024,
+                    max_file_size=MAX_FILE_SIZE,
                 )
                 .props("accept=.xyd,.raw")
                 .classes("w-full")
             )
-            selected_elements = ui.select(ALL_ELEMENTS, label="Contained elements", multiple=True).classes("w-full")
-            tags = altui.tag_select(list(list_used_tags()), label="Tags").classes("w-full")
+
+        with ui.card().classes("w-full max-w-4xl"):
+            file_table = ui.column().classes("w-full")
 
             async def on_submit():
-                file = uploaded_file_content["file"]
-                if not file:
-                    ui.notify("Please upload a spectrum file.", color="negative")
-                elif not spectrum_name.value:
-                    ui.notify("Please enter a spectrum name.", color="negative")
+                validate_names()
+                valid = [row for row in rows.values() if row["data"] is not None and row["error"] is None]
+                if not valid:
+                    ui.notify("Please upload at least one valid spectrum file.", color="negative")
                 elif not selected_elements.value:
                     ui.notify("Please select at least one element.", color="negative")
                 else:
-                    save_new_spectrum(
-                        name=spectrum_name.value,
-                        uploaded_file=file,
-                        contained_elements=set(selected_elements.value),
-                        tags=tags.value,
-                        description=description.value,
-                        display_name=display_name.value if display_name.value else None,
-                    )
-                    ui.notify("Spectrum uploaded successfully!", color="positive")
-                    # Manually reset all fields
-                    spectrum_name.value = ""
-                    await spectrum_name.run_method("resetValidation")  # it only works if execute twice???
-                    display_name.value = ""
-                    description.value = ""
-                    uploaded_file.reset()
-                    uploaded_file_content["file"] = None
-                    selected_elements.value = []
-                    tags.value = []
+                    save_button.disable()
+                    try:
+                        saved = await run.io_bound(
+                            save_new_spectra,
+                            {row["name"].value: row["data"] for row in valid},
+                            contained_elements=set(selected_elements.value),
+                            tags=tags.value,
+                            description=description.value,
+                            display_names={
+                                row["name"].value: row["display_name"].value
+                                for row in valid
+                                if row["display_name"].value
+                            },
+                            raw_hashes={row["name"].value: row["raw_hash"] for row in valid},
+                            x_units={row["name"].value: row["x_unit"] or xyd_unit.value for row in valid},
+                            wavelengths={
+                                row["name"].value: row["wavelength"] if row["x_unit"] else xyd_wavelength.value
+                                for row in valid
+                            },
+                            write_thumbnails=False,
+                            raw_counts={
+                                row["name"].value: row["raw_counts"] for row in valid if row["raw_counts"] is not None
+                            },
+                        )
+                    except Exception as ex:
+                        ui.notify(f"Error saving spectra: {ex}", color="negative")
+                        return
+                    finally:
+                        validate_names()
+                    # Rendered in the background; the gallery renders the ones it needs before that
+                    jobs.queue.submit("thumbnails")
+                    ui.notify(f"{len(saved)} spectra uploaded successfully!", color="positive")
+                    saved_rows = {id(row) for row in valid}
+                    for row_id, row in list(rows.items()):
+                        if id(row) in saved_rows:
+                            remove_row(row_id)
+                    if not rows:
+                        uploaded_files.reset()
+                        description.value = ""
+                        selected_elements.value = []
+                        tags.value = []
                     tags.options = list(list_used_tags())
-                    await spectrum_name.run_method("resetValidation")
 
-            ui.button("Upload Spectrum", on_click=on_submit, color="primary").classes("mt-4")
+            save_button = ui.button("Save 0 spectra", on_click=on_submit, color="primary").classes("mt-4")
+            save_button.set_enabled(False)
@@ -0,0 +1,153 @@
+from collections import Counter
+
+import plotly.graph_objects as go
+from menutheme import register_nav_page, menutheme
+from nicegui import ui, run
+import altui
+import jobs
+import similarity
+
+# Leaf labels are only readable up to this many spectra
+MAX_LABELED_LEAVES = 150
+
+
+def cluster_rows(spectra, labels) -> list[dict]:
+    """
+    Table rows of the clusters with more than one spectrum, with their most common tags; a cluster whose members
+    carry different tags may contain a mislabelled sample.
+    """
+    members = {}
+    for spectrum, label in zip(spectra, labels):
+        members.setdefault(int(label), []).append(spectrum)
+    rows = []
+    for label, group in sorted(members.items()):
+        if len(group) < 2:
+            continue
+        tags = Counter(tag for spectrum in group for tag in spectrum.tags)
+        rows.append(
+            {
+                "cluster": label + 1,
+                "size": len(group),
+                "spectra": ", ".join(spectrum.readable_name for spectrum in group[:12])
+                + (f" … (+{len(group) - 12})" if len(group) > 12 else ""),
+                "tags": ", ".join(f"{tag} ({count})" for tag, count in tags.most_common(4)),
+            }
+        )
+    return rows
+
+
+def compute_clustering():
+    spectra, triangle = similarity.load_triangle()
+    links = similarity.linkage(triangle)
+    return spectra, links, similarity.leaf_order(links)
+
+
+@register_nav_page("/clusters", display_name="Clusters", favicon="🌳")
+async def clusters_page():
+    with menutheme("Clusters"):
+        with ui.row().classes("w-full items-center"):
+            status = ui.label()
+            update_button = ui.button("Update similarity matrix", icon="refresh").props("flat")
+            progress = ui.linear_progress(show_value=False).classes("w-48")
+            progress.visible = False
+        with ui.row().classes("w-full items-center"):
+            cut = ui.slider(min=0.5, max=1.0, step=0.005, value=0.9).classes("w-64")
+            ui.label().bind_text_from(cut, "value", lambda v: f"Minimum similarity within a cluster: {v:.3f}")
+            rotate_button = ui.button("View in this order", icon="swap_vert").props("flat")
+        fig = go.Figure()
+        fig.update_layout(
+            margin_t=20, margin_b=20, margin_l=20, yaxis_title="1 − similarity", showlegend=False, hovermode="closest"
+        )
+        plot = ui.plotly(fig).style("height: 450px;").classes("w-full")
+        table = ui.table(
+            columns=[
+                {"name": "cluster", "label": "Cluster", "field": "cluster", "sortable": True},
+                {"name": "size", "label": "Spectra", "field": "size", "sortable": True},
+                {"name": "spectra", "label": "Members", "field": "spectra", "align": "left"},
+                {"name": "tags", "label": "Tags", "field": "tags", "align": "left"},
+            ],
+            rows=[],
+            row_key="cluster",
+            pagination=20,
+        ).classes("w-full")
+
+        state = {"spectra": [], "links": None, "order": None}
+
+        def draw():
+            spectra, links, order = state["spectra"], state["links"], state["order"]
+            fig.data = tuple()
+            fig.layout.shapes = ()
+            if len(spectra) < 2:
+                table.rows = []
+                plot.update()
+                return
+            x, y = similarity.dendrogram_lines(links, order)
+            fig.add_trace(go.Scatter(x=x, y=y, mode="lines", line=dict(color="#1976d2", width=1), hoverinfo="none"))
+            fig.add_trace(
+                go.Scatter(
+                    x=list(range(len(order))),
+                    y=[0.0] * len(order),
+                    mode="markers",
+                    marker=dict(size=4, color="#1976d2"),
+                    text=[spectra[i].readable_name for i in order],
+                    hoverinfo="text",
+                )
+            )
+            fig.add_hline(y=1 - cut.value, line_dash="dash", line_color="#FF0000")
+            labeled = len(order) <= MAX_LABELED_LEAVES
+            fig.update_xaxes(
+                tickvals=list(range(len(order))) if labeled else [],
+                ticktext=[spectra[i].readable_name for i in order] if labeled else [],
+            )
+            plot.update()
+            table.rows = cluster_rows(spectra, similarity.flat_clusters(links, cut.value))
+
+        async def refresh():
+            missing = await run.io_bound(similarity.missing_spectra)
+            try:
+                state["spectra"], state["links"], state["order"] = await run.cpu_bound(compute_clustering)
+            except ValueError as e:
+                status.text = str(e)
+                update_button.visible = bool(missing)
+                return
+            status.text = f"{len(state['spectra'])} spectra clustered" + (
+                f", {len(missing)} not in the similarity matrix yet" if missing else ""
+            )
+            update_button.visible = bool(missing)
+            draw()
+
+        def watch(job: jobs.Job):
+            update_button.props("loading")
+            progress.visible = True
+            progress.value = 0
+            poll = ui.timer(0.5, lambda: progress.set_value(job.fraction or 0))
+
+            async def finished(_):
+                poll.cancel()
+                update_button.props(remove="loading")
+                progress.visible = False
+                await refresh()
+
+            altui.notify_when_finished(job, finished)
+
+        def update_matrix():
+            # Runs as a background job, so it goes on when the page is closed (see the jobs page)
+            watch(jobs.queue.submit("similarity"))
+
+        async def view_in_order():
+            # Computes (and stores) the order the viewer asks for
+            if similarity.stored_order() is None:
+                try:
+                    await run.cpu_bound(similarity.update_order)
+                except ValueError as e:
+                    ui.notify(str(e), color="negative")
+                    return
+            ui.navigate.to("/?order=clusters")
+
+        update_button.on_click(update_matrix)
+        rotate_button.on_click(view_in_order)
+        cut.on_value_change(draw)
+        await refresh()
+        running = [job for job in jobs.queue.jobs() if job.kind == "similarity" and not job.is_finished]
+        if running:
+            watch(running[0])
@@ -1,14 +1,18 @@
 from menutheme import register_nav_page, menutheme
-from nicegui import ui
+from nicegui import ui, context
 from data_sources import (
     Spectrum,
     delete_spectrum,
+    edit_spectra,
     edit_spectrum,
     list_available_spectra,
     ALL_ELEMENTS,
     list_used_tags,
 )
 import altui
+import jobs
+import library_watcher
+import units
 
 
 @register_nav_page("/edit-spectra", display_name="Edit Spectra", favicon="✏️")
@@ -27,12 +31,12 @@ def edit_spectra_page():
             description.value = getattr(spectrum, "description", "")
             selected_elements.value = list(spectrum.contained_elements)
             tags.value = list(spectrum.tags)
+            x_unit.value = spectrum.x_unit
+            wavelength.value = spectrum.wavelength
 
-        spectrum_names = [s.name for s in spectra]
-        selected_name = ui.select(
-            spectrum_names,
-            label="Select a spectrum to edit",
-            value=spectrum_names[0],
+        selected_name = altui.SpectrumPicker(
+            "Select a spectrum to edit",
+            value=spectra[0].name,
             on_change=lambda e: update_selected_spectrum(next(s for s in spectra if s.name == e.value)),
         ).classes("w-full")
         spectrum_name = ui.input("Spectrum name").classes("w-full")
@@ -40,6 +44,10 @@ def edit_spectra_page():
         description = ui.textarea("Description").classes("w-full")
         selected_elements = ui.select(ALL_ELEMENTS, label="Contained elements", multiple=True).classes("w-full")
         tags = altui.tag_select(list(list_used_tags()), label="Tags").classes("w-full")
+        # Corrects the recorded axis of the stored data; the data itself is not converted
+        with ui.row().classes("w-full"):
+            x_unit = ui.select(units.UNITS, label="Stored x axis").classes("w-48")
+            wavelength = ui.number("Wavelength (Å)", min=0.01, step=0.0001, format="%.5f").classes("w-48")
         # Initialize fields
         update_selected_spectrum(spectra[0])
 
@@ -61,29 +69,37 @@ def edit_spectra_page():
                     tags=list(tags.value),
                     description=description.value,
                     display_name=display_name.value if display_name.value else None,
+                    x_unit=x_unit.value,
+                    wavelength=wavelength.value,
                 )
                 spectra = list_available_spectra()
-                selected_name.options = [s.name for s in spectra]
                 selected_name.value = new_spectrum.name  # todo make the whole data management nicer
+                selected_name.refresh()
+                batch_selection.value = []
+                batch_selection.refresh()
                 tags.options = list(list_used_tags())
                 ui.notify("Spectrum metadata updated!", color="positive")
             except Exception as e:
                 ui.notify(f"Error updating spectrum: {e}", color="negative")
 
         async def on_delete():
-            nonlocal spectra, spectrum_names
+            nonlocal spectra
             try:
                 selected_spectrum = next(s for s in spectra if s.name == selected_name.value)
                 delete_spectrum(selected_spectrum)
                 ui.notify(f"Spectrum '{selected_spectrum.name}' deleted!", color="positive")
+                # Removing the unused thumbnail and similarity rows can wait
+                jobs.queue.submit("thumbnails", prune=True)
+                jobs.queue.submit("similarity-compact")
                 spectra = list_available_spectra()
                 if not spectra:
                     ui.notify("No spectra available to edit.", color="info")
                     ui.navigate.reload()
                     return
-                spectrum_names = [s.name for s in spectra]
-                selected_name.options = spectrum_names
                 selected_name.value = spectra[0].name
+                selected_name.refresh()
+                batch_selection.value = []
+                batch_selection.refresh()
                 tags.options = list(list_used_tags())
             except Exception as e:
                 ui.notify(f"Error deleting spectrum: {e}", color="negative")
@@ -91,3 +107,77 @@ def edit_spectra_page():
         with ui.row().classes("w-full"):
             ui.button("Save Changes", on_click=on_save, color="primary").classes("mt-4")
             ui.button("Delete Spectrum", on_click=on_delete, color="negative").classes("mt-4")
+
+        ui.label("Batch Edit").classes("text-xl font-bold mt-8 mb-2")
+        with ui.card().classes("w-full"):
+            batch_selection = (
+                altui.SpectrumPicker("Spectra to edit", multiple=True).props("use-chips").classes("w-full")
+            )
+            with ui.row():
+                ui.button(
+                    "Select all matches", on_click=lambda: batch_selection.set_value(batch_selection.matching_names())
+                )
+                ui.button("Clear selection", on_click=lambda: batch_selection.set_value([]))
+            with ui.row().classes("w-full no-wrap"):
+                batch_add_tags = altui.tag_select(list(list_used_tags()), label="Add tags").classes("w-1/2")
+                batch_remove_tags = ui.select(list(list_used_tags()), label="Remove tags", multiple=True).classes(
+                    "w-1/2"
+                )
+            with ui.row().classes("w-full no-wrap"):
+                batch_add_elements = ui.select(ALL_ELEMENTS, label="Add elements", multiple=True).classes("w-1/2")
+                batch_remove_elements = ui.select(ALL_ELEMENTS, label="Remove elements", multiple=True).classes("w-1/2")
+            replace_description = ui.checkbox("Replace description")
+            batch_description = (
+                ui.textarea("New description").classes("w-full").bind_visibility_from(replace_description, "value")
+            )
+
+            async def on_batch_apply():
+                nonlocal spectra
+                selected_names = set(batch_selection.value)
+                selected = [s for s in spectra if s.name in selected_names]
+                if not selected:
+                    ui.notify("Please select at least one spectrum.", color="negative")
+                    return
+                try:
+                    # One transaction and one catalog invalidation for the whole selection
+                    edit_spectra(
+                        selected,
+                        add_elements=set(batch_add_elements.value),
+                        remove_elements=set(batch_remove_elements.value),
+                        add_tags=list(batch_add_tags.value),
+                        remove_tags=list(batch_remove_tags.value),
+                        description=batch_description.value if replace_description.value else None,
+                    )
+                except Exception as e:
+                    ui.notify(f"Error updating spectra, no changes were made: {e}", color="negative")
+                    return
+                spectra = list_available_spectra()
+                if selected_name.value in set(batch_selection.value):
+                    update_selected_spectrum(next(s for s in spectra if s.name == selected_name.value))
+                used_tags = list(list_used_tags())
+                tags.options = used_tags
+                batch_add_tags.options = used_tags
+                batch_remove_tags.options = used_tags
+                for field in (batch_add_tags, batch_remove_tags, batch_add_elements, batch_remove_elements):
+                    field.value = []
+                ui.notify(f"Updated {len(selected)} spectra!", color="positive")
+
+            ui.button("Apply to selected spectra", on_click=on_batch_apply, color="primary").classes("mt-4")
+
+        # Keep the selector in sync with changes made in other tabs or worker processes
+        def on_library_change(delta: library_watcher.LibraryDelta):
+            nonlocal spectra
+            with client:
+                spectra = library_watcher.apply_delta(spectra, delta)
+                if not spectra:
+                    ui.navigate.reload()
+                    return
+                batch_selection.value = [n for n in batch_selection.value if n not in delta.removed]
+                if selected_name.value in delta.removed:
+                    selected_name.value = spectra[0].name
+                selected_name.refresh()
+                batch_selection.refresh()
+                tags.options = list(list_used_tags())
+
+        client = context.client
+        client.on_delete(library_watcher.watcher.subscribe(on_library_change))
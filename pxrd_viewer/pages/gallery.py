@@ -0,0 +1,79 @@
+from html import escape
+
+from menutheme import register_nav_page, menutheme
+from nicegui import ui, context
+from data_sources import ALL_ELEMENTS, Spectrum, list_used_tags
+import api
+import library_watcher
+import search_index
+
+# Cards are rendered as one HTML element in pages of this size; the thumbnails are images the browser loads lazily
+# (and caches forever), so the page never touches the spectrum arrays.
+PAGE_SIZE = 300
+
+GALLERY_CSS = """
+.gallery { display: grid; grid-template-columns: repeat(auto-fill, minmax(180px, 1fr)); gap: 12px; }
+.gallery-card { border: 1px solid rgba(128, 128, 128, 0.3); border-radius: 6px; padding: 8px; overflow: hidden; }
+.gallery-card img { width: 100%; height: 48px; display: block; }
+.gallery-card .name { font-weight: 600; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+.gallery-card .meta { font-size: 0.75rem; opacity: 0.75; }
+"""
+
+
+def card_html(spectrum: Spectrum) -> str:
+    name = escape(spectrum.readable_name)
+    details = [escape(", ".join(spectrum.tags)), escape(" ".join(sorted(spectrum.contained_elements)))]
+    return (
+        f'<div class="gallery-card" title="{escape(spectrum.name)}">'
+        f'<img src="{api.thumbnail_url(spectrum)}" loading="lazy" width="160" height="48" alt="">'
+        f'<div class="name">{name}</div>'
+        + "".join(f'<div class="meta">{detail}</div>' for detail in details if detail)
+        + "</div>"
+    )
+
+
+@register_nav_page("/gallery", display_name="Gallery", favicon="🖼️")
+def gallery_page():
+    with menutheme("Gallery"):
+        ui.add_css(GALLERY_CSS)
+        with ui.row().classes("w-full items-center"):
+            query = ui.input("Search name, display name or tags").props("clearable debounce=200").classes("w-72")
+            tags = ui.select(sorted(list_used_tags()), label="Tags", multiple=True).props("use-chips").classes("w-64")
+            elements = ui.select(ALL_ELEMENTS, label="Elements", multiple=True, with_input=True).props("use-chips")
+            elements.classes("w-64")
+            count = ui.label()
+            with ui.dropdown_button("Export", icon="download", auto_close=True).props("flat"):
+                ui.item(".xy files (zip)", on_click=lambda: download("xy-zip"))
+                ui.item("Matrix on a common Q grid (npz)", on_click=lambda: download("npz"))
+        grid = ui.html("", sanitize=False).classes("w-full")
+        more = ui.button("Show more", on_click=lambda: render(limit + PAGE_SIZE)).props("flat")
+        limit = PAGE_SIZE
+
+        def matching() -> list[Spectrum]:
+            return search_index.catalog_index().filter(query.value or "", tags.value, elements.value)
+
+        def download(format: str):
+            # The browser fetches the file from the API, which streams it while it is written
+            ui.download.from_url(api.export_url(query.value or "", tags.value, elements.value, format))
+
+        def render(new_limit: int = PAGE_SIZE):
+            nonlocal limit
+            limit = new_limit
+            spectra = matching()
+            count.text = f"{len(spectra)} spectra"
+            grid.content = '<div class="gallery">' + "".join(card_html(s) for s in spectra[:limit]) + "</div>"
+            more.visible = len(spectra) > limit
+
+        render()
+        for control in (query, tags, elements):
+            control.on_value_change(lambda: render())
+
+        # New, edited and deleted spectra show up without reloading the page
+        def on_library_change(delta: library_watcher.LibraryDelta):
+            with client:
+                used_tags = sorted(list_used_tags())
+                tags.set_options(used_tags, value=[tag for tag in tags.value if tag in used_tags])
+                render(limit)
+
+        client = context.client
+        client.on_delete(library_watcher.watcher.subscribe(on_library_change))
@@ -0,0 +1,139 @@
+import time
+
+from menutheme import register_nav_page, menutheme
+from nicegui import ui
+import altui
+import jobs
+import units
+from data_sources import ALL_ELEMENTS, list_used_tags
+
+
+def job_row(job: jobs.Job) -> dict:
+    if job.total:
+        progress = f"{job.done} / {job.total} ({job.fraction:.0%})"
+    else:
+        progress = ""
+    end = job.finished if job.is_finished else time.time()
+    return {
+        "id": job.id,
+        "title": job.title,
+        "state": job.state + (" (cancelling)" if job.cancel_requested and not job.is_finished else ""),
+        "progress": progress,
+        "eta": altui.format_duration(job.eta) if job.eta is not None else "",
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.started)) if job.started else "",
+        "duration": altui.format_duration(end - job.started) if job.started else "",
+        "details": job.error or job.result or job.message,
+    }
+
+
+@register_nav_page("/jobs", display_name="Jobs", favicon="⏳")
+def jobs_page():
+    with menutheme("Background Jobs"):
+        ui.label("Background Jobs").classes("text-2xl font-bold mb-4")
+        with ui.row().classes("w-full items-center"):
+            ui.button(
+                "Create missing thumbnails",
+                icon="image",
+                on_click=lambda: submit("thumbnails", prune=True),
+            ).props("flat")
+            ui.button("Validate linked spectra", icon="link", on_click=lambda: submit("validate-linked")).props("flat")
+            ui.button("Update similarity matrix", icon="refresh", on_click=lambda: submit("similarity")).props("flat")
+            ui.button("Check library integrity", icon="fact_check", on_click=lambda: submit("integrity")).props("flat")
+            ui.button(
+                "Quarantine broken entries",
+                icon="report",
+                on_click=lambda: submit("integrity", title="Quarantine broken entries", quarantine=True),
+            ).props("flat")
+            cancel_button = ui.button("Cancel selected", icon="cancel", color="negative").props("flat")
+        table = ui.table(
+            columns=[
+                {"name": "title", "label": "Job", "field": "title", "align": "left"},
+                {"name": "state", "label": "State", "field": "state", "align": "left"},
+                {"name": "progress", "label": "Progress", "field": "progress"},
+                {"name": "eta", "label": "Remaining", "field": "eta"},
+                {"name": "started", "label": "Started", "field": "started"},
+                {"name": "duration", "label": "Duration", "field": "duration"},
+                {"name": "details", "label": "Details", "field": "details", "align": "left"},
+            ],
+            rows=[],
+            row_key="id",
+            selection="multiple",
+            pagination=25,
+        ).classes("w-full")
+
+        ui.label("Link an archive").classes("text-xl font-bold mt-8 mb-2")
+        with ui.card().classes("w-full max-w-4xl"):
+            root = ui.input("Directory on the server").classes("w-full")
+            elements = ui.select(ALL_ELEMENTS, label="Contained elements", multiple=True).classes("w-full")
+            tags = altui.tag_select(list(list_used_tags()), label="Tags").classes("w-full")
+            with ui.row().classes("w-full"):
+                xyd_unit = ui.select(units.UNITS, value=units.TWO_THETA, label="x axis of .xyd files").classes("w-48")
+                xyd_wavelength = ui.number(
+                    "Wavelength of .xyd files (Å)", value=units.CU_K_ALPHA, min=0.01, step=0.0001, format="%.5f"
+                ).classes("w-48")
+            ui.button(
+                "Link",
+                on_click=lambda: submit(
+                    "link-archive",
+                    title=f"Link {root.value}",
+                    root=root.value,
+                    contained_elements=list(elements.value),
+                    tags=list(tags.value),
+                    x_unit=xyd_unit.value,
+                    wavelength=xyd_wavelength.value,
+                ),
+                color="primary",
+            )
+
+        ui.label("Import crystal structures").classes("text-xl font-bold mt-8 mb-2")
+        with ui.card().classes("w-full max-w-4xl"):
+            ui.label(
+                "Simulates the powder patterns of all .cif files below a directory and adds them as spectra tagged "
+                "'simulated'."
+            ).classes("text-sm text-gray-600")
+            cif_root = ui.input("Directory on the server").classes("w-full")
+            with ui.row().classes("w-full"):
+                cif_tags = altui.tag_select(list(list_used_tags()), label="Tags").classes("w-96")
+                cif_wavelength = ui.number(
+                    "Wavelength (Å)", value=units.CU_K_ALPHA, min=0.01, step=0.0001, format="%.5f"
+                ).classes("w-48")
+            ui.button(
+                "Import",
+                on_click=lambda: submit(
+                    "import-cif",
+                    title=f"Import structures from {cif_root.value}",
+                    root=cif_root.value,
+                    tags=list(cif_tags.value),
+                    wavelength=cif_wavelength.value,
+                ),
+                color="primary",
+            )
+
+        def refresh():
+            selected = {row["id"] for row in table.selected}
+            all_jobs = jobs.queue.jobs()
+            table.rows = [job_row(job) for job in all_jobs]
+            # Finished jobs can no longer be cancelled
+            selectable = {job.id for job in all_jobs if job.id in selected and not job.is_finished}
+            table.selected = [row for row in table.rows if row["id"] in selectable]
+            cancel_button.set_enabled(bool(table.selected))
+
+        def submit(kind: str, **args):
+            if kind in ("link-archive", "import-cif") and not args["root"]:
+                ui.notify("Please enter a directory.", color="negative")
+                return
+            job = jobs.queue.submit(kind, **args)
+            ui.notify(f"{job.title} queued", color="info")
+            altui.notify_when_finished(job)
+            refresh()
+
+        def cancel_selected():
+            for row in table.selected:
+                jobs.queue.cancel(row["id"])
+            table.selected = []
+            refresh()
+
+        cancel_button.on_click(cancel_selected)
+        table.on_select(lambda: cancel_button.set_enabled(bool(table.selected)))
+        refresh()
+        ui.timer(1.0, refresh)
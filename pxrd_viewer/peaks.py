@@ -0,0 +1,376 @@
+"""
+Peak fitting with pseudo-Voigt profiles.
+
+All peaks of a window are fitted simultaneously as a linear background plus a sum of area-normalized pseudo-Voigt
+profiles (a mix of a Lorentzian and a Gaussian of the same FWHM). The Levenberg-Marquardt solver works on a whole
+batch of spectra at once: residuals, the analytic Jacobian and the normal equations are (spectra, points, parameters)
+arrays, so there are no Python loops over points or spectra. Spectra of different length are padded and masked.
+"""
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+import units
+from data_sources import Spectrum
+
+logger = logging.getLogger(__name__)
+
+_GAUSS_EXPONENT = 4 * np.log(2)
+_GAUSS_NORM = 2 * np.sqrt(np.log(2) / np.pi)
+_LORENTZ_NORM = 2 / np.pi
+
+# Parameters per peak: area, center, FWHM and the Lorentzian fraction eta
+PEAK_PARAMETERS = 4
+BACKGROUND_PARAMETERS = 2
+
+SCHERRER_CONSTANT = 0.9
+
+
+@dataclass
+class PeakFit:
+    """
+    The fitted peaks of one spectrum, in the units of the fitted x axis.
+    """
+
+    centers: np.ndarray
+    fwhm: np.ndarray
+    areas: np.ndarray
+    eta: np.ndarray
+    center_errors: np.ndarray
+    fwhm_errors: np.ndarray
+    area_errors: np.ndarray
+    background: np.ndarray  # offset and slope of the linear background around `reference_x`
+    reference_x: float
+    r_squared: float
+    iterations: int
+    converged: bool
+
+    def profiles(self, x: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the fitted peaks (without background) on `x`, one row per peak.
+        """
+        return self.areas[:, None] * pseudo_voigt(
+            x[None, :], self.centers[:, None], self.fwhm[:, None], self.eta[:, None]
+        )
+
+    def evaluate(self, x: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the fitted model, background and all peaks, on `x`.
+        """
+        return self.background[0] + self.background[1] * (x - self.reference_x) + self.profiles(x).sum(axis=0)
+
+    def crystallite_sizes(self) -> np.ndarray:
+        """
+        Scherrer estimates of the crystallite size (Å) from peaks fitted on a Q axis: L = 2πK / ΔQ.
+        Instrumental broadening is not subtracted, so these are lower bounds.
+        """
+        return 2 * np.pi * SCHERRER_CONSTANT / self.fwhm
+
+
+def pseudo_voigt(x: np.ndarray, center, fwhm, eta) -> np.ndarray:
+    """
+    Area-normalized pseudo-Voigt profile: eta · Lorentzian + (1 - eta) · Gaussian, both with the given FWHM.
+    """
+    u = (x - center) / fwhm
+    gauss = _GAUSS_NORM / fwhm * np.exp(-_GAUSS_EXPONENT * u**2)
+    lorentz = _LORENTZ_NORM / fwhm / (1 + 4 * u**2)
+    return eta * lorentz + (1 - eta) * gauss
+
+
+def _model_and_jacobian(x: np.ndarray, reference: np.ndarray, p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates the model and its analytic Jacobian for a batch.
+
+    Args:
+        x: (spectra, points) x values.
+        reference: (spectra,) x values the background slope refers to.
+        p: (spectra, parameters) background offset and slope followed by area, center, FWHM and eta per peak.
+
+    Returns:
+        The (spectra, points) model and the (spectra, points, parameters) Jacobian.
+    """
+    peaks = p[:, BACKGROUND_PARAMETERS:].reshape(len(p), -1, PEAK_PARAMETERS)
+    area, center, fwhm, eta = (peaks[:, None, :, i] for i in range(PEAK_PARAMETERS))  # (spectra, 1, peaks)
+    dx = (x - reference[:, None])[:, :, None]
+    u = (x[:, :, None] - center) / fwhm  # (spectra, points, peaks)
+    denominator = 1 + 4 * u**2
+    gauss = _GAUSS_NORM / fwhm * np.exp(-_GAUSS_EXPONENT * u**2)
+    lorentz = _LORENTZ_NORM / fwhm / denominator
+    profile = eta * lorentz + (1 - eta) * gauss
+
+    # Derivatives with respect to the center and the FWHM, using du/dc = -1/w and du/dw = -u/w
+    d_gauss_center = gauss * 2 * _GAUSS_EXPONENT * u / fwhm
+    d_lorentz_center = lorentz * 8 * u / (fwhm * denominator)
+    d_gauss_fwhm = gauss * (2 * _GAUSS_EXPONENT * u**2 - 1) / fwhm
+    d_lorentz_fwhm = lorentz * (8 * u**2 / denominator - 1) / fwhm
+
+    jacobian = np.empty((*x.shape, p.shape[1]))
+    jacobian[:, :, 0] = 1.0
+    jacobian[:, :, 1] = dx[:, :, 0]
+    peak_jacobian = jacobian[:, :, BACKGROUND_PARAMETERS:].reshape(*x.shape, -1, PEAK_PARAMETERS)
+    peak_jacobian[..., 0] = profile
+    peak_jacobian[..., 1] = area * (eta * d_lorentz_center + (1 - eta) * d_gauss_center)
+    peak_jacobian[..., 2] = area * (eta * d_lorentz_fwhm + (1 - eta) * d_gauss_fwhm)
+    peak_jacobian[..., 3] = area * (lorentz - gauss)
+    jacobian[:, :, BACKGROUND_PARAMETERS:] = peak_jacobian.reshape(*x.shape, -1)
+
+    model = p[:, :1] + p[:, 1:2] * dx[:, :, 0] + (area * profile).sum(axis=2)
+    return model, jacobian
+
+
+def _constrain(p: np.ndarray, low: np.ndarray, high: np.ndarray, min_fwhm: np.ndarray) -> np.ndarray:
+    """
+    Keeps areas positive, centers inside their window, FWHMs above the point spacing and eta in [0, 1].
+    """
+    peaks = p[:, BACKGROUND_PARAMETERS:].reshape(len(p), -1, PEAK_PARAMETERS)
+    peaks[..., 0] = np.maximum(peaks[..., 0], 0.0)
+    peaks[..., 1] = np.clip(peaks[..., 1], low[:, None], high[:, None])
+    peaks[..., 2] = np.clip(peaks[..., 2], min_fwhm[:, None], (high - low)[:, None])
+    peaks[..., 3] = np.clip(peaks[..., 3], 0.0, 1.0)
+    return p
+
+
+def levenberg_marquardt(
+    x: np.ndarray,
+    y: np.ndarray,
+    mask: np.ndarray,
+    initial: np.ndarray,
+    max_iterations: int = 200,
+    tolerance: float = 1e-9,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int, np.ndarray]:
+    """
+    Fits the model to a batch of spectra. Every spectrum has its own damping, and stops once its cost changes
+    by less than `tolerance` (relative).
+
+    Args:
+        x, y, mask: (spectra, points) data; points where `mask` is False are ignored.
+        initial: (spectra, parameters) start parameters, see `_model_and_jacobian`.
+
+    Returns:
+        The fitted parameters, their standard errors, the final costs (sum of squared residuals),
+        the number of iterations and which spectra converged.
+    """
+    weights = mask.astype(float)
+    reference = np.nanmean(np.where(mask, x, np.nan), axis=1)
+    low = np.nanmin(np.where(mask, x, np.nan), axis=1)
+    high = np.nanmax(np.where(mask, x, np.nan), axis=1)
+    min_fwhm = 2 * (high - low) / np.maximum(mask.sum(axis=1) - 1, 1)
+    p = _constrain(initial.astype(float).copy(), low, high, min_fwhm)
+
+    model, jacobian = _model_and_jacobian(x, reference, p)
+    residuals = (y - model) * weights
+    cost = (residuals**2).sum(axis=1)
+    damping = np.full(len(p), 1e-3)
+    converged = np.zeros(len(p), dtype=bool)
+    identity = np.eye(p.shape[1])
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        weighted_jacobian = jacobian * weights[:, :, None]
+        normal = np.einsum("snp,snq->spq", weighted_jacobian, weighted_jacobian)
+        gradient = np.einsum("snp,sn->sp", weighted_jacobian, residuals)
+        scaling = np.einsum("spp->sp", normal)[:, :, None] * identity + 1e-12 * identity
+        step = np.linalg.solve(normal + damping[:, None, None] * scaling, gradient[:, :, None])[:, :, 0]
+        step[converged] = 0.0
+        candidate = _constrain(p + step, low, high, min_fwhm)
+        candidate_model, candidate_jacobian = _model_and_jacobian(x, reference, candidate)
+        candidate_residuals = (y - candidate_model) * weights
+        candidate_cost = (candidate_residuals**2).sum(axis=1)
+
+        improved = (candidate_cost < cost) & ~converged
+        newly_converged = improved & ((cost - candidate_cost) <= tolerance * cost)
+        p[improved] = candidate[improved]
+        jacobian[improved] = candidate_jacobian[improved]
+        residuals[improved] = candidate_residuals[improved]
+        cost[improved] = candidate_cost[improved]
+        damping = np.where(improved, damping / 10, damping * 10)
+        # A damping this large means no step reduces the cost anymore: the fit is at a minimum
+        converged |= newly_converged | (damping > 1e10)
+        if converged.all():
+            break
+
+    weighted_jacobian = jacobian * weights[:, :, None]
+    normal = np.einsum("snp,snq->spq", weighted_jacobian, weighted_jacobian)
+    degrees_of_freedom = np.maximum(mask.sum(axis=1) - p.shape[1], 1)
+    covariance = np.linalg.pinv(normal) * (cost / degrees_of_freedom)[:, None, None]
+    errors = np.sqrt(np.abs(np.einsum("spp->sp", covariance)))
+    return p, errors, cost, iteration, converged
+
+
+def detect_peaks(
+    x: np.ndarray, y: np.ndarray, max_peaks: int = 20, min_height: float = 0.05, smoothing: int = 5
+) -> np.ndarray:
+    """
+    Finds the positions of the most prominent local maxima as start values for a fit.
+
+    Args:
+        min_height (float, optional): Minimum height above the background, relative to the highest peak.
+        smoothing (int, optional): Width (points) of the moving average applied before searching maxima.
+
+    Returns:
+        np.ndarray: Up to `max_peaks` peak positions, ascending.
+    """
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    smooth = np.convolve(y, np.ones(smoothing) / smoothing, mode="same") if len(y) > smoothing else y
+    background = np.percentile(smooth, 10)
+    height = smooth - background
+    maxima = np.flatnonzero((height[1:-1] > height[:-2]) & (height[1:-1] >= height[2:])) + 1
+    maxima = maxima[height[maxima] >= min_height * height.max()]
+    maxima = maxima[np.argsort(-height[maxima])][:max_peaks]
+    return np.sort(x[maxima])
+
+
+def _initial_parameters(x: np.ndarray, y: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Start values: a flat background at the lower decile, and per peak its height above that background with
+    a FWHM estimated from where the data first drops below half of it.
+    """
+    background = np.percentile(y, 10)
+    indices = np.clip(np.searchsorted(x, centers), 0, len(x) - 1)
+    heights = np.maximum(y[indices] - background, 0.0)
+    spacing = (x[-1] - x[0]) / max(len(x) - 1, 1)
+    fwhm = np.empty(len(centers))
+    for i, (index, height) in enumerate(zip(indices, heights)):
+        half = y - background < height / 2
+        right = np.argmax(half[index:]) if half[index:].any() else len(x) - 1 - index
+        left = np.argmax(half[index::-1]) if half[index::-1].any() else index
+        fwhm[i] = max(left + right, 2) * spacing
+    # The peak height of an area-normalized pseudo-Voigt with eta = 0.5 is about 0.78 / FWHM
+    areas = heights * fwhm / 0.78
+    peaks = np.column_stack([areas, centers, fwhm, np.full(len(centers), 0.5)])
+    return np.concatenate([[background, 0.0], peaks.ravel()])
+
+
+def _fit_block(
+    cut: list[tuple[np.ndarray, np.ndarray]], centers: np.ndarray, max_iterations: int
+) -> list[PeakFit | None]:
+    points = max(len(x) for x, _ in cut)
+    xs = np.zeros((len(cut), points))
+    ys = np.zeros((len(cut), points))
+    mask = np.zeros((len(cut), points), dtype=bool)
+    initial = np.empty((len(cut), BACKGROUND_PARAMETERS + PEAK_PARAMETERS * len(centers)))
+    for i, (x, y) in enumerate(cut):
+        n = len(x)
+        xs[i, :n], ys[i, :n], mask[i, :n] = x, y, True
+        # Padding repeats the last point, so the (masked) model stays finite
+        xs[i, n:] = x[-1]
+        initial[i] = _initial_parameters(x, y, centers)
+
+    p, errors, cost, iterations, converged = levenberg_marquardt(xs, ys, mask, initial, max_iterations)
+
+    fits = []
+    reference = np.nanmean(np.where(mask, xs, np.nan), axis=1)
+    for i, (x, y) in enumerate(cut):
+        peaks = p[i, BACKGROUND_PARAMETERS:].reshape(-1, PEAK_PARAMETERS)
+        peak_errors = errors[i, BACKGROUND_PARAMETERS:].reshape(-1, PEAK_PARAMETERS)
+        total = ((y - y.mean()) ** 2).sum()
+        fits.append(
+            PeakFit(
+                centers=peaks[:, 1],
+                fwhm=peaks[:, 2],
+                areas=peaks[:, 0],
+                eta=peaks[:, 3],
+                center_errors=peak_errors[:, 1],
+                fwhm_errors=peak_errors[:, 2],
+                area_errors=peak_errors[:, 0],
+                background=p[i, :BACKGROUND_PARAMETERS],
+                reference_x=float(reference[i]),
+                r_squared=float(1 - cost[i] / total) if total > 0 else 1.0,
+                iterations=iterations,
+                converged=bool(converged[i]),
+            )
+        )
+    return fits
+
+
+def fit_batch(
+    spectra: list[tuple[np.ndarray, np.ndarray]],
+    centers: np.ndarray,
+    window: tuple[float, float] = None,
+    max_iterations: int = 200,
+    block_size: int = 64,
+) -> list[PeakFit | None]:
+    """
+    Fits the same peaks (start positions `centers`) in the same x `window` of many spectra in one batch,
+    e.g. to follow the reflections of a phase through a temperature series.
+
+    Args:
+        spectra (list[tuple[np.ndarray, np.ndarray]]): The (x, y) arrays of the spectra; the grids may differ.
+        centers (np.ndarray): Start positions of the peaks.
+        window (tuple[float, float], optional): The x range to fit, by default the range of `centers` plus margins.
+        block_size (int, optional): Number of spectra solved together, which bounds the memory of the Jacobians.
+
+    Returns:
+        list[PeakFit | None]: The fits in the order of `spectra`, None for spectra without data in the window.
+    """
+    centers = np.sort(np.asarray(centers, dtype=float))
+    if len(centers) == 0:
+        raise ValueError("No peaks to fit.")
+    if window is None:
+        margin = max(0.1 * (centers[-1] - centers[0]), 0.05 * abs(centers[-1]) + 1e-6)
+        window = (centers[0] - margin, centers[-1] + margin)
+    cut = []
+    for x, y in spectra:
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        inside = (x >= window[0]) & (x <= window[1]) & np.isfinite(x) & np.isfinite(y)
+        order = np.argsort(x[inside])
+        cut.append((x[inside][order], y[inside][order]))
+    # Each peak needs a few points more than its four parameters
+    fittable = [
+        i for i, (x, _) in enumerate(cut) if len(x) > BACKGROUND_PARAMETERS + 2 * PEAK_PARAMETERS * len(centers)
+    ]
+    fits: list[PeakFit | None] = [None] * len(cut)
+    for start in range(0, len(fittable), block_size):
+        block = fittable[start : start + block_size]
+        for i, fit in zip(block, _fit_block([cut[i] for i in block], centers, max_iterations)):
+            fits[i] = fit
+    return fits
+
+
+def fit_spectra(
+    spectra: list[Spectrum],
+    centers: np.ndarray,
+    window: tuple[float, float],
+    max_iterations: int = 200,
+    block_size: int = 64,
+) -> list[PeakFit | None]:
+    """
+    Fits the same peaks in the Q `window` of many library spectra like `fit_batch`, reading their arrays one block of
+    `block_size` spectra at a time without caching them on the spectra, so it can run in a worker process on the
+    whole library. Spectra that cannot be read are skipped with a warning.
+
+    Returns:
+        list[PeakFit | None]: The fits in the order of `spectra`, None for spectra without data in the window and
+            for unreadable ones.
+    """
+    fits = []
+    for start in range(0, len(spectra), block_size):
+        arrays = []
+        for spectrum in spectra[start : start + block_size]:
+            try:
+                x, y = spectrum.read_data()
+                arrays.append((units.to_q(x, spectrum.x_unit, spectrum.wavelength), y))
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping spectrum %s: %s", spectrum.name, e)
+                arrays.append((np.empty(0), np.empty(0)))
+        fits.extend(fit_batch(arrays, centers, window, max_iterations, block_size))
+    return fits
+
+
+def fit_spectrum(x: np.ndarray, y: np.ndarray, centers: np.ndarray = None, max_peaks: int = 20) -> PeakFit:
+    """
+    Fits all peaks of a spectrum simultaneously, detecting their start positions if `centers` is not given.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if centers is None:
+        centers = detect_peaks(x, y, max_peaks)
+    if len(centers) == 0:
+        raise ValueError("No peaks found.")
+    (fit,) = fit_batch([(x, y)], centers, window=(x.min(), x.max()))
+    if fit is None:
+        raise ValueError("Too few points for the number of peaks.")
+    return fit
@@ -0,0 +1,153 @@
+import threading
+
+from data_sources import Spectrum, list_available_spectra
+import metrics
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogIndex:
+    """
+    A substring index over the name, display name and tags of all spectra.
+
+    Every searchable text is split into trigrams with a posting set of spectrum positions each, so a query only
+    has to verify the few spectra that contain all trigrams of its words instead of scanning the whole library.
+    Changes of the catalog are applied in place (see `sync`), touching only the trigrams of the changed spectra.
+    """
+
+    def __init__(self, spectra: list[Spectrum]):
+        self.spectra = []
+        self.by_name = {}
+        # Positions of removed spectra stay empty (None, with an empty text) until the index is compacted
+        self._entries: list[Spectrum | None] = []
+        self._texts: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._lock = threading.Lock()
+        self.sync(spectra)
+
+    @staticmethod
+    def _searchable_text(spectrum: Spectrum) -> str:
+        return "\n".join([spectrum.name, spectrum.display_name or "", *spectrum.tags]).lower()
+
+    def sync(self, spectra: list[Spectrum]) -> None:
+        """
+        Brings the index up to date with `spectra`, e.g. the catalog after a library change. Only the spectra whose
+        searchable text changed are re-indexed.
+        """
+        names = {s.name for s in spectra}
+        with self._lock:
+            changed = []
+            for spectrum in spectra:
+                position = self._positions.get(spectrum.name)
+                if position is not None and self._texts[position] == self._searchable_text(spectrum):
+                    self._entries[position] = spectrum
+                else:
+                    changed.append(spectrum)
+            self._update(changed, [name for name in self._positions if name not in names])
+            self.spectra = spectra
+            self.by_name = {s.name: s for s in spectra}
+
+    def _update(self, added: list[Spectrum], removed: list[str]) -> None:
+        for name in removed:
+            self._set_entry(self._positions.pop(name), None)
+        for spectrum in added:
+            position = self._positions.get(spectrum.name)
+            if position is None:
+                position = self._positions[spectrum.name] = len(self._entries)
+                self._entries.append(None)
+                self._texts.append("")
+            self._set_entry(position, spectrum)
+        if len(self._entries) > 2 * len(self._positions) + 64:
+            self._compact()
+
+    def _set_entry(self, position: int, spectrum: Spectrum | None) -> None:
+        for trigram in _trigrams(self._texts[position]):
+            posting = self._postings[trigram]
+            posting.discard(position)
+            if not posting:
+                del self._postings[trigram]
+        text = self._searchable_text(spectrum) if spectrum is not None else ""
+        self._entries[position], self._texts[position] = spectrum, text
+        for trigram in _trigrams(text):
+            self._postings.setdefault(trigram, set()).add(position)
+
+    def _compact(self) -> None:
+        entries = [entry for entry in self._entries if entry is not None]
+        self._entries, self._texts, self._positions, self._postings = [], [], {}, {}
+        self._update(entries, [])
+
+    def _candidates(self, words: list[str], scope: set[str] = None) -> list[int]:
+        candidates = None if scope is None else {self._positions[name] for name in scope if name in self._positions}
+        for word in words:
+            for trigram in _trigrams(word):
+                posting = self._postings.get(trigram, set())
+                candidates = posting.copy() if candidates is None else candidates & posting
+                if not candidates:
+                    return []
+        if candidates is None:  # only words shorter than three characters
+            return range(len(self._entries))
+        return sorted(candidates)
+
+    def _rank(self, position: int, query: str, words: list[str]) -> int:
+        spectrum = self._entries[position]
+        if spectrum.name.lower() == query or (spectrum.display_name or "").lower() == query:
+            return 0
+        if spectrum.name.lower().startswith(words[0]) or (spectrum.display_name or "").lower().startswith(words[0]):
+            return 1
+        return 2
+
+    def search(
+        self, query: str, offset: int = 0, limit: int = 50, scope: set[str] = None
+    ) -> tuple[list[Spectrum], int]:
+        """
+        Finds the spectra whose name, display name or tags contain every word of `query`, among the spectra named in
+        `scope` if given. Exact and prefix matches of the name or display name come first, otherwise the catalog
+        order is kept.
+
+        Returns:
+            tuple[list[Spectrum], int]: The requested page of matches and the total number of matches.
+        """
+        query = query.strip().lower()
+        words = query.split()
+        with self._lock:
+            if not words and scope is None:
+                return self.spectra[offset : offset + limit], len(self.spectra)
+            matches = [p for p in self._candidates(words, scope) if all(word in self._texts[p] for word in words)]
+            if not words:
+                return [self._entries[p] for p in matches[offset : offset + limit]], len(matches)
+            matches.sort(key=lambda p: self._rank(p, query, words))
+            return [self._entries[p] for p in matches[offset : offset + limit]], len(matches)
+
+    def filter(self, query: str = "", tags: list[str] = (), elements: list[str] = ()) -> list[Spectrum]:
+        """
+        Returns all matches of `query` (see `search`) that have every one of `tags` and `elements`.
+        """
+        spectra = self.search(query, limit=len(self.spectra))[0]
+        if tags or elements:
+            required_tags, required_elements = set(tags), set(elements)
+            spectra = [s for s in spectra if required_tags <= set(s.tags) and required_elements <= s.contained_elements]
+        return spectra
+
+
+_index_cache = {"spectra": None, "index": None}
+
+
+def catalog_index() -> CatalogIndex:
+    """
+    Returns the index of the current catalog, updated with the changed spectra whenever the catalog was rescanned.
+    """
+    spectra = list_available_spectra()
+    if _index_cache["index"] is None:
+        metrics.SEARCH_INDEX_CACHE_REQUESTS.inc(result="miss")
+        _index_cache["index"] = CatalogIndex(spectra)
+        _index_cache["spectra"] = spectra
+    elif _index_cache["spectra"] is not spectra:
+        metrics.SEARCH_INDEX_CACHE_REQUESTS.inc(result="update")
+        _index_cache["index"].sync(spectra)
+        _index_cache["spectra"] = spectra
+    else:
+        metrics.SEARCH_INDEX_CACHE_REQUESTS.inc(result="hit")
+    return _index_cache["index"]
@@ -0,0 +1,529 @@
+"""
+Pairwise similarity of all spectra in the library and their hierarchical clustering.
+
+Spectra are compared as fingerprints: resampled onto one fixed Q grid, background subtracted and normalized to unit
+length, so the dot product of two fingerprints is their cosine similarity. The grid does not depend on the library,
+so stored similarities stay valid when spectra are added.
+
+The matrix is stored under DATA_DIR/.similarity as an append-only lower triangle keyed by content hash: row i holds
+the similarities of spectrum i to the spectra 0..i. Adding a spectrum appends its fingerprint and one row, computed
+in blocks against the stored fingerprints; rows of deleted spectra are dropped by `compact`.
+
+Run as `python pxrd_viewer/similarity.py` to bring the stored matrix up to date.
+"""
+
+import contextlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+import data_sources
+import units
+from data_sources import Spectrum
+
+SIMILARITY_DIR_NAME = ".similarity"
+
+# The fixed comparison grid, covering Cu to Mo Kα measurements
+Q_MIN = 0.3
+Q_MAX = 10.0
+BINS = 2048
+# Every bin averages this many interpolated points, so reflections narrower than a bin are not skipped
+OVERSAMPLING = 4
+
+# Rows computed (and persisted) together; a block needs block size × library size floats
+BLOCK_SIZE = 256
+# Spectra per fingerprint task of the worker processes
+CHUNK_SIZE = 64
+
+_INDEX_FILE_NAME = "index.json"
+_FINGERPRINT_FILE_NAME = "fingerprints.f32"
+_TRIANGLE_FILE_NAME = "triangle.f32"
+_ORDER_FILE_NAME = "order.json"
+
+# Clustering holds the lower triangle of the similarities in memory, 800 MB of float32 at this many spectra
+MAX_CLUSTER_SPECTRA = 20_000
+
+
+def fingerprint(q: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Returns the unit-length fingerprint of a spectrum given on a Q axis: the intensity above the lower decile,
+    averaged into the bins of the fixed grid and zero outside the measured range.
+    """
+    valid = np.isfinite(q) & np.isfinite(y)
+    q, y = q[valid], y[valid]
+    result = np.zeros(BINS, dtype=np.float32)
+    if len(q) < 2:
+        return result
+    order = np.argsort(q, kind="stable")
+    q, y = q[order], y[order]
+    points = np.linspace(Q_MIN, Q_MAX, BINS * OVERSAMPLING)
+    inside = (points >= q[0]) & (points <= q[-1])
+    values = np.zeros(len(points))
+    values[inside] = np.interp(points[inside], q, y)
+    values[inside] = np.maximum(values[inside] - np.percentile(values[inside], 10), 0.0)
+    result[:] = values.reshape(BINS, OVERSAMPLING).mean(axis=1)
+    norm = np.linalg.norm(result)
+    return result / norm if norm > 0 else result
+
+
+def fingerprints(spectra: list[Spectrum]) -> np.ndarray:
+    """
+    Returns the (len(spectra), BINS) float32 fingerprints. Used as the task of the worker processes.
+    """
+    result = np.empty((len(spectra), BINS), dtype=np.float32)
+    for i, spectrum in enumerate(spectra):
+        x, y = spectrum.read_data()
+        result[i] = fingerprint(units.to_q(x, spectrum.x_unit, spectrum.wavelength), y)
+    return result
+
+
+def _store_dir() -> Path:
+    return data_sources.DATA_DIR / SIMILARITY_DIR_NAME
+
+
+@contextlib.contextmanager
+def _update_lock():
+    """
+    Serializes updates of the store across processes. Separate from the library lock, so saves are not blocked.
+    """
+    _store_dir().mkdir(parents=True, exist_ok=True)
+    with open(_store_dir() / ".lock", "a") as lock_file:
+        if data_sources.fcntl is not None:
+            data_sources.fcntl.flock(lock_file, data_sources.fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if data_sources.fcntl is not None:
+                data_sources.fcntl.flock(lock_file, data_sources.fcntl.LOCK_UN)
+
+
+def read_index() -> list[str]:
+    """
+    Returns the content hashes of the stored rows, in row order. A store made for another grid counts as empty.
+    """
+    try:
+        index = json.loads((_store_dir() / _INDEX_FILE_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return []
+    if index.get("grid") != [Q_MIN, Q_MAX, BINS, OVERSAMPLING]:
+        return []
+    return index["hashes"]
+
+
+def _write_index(hashes: list[str]) -> None:
+    index = {"grid": [Q_MIN, Q_MAX, BINS, OVERSAMPLING], "hashes": hashes}
+    data_sources._atomic_write(_store_dir() / _INDEX_FILE_NAME, lambda f: json.dump(index, f))
+
+
+def _triangle_size(rows: int) -> int:
+    return rows * (rows + 1) // 2
+
+
+def _truncate(rows: int) -> None:
+    """
+    Cuts both data files to `rows` rows, dropping what an interrupted update appended after its last index write.
+    """
+    for name, size in ((_FINGERPRINT_FILE_NAME, rows * BINS), (_TRIANGLE_FILE_NAME, _triangle_size(rows))):
+        path = _store_dir() / name
+        with open(path, "ab") as f:
+            f.truncate(size * 4)
+
+
+def content_hashes(spectra: list[Spectrum]) -> list[str]:
+    """
+    Returns the content hash of every spectrum, reading the arrays only for spectra saved before hashes were stored.
+    """
+    by_name = {name: h for h, names in data_sources.hash_index()["content"].items() for name in names}
+    return [
+        spectrum.content_hash or by_name.get(spectrum.name) or data_sources.content_hash(*spectrum.read_data())
+        for spectrum in spectra
+    ]
+
+
+def missing_spectra(spectra: list[Spectrum] = None) -> list[Spectrum]:
+    """
+    Returns the spectra (one per content) that have no row in the stored matrix yet.
+    """
+    spectra = data_sources.list_available_spectra() if spectra is None else spectra
+    known = set(read_index())
+    missing = {}
+    for spectrum, h in zip(spectra, content_hashes(spectra)):
+        if h not in known:
+            missing.setdefault(h, spectrum)
+    return list(missing.values())
+
+
+def append_rows(spectra: list[Spectrum], new_fingerprints: np.ndarray, block_size: int = BLOCK_SIZE) -> int:
+    """
+    Adds the rows of `spectra` (with their precomputed fingerprints) to the stored matrix. The rows are computed
+    and persisted in blocks, so an interrupted update keeps all completed blocks.
+
+    Returns:
+        int: The number of added rows; spectra that already have a row are skipped.
+    """
+    hashes = content_hashes(spectra)
+    with _update_lock():
+        stored = read_index()
+        if not stored:
+            # Start over, e.g. after the grid changed
+            _write_index([])
+        _truncate(len(stored))
+        known = set(stored)
+        new = []
+        for i, h in enumerate(hashes):
+            if h not in known:
+                known.add(h)
+                new.append(i)
+        for start in range(0, len(new), block_size):
+            block = new[start : start + block_size]
+            block_fingerprints = np.ascontiguousarray(new_fingerprints[block], dtype=np.float32)
+            rows = len(stored)
+            similarities = np.empty((len(block), rows + len(block)), dtype=np.float32)
+            if rows:
+                existing = np.memmap(_store_dir() / _FINGERPRINT_FILE_NAME, np.float32, "r", shape=(rows, BINS))
+                np.matmul(block_fingerprints, existing.T, out=similarities[:, :rows])
+                del existing
+            similarities[:, rows:] = block_fingerprints @ block_fingerprints.T
+            # Row r of the block takes the stored columns and the block columns up to the diagonal
+            triangle = np.concatenate([similarities[r, : rows + r + 1] for r in range(len(block))])
+            for name, data in ((_FINGERPRINT_FILE_NAME, block_fingerprints), (_TRIANGLE_FILE_NAME, triangle)):
+                with open(_store_dir() / name, "ab") as f:
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            stored = stored + [hashes[i] for i in block]
+            _write_index(stored)
+        return len(new)
+
+
+def update_matrix(
+    spectra: list[Spectrum] = None,
+    processes: int = None,
+    block_size: int = BLOCK_SIZE,
+    progress: Callable[[int, int], None] = None,
+) -> int:
+    """
+    Adds the missing rows of the library (or `spectra`) to the stored matrix. The fingerprints are computed in
+    `processes` worker processes (all cores by default), the rows by blockwise matrix products. `progress` is called
+    with the number of processed and of all missing spectra after every chunk.
+
+    Returns:
+        int: The number of added rows.
+    """
+    missing = missing_spectra(spectra)
+    if not missing:
+        return 0
+    chunks = [missing[i : i + CHUNK_SIZE] for i in range(0, len(missing), CHUNK_SIZE)]
+    if processes == 1 or len(chunks) == 1:
+        results = map(fingerprints, chunks)
+    else:
+        executor = ProcessPoolExecutor(processes)
+        results = executor.map(fingerprints, chunks)
+    added = 0
+    try:
+        for i, (chunk, chunk_fingerprints) in enumerate(zip(chunks, results)):
+            added += append_rows(chunk, chunk_fingerprints, block_size)
+            if progress is not None:
+                progress(min((i + 1) * CHUNK_SIZE, len(missing)), len(missing))
+    finally:
+        if processes != 1 and len(chunks) > 1:
+            executor.shutdown(cancel_futures=True)
+    return added
+
+
+def compact(spectra: list[Spectrum] = None) -> int:
+    """
+    Rewrites the store without the rows of spectra that are no longer in the library.
+
+    Returns:
+        int: The number of removed rows.
+    """
+    spectra = data_sources.list_available_spectra() if spectra is None else spectra
+    used = set(content_hashes(spectra))
+    with _update_lock():
+        stored = read_index()
+        keep = np.array([i for i, h in enumerate(stored) if h in used], dtype=np.int64)
+        if len(keep) == len(stored):
+            return 0
+        _truncate(len(stored))
+        directory = _store_dir()
+        old_fingerprints = np.memmap(directory / _FINGERPRINT_FILE_NAME, np.float32, "r", shape=(len(stored), BINS))
+        old_triangle = np.memmap(directory / _TRIANGLE_FILE_NAME, np.float32, "r", shape=(_triangle_size(len(stored)),))
+        offsets = np.array([_triangle_size(i) for i in keep], dtype=np.int64)
+        triangle = np.concatenate([old_triangle[offset + keep[: j + 1]] for j, offset in enumerate(offsets)])
+        kept_fingerprints = np.asarray(old_fingerprints[keep])
+        del old_fingerprints, old_triangle
+        data_sources._atomic_write(
+            directory / _FINGERPRINT_FILE_NAME, lambda f: f.write(kept_fingerprints.tobytes()), mode="wb"
+        )
+        data_sources._atomic_write(
+            directory / _TRIANGLE_FILE_NAME, lambda f: f.write(triangle.astype(np.float32).tobytes()), mode="wb"
+        )
+        _write_index([stored[i] for i in keep])
+        return len(stored) - len(keep)
+
+
+def _check_cluster_size(rows: int) -> None:
+    if rows > MAX_CLUSTER_SPECTRA:
+        raise ValueError(
+            f"Clustering is limited to {MAX_CLUSTER_SPECTRA} spectra, the similarity matrix has {rows} rows."
+        )
+
+
+def load_triangle(spectra: list[Spectrum] = None) -> tuple[list[Spectrum], np.ndarray]:
+    """
+    Returns the spectra of the library (or `spectra`) that have a stored row and the lower triangle of their
+    similarity matrix, diagonal included, packed row by row: entry (i, j) with j <= i is at i * (i + 1) / 2 + j.
+    Spectra with the same content share a row and have a similarity of 1.
+
+    Raises:
+        ValueError: If there are more than MAX_CLUSTER_SPECTRA such spectra.
+    """
+    spectra = data_sources.list_available_spectra() if spectra is None else spectra
+    hashes = content_hashes(spectra)
+    with _update_lock():
+        stored = read_index()
+        # The memory map keeps the file open, so a compaction replacing it after the lock is released does not matter
+        triangle = None
+        if stored:
+            path = _store_dir() / _TRIANGLE_FILE_NAME
+            triangle = np.memmap(path, np.float32, "r", shape=(_triangle_size(len(stored)),))
+    rows = {h: i for i, h in enumerate(stored)}
+    pairs = [(spectrum, rows[h]) for spectrum, h in zip(spectra, hashes) if h in rows]
+    _check_cluster_size(len(pairs))
+    selected = np.array([row for _, row in pairs], dtype=np.int64)
+    result = np.empty(_triangle_size(len(selected)), dtype=np.float32)
+    for i, row in enumerate(selected):
+        # The stored triangle holds (row, column) with column <= row
+        high, low = np.maximum(row, selected[: i + 1]), np.minimum(row, selected[: i + 1])
+        result[_triangle_size(i) : _triangle_size(i + 1)] = triangle[high * (high + 1) // 2 + low]
+    return [spectrum for spectrum, _ in pairs], result
+
+
+def load_matrix(spectra: list[Spectrum] = None) -> tuple[list[Spectrum], np.ndarray]:
+    """
+    Like `load_triangle`, but returns the full symmetric matrix, for small selections.
+    """
+    spectra, triangle = load_triangle(spectra)
+    rows, columns = np.tril_indices(len(spectra))
+    matrix = np.empty((len(spectra), len(spectra)), dtype=np.float32)
+    matrix[rows, columns] = triangle
+    matrix[columns, rows] = triangle
+    return spectra, matrix
+
+
+def linkage(similarity: np.ndarray) -> np.ndarray:
+    """
+    Average-linkage hierarchical clustering with the distance 1 - similarity, by the nearest-neighbor chain
+    algorithm: O(n²) time, with one vectorized pass over a row per step.
+
+    Args:
+        similarity (np.ndarray): The symmetric similarity matrix, or its packed lower triangle as returned by
+            `load_triangle`, which needs half the memory. A writable float32 triangle is used as the working
+            memory and overwritten, so clustering needs no copy of it.
+
+    Returns:
+        np.ndarray: The (n - 1, 4) linkage matrix in the SciPy format: the merged cluster ids (leaves are 0..n-1,
+        merge k creates id n + k), the distance and the size of the new cluster, ordered by distance.
+    """
+    # float32 halves the memory of large libraries; the merge heights do not need more precision
+    triangle = np.asarray(similarity, dtype=np.float32)
+    if triangle.ndim == 2:
+        triangle = triangle[np.tril_indices(len(triangle))]
+    elif not triangle.flags.writeable:
+        triangle = triangle.copy()
+    n = int(round((np.sqrt(8 * len(triangle) + 1) - 1) / 2))
+    if n < 2:
+        return np.zeros((0, 4))
+    np.subtract(1.0, triangle, out=triangle)
+    starts = np.arange(n, dtype=np.int64) * np.arange(1, n + 1) // 2
+
+    def row(i: int) -> np.ndarray:
+        # Positions of the distances of i to every point in the packed triangle: its own row up to the diagonal,
+        # then its column in the rows below
+        return np.concatenate([np.arange(starts[i], starts[i] + i + 1), starts[i + 1 :] + i])
+
+    triangle[starts + np.arange(n)] = np.inf
+    size = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    merges = []
+    chain = []
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        a = chain[-1]
+        distance_a = triangle[row(a)]
+        b = int(np.argmin(distance_a))
+        # Ties are resolved in favor of the previous chain element, so the chain always terminates
+        if len(chain) > 1 and distance_a[chain[-2]] <= distance_a[b]:
+            b = chain[-2]
+        if len(chain) < 2 or b != chain[-2]:
+            chain.append(b)
+            continue
+        del chain[-2:]
+        keep, drop = min(a, b), max(a, b)
+        merges.append((a, b, distance_a[b]))
+        # Lance-Williams update of the average linkage; inactive clusters stay at infinity
+        merged = (size[a] * distance_a + size[b] * triangle[row(b)]) / (size[a] + size[b])
+        merged[keep] = np.inf
+        triangle[row(keep)] = merged
+        triangle[row(drop)] = np.inf
+        size[keep] += size[drop]
+        active[drop] = False
+
+    # Relabel the merges in the order of their distance, as cluster ids of a union-find over the points
+    parent = np.arange(2 * n - 1)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    result = np.empty((n - 1, 4))
+    sizes = np.ones(2 * n - 1)
+    for k, index in enumerate(np.argsort([d for _, _, d in merges], kind="stable")):
+        a, b, d = merges[index]
+        x, y = sorted((find(a), find(b)))
+        parent[x] = parent[y] = n + k
+        sizes[n + k] = sizes[x] + sizes[y]
+        result[k] = (x, y, d, sizes[n + k])
+    return result
+
+
+def leaf_order(links: np.ndarray) -> np.ndarray:
+    """
+    Returns the leaves in dendrogram order, so that similar spectra are next to each other.
+    """
+    n = len(links) + 1
+    if n == 1:
+        return np.zeros(1, dtype=np.int64)
+    order = []
+    stack = [2 * n - 2]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            order.append(node)
+        else:
+            left, right = links[node - n, :2].astype(np.int64)
+            stack += [right, left]
+    return np.array(order, dtype=np.int64)
+
+
+def flat_clusters(links: np.ndarray, min_similarity: float) -> np.ndarray:
+    """
+    Cuts the tree where the average similarity of merged clusters drops below `min_similarity`.
+
+    Returns:
+        np.ndarray: A cluster label per leaf, numbered in dendrogram order.
+    """
+    n = len(links) + 1
+    parent = np.arange(2 * n - 1)
+    for k, (a, b, distance, _) in enumerate(links):
+        if 1.0 - distance >= min_similarity:
+            parent[int(a)] = parent[int(b)] = n + k
+    # Merges come after their children, so resolving the parents from the top assigns every node its root
+    for node in range(2 * n - 2, -1, -1):
+        parent[node] = parent[parent[node]]
+    order = leaf_order(links)
+    _, first, labels = np.unique(parent[order], return_index=True, return_inverse=True)
+    # Number the clusters by their first leaf in dendrogram order
+    relabel = np.argsort(np.argsort(first))
+    result = np.empty(n, dtype=np.int64)
+    result[order] = relabel[labels]
+    return result
+
+
+def dendrogram_lines(links: np.ndarray, order: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the x and y coordinates of the dendrogram as one polyline with NaN gaps: leaf i is drawn at the
+    position of i in `order`, merges at the height of their distance.
+    """
+    n = len(links) + 1
+    position = np.empty(2 * n - 1)
+    height = np.zeros(2 * n - 1)
+    position[order] = np.arange(n)
+    x = np.full((len(links), 5), np.nan)
+    y = np.full((len(links), 5), np.nan)
+    for k, (a, b, distance, _) in enumerate(links):
+        a, b = int(a), int(b)
+        position[n + k] = (position[a] + position[b]) / 2
+        height[n + k] = distance
+        x[k, :4] = position[a], position[a], position[b], position[b]
+        y[k, :4] = height[a], distance, distance, height[b]
+    return x.ravel(), y.ravel()
+
+
+def stored_order() -> list[str] | None:
+    """
+    Returns the content hashes of the stored rows in dendrogram order, if `update_order` ran since the stored matrix
+    last changed, else None.
+    """
+    try:
+        stamp = (_store_dir() / _INDEX_FILE_NAME).stat().st_mtime_ns
+        order = json.loads((_store_dir() / _ORDER_FILE_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return order["hashes"] if order.get("stamp") == stamp else None
+
+
+def update_order() -> list[str]:
+    """
+    Clusters all stored rows and stores their dendrogram order, which `cluster_order` then uses until the matrix
+    changes. CPU bound for large libraries, so the viewer runs it in a worker process.
+
+    Returns:
+        list[str]: The content hashes of the stored rows in dendrogram order.
+
+    Raises:
+        ValueError: If the matrix has more than MAX_CLUSTER_SPECTRA rows.
+    """
+    with _update_lock():
+        stored = read_index()
+        stamp = (_store_dir() / _INDEX_FILE_NAME).stat().st_mtime_ns if stored else None
+        _check_cluster_size(len(stored))
+        triangle = None
+        if stored:
+            triangle = np.fromfile(_store_dir() / _TRIANGLE_FILE_NAME, np.float32, _triangle_size(len(stored)))
+    hashes = [stored[i] for i in leaf_order(linkage(triangle))] if stored else []
+    order = {"stamp": stamp, "hashes": hashes}
+    data_sources._atomic_write(_store_dir() / _ORDER_FILE_NAME, lambda f: json.dump(order, f))
+    return hashes
+
+
+def cluster_order(spectra: list[Spectrum] = None, order: list[str] = None) -> list[Spectrum]:
+    """
+    Returns `spectra` (the library by default) in dendrogram order; spectra without a stored row come last.
+
+    Args:
+        order (list[str], optional): The order of the stored rows, from `stored_order` or `update_order`. By default
+            the stored order, which is updated first if the matrix changed since.
+    """
+    spectra = data_sources.list_available_spectra() if spectra is None else spectra
+    if order is None:
+        order = stored_order()
+    if order is None:
+        order = update_order()
+    rank = {h: i for i, h in enumerate(order)}
+    hashes = dict(zip(map(id, spectra), content_hashes(spectra)))
+    return sorted(spectra, key=lambda spectrum: rank.get(hashes[id(spectrum)], len(rank)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--compact", action="store_true", help="Drop the rows of deleted spectra")
+    args = parser.parse_args()
+
+    added = update_matrix(processes=args.processes)
+    print(f"Added {added} rows, the matrix now has {len(read_index())} rows.")
+    if args.compact:
+        print(f"Removed {compact()} rows of deleted spectra.")
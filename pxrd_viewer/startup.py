@@ -0,0 +1,104 @@
+"""
+Startup phases of the server and their timing.
+
+`app.py` imports this module first, so the clock starts before the heavy imports. Right after the server has started,
+`warm_up` loads the catalog, the search index, plotly's figure machinery and the arrays of the spectra the viewer
+opens with in the background, so the first visitor after a restart does not pay for them.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Number of spectra (in catalog order, which the viewer opens with and rotates through) whose arrays are pre-loaded.
+PREWARM_SPECTRA = int(os.environ.get("PXRD_PREWARM_SPECTRA", "10"))
+
+
+class StartupTimer:
+    """
+    Collects the duration of the named startup phases, measured from the creation of the timer.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, name: str):
+        """
+        Ends a phase that began at the previous mark (or the creation of the timer).
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_mark))
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+            self._last_mark = time.perf_counter()
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name} {duration * 1000:.0f} ms" for name, duration in self.phases)
+        return f"Startup finished after {total * 1000:.0f} ms: {breakdown}"
+
+
+timer = StartupTimer()
+
+
+def _warm_plotly():
+    # plotly loads the validators of every trace and layout property on first use
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Scatter(x=[0.0, 1.0], y=[0.0, 1.0], mode="lines", line=dict(color="#FF0000")))
+    fig.update_layout(hovermode="x unified", xaxis_rangeslider_visible=True, uirevision="constant")
+    fig.to_plotly_json()
+
+
+def _load_arrays(spectra):
+    for spectrum in spectra:
+        try:
+            spectrum.x, spectrum.y
+        except (OSError, ValueError) as e:
+            # e.g. the archive file of a linked spectrum changed or is not mounted
+            logger.warning("Could not pre-load %s: %s", spectrum.name, e)
+
+
+async def warm_up(prewarm_spectra: int = PREWARM_SPECTRA):
+    """
+    Pre-warms the caches used by the first page load off the event loop and logs the startup timing breakdown.
+    Afterwards jobs are queued that create the missing gallery thumbnails and validate the files of linked spectra.
+    """
+    from nicegui import run
+
+    import data_sources
+    import jobs
+    import search_index
+
+    timer.mark("server start")
+    spectra = []
+    try:
+        with timer.phase("catalog"):
+            spectra = await run.io_bound(data_sources.list_available_spectra)
+        with timer.phase("search index"):
+            await run.io_bound(search_index.catalog_index)
+        with timer.phase("full-text index"):
+            await run.io_bound(data_sources.fulltext_index)
+        with timer.phase("plotly"):
+            await run.io_bound(_warm_plotly)
+        with timer.phase(f"arrays of {min(prewarm_spectra, len(spectra))} spectra"):
+            await run.io_bound(_load_arrays, spectra[:prewarm_spectra])
+    except Exception:
+        logger.exception("Warming up the caches failed")
+    logger.info("%s (%d spectra)", timer.report(), len(spectra))
+
+    # Shown on the jobs page; a restart while they run starts them again. Once for all worker processes.
+    jobs.queue.submit_at_startup("thumbnails", prune=True)
+    jobs.queue.submit_at_startup("validate-linked")
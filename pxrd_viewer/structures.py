@@ -0,0 +1,644 @@
+"""
+Simulated powder patterns of crystal structures from CIF files, imported as reference spectra.
+
+    python pxrd_viewer/structures.py /path/to/cifs [--wavelength 1.5406] [--tag reference] [--processes 8]
+
+A structure is expanded to the full unit cell with its symmetry operations. All reflections up to the largest Q
+of the pattern are generated at once, one of each Friedel pair, and their structure factors are computed as one
+matrix product over reflections × atoms. Systematically absent reflections are dropped, and those at the same Q are
+merged into sticks whose multiplicity is the number of merged reflections. The stick intensities m·|F|² are
+Lorentz-polarization corrected for the wavelength and broadened with a pseudo-Voigt profile of constant width onto
+the Q grid of the viewer.
+
+Atomic form factors come from the Thomas–Fermi model in Molière's approximation, which needs no tabulated
+coefficients: f(Q) = Z Σ αᵢ κᵢ² / (κᵢ² + Q²). Peak positions are exact; intensities are good enough to recognize a
+phase, but deviate by some ten percent from tabulated form factors, most for light atoms.
+
+Sticks and profiles are cached in DATA_DIR/.patterns, keyed on the hash of the expanded structure and the wavelength,
+so re-importing a structure, or the same structure from another file, is not simulated again. Bulk imports simulate
+the files in worker processes and save all new patterns as regular spectra in one batch.
+"""
+
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+import data_sources
+import similarity
+import units
+from data_sources import ALL_ELEMENTS, Spectrum
+
+PATTERN_DIR_NAME = ".patterns"
+# Part of every cache key; bump when the simulation changes
+CACHE_VERSION = 1
+
+SIMULATED_TAG = "simulated"
+
+# The Q grid of the simulated spectra, about one point per 0.0012 Å⁻¹ across the similarity grid
+GRID_POINTS = 8192
+# Diffractometers rarely reach further, and the Lorentz factor diverges towards 180°
+MAX_TWO_THETA = 150.0
+DEFAULT_FWHM = 0.02  # Å⁻¹
+DEFAULT_ETA = 0.5  # Lorentzian fraction of the pseudo-Voigt
+# The profile of a stick is evaluated up to this many FWHM from its center
+PROFILE_WINDOW = 10
+# Isotropic displacement of atoms without one in the CIF (Å²)
+DEFAULT_B = 1.0
+# Structure factor terms (reflections × atoms) per block, bounding the memory of large cells
+BLOCK_SIZE = 4_000_000
+
+# Molière's approximation of the Thomas–Fermi screening function
+_MOLIERE_ALPHA = np.array([0.35, 0.55, 0.10])
+_MOLIERE_BETA = np.array([0.3, 1.2, 6.0])
+BOHR_RADIUS = 0.529177  # Å
+
+_TOKEN = re.compile(r"""'(?P<single>.*?)'(?=\s|$)|"(?P<double>.*?)"(?=\s|$)|(?P<comment>#.*)|(?P<bare>\S+)""")
+_UNCERTAINTY = re.compile(r"\(\d+\)$")
+
+
+@dataclass
+class Structure:
+    """
+    A crystal structure with every atom of the unit cell. Positions are fractional coordinates in [0, 1).
+    """
+
+    name: str
+    formula: str
+    cell: tuple[float, float, float, float, float, float]
+    positions: np.ndarray
+    atomic_numbers: np.ndarray
+    occupancies: np.ndarray
+    b_factors: np.ndarray
+
+    @property
+    def elements(self) -> set[str]:
+        return {ALL_ELEMENTS[z - 1] for z in np.unique(self.atomic_numbers)}
+
+    def metric(self) -> np.ndarray:
+        """
+        Returns the metric tensor of the direct lattice (Å²).
+        """
+        a, b, c, alpha, beta, gamma = self.cell
+        cos_alpha, cos_beta, cos_gamma = np.cos(np.radians([alpha, beta, gamma]))
+        return np.array(
+            [
+                [a * a, a * b * cos_gamma, a * c * cos_beta],
+                [a * b * cos_gamma, b * b, b * c * cos_alpha],
+                [a * c * cos_beta, b * c * cos_alpha, c * c],
+            ]
+        )
+
+    def structure_hash(self) -> str:
+        """
+        Hashes the cell and the atoms of the unit cell, independent of their order and of how the CIF lists them.
+        """
+        atoms = np.column_stack(
+            [self.atomic_numbers, np.round(self.positions, 4) % 1.0, self.occupancies, self.b_factors]
+        )
+        atoms = np.round(atoms[np.lexsort(atoms.T[::-1])], 4) + 0.0  # +0.0 turns -0.0 into 0.0
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{CACHE_VERSION}\0{np.round(self.cell, 5).tolist()}\0".encode())
+        h.update(np.ascontiguousarray(atoms, dtype="<f8").tobytes())
+        return h.hexdigest()
+
+
+@dataclass
+class Sticks:
+    """
+    The reflections of a pattern, merged per Q: a representative hkl, the multiplicity and the intensity.
+    """
+
+    q: np.ndarray
+    intensity: np.ndarray
+    multiplicity: np.ndarray
+    hkl: np.ndarray
+
+
+@dataclass
+class SimulatedPattern:
+    source_file: Path
+    structure: Structure
+    structure_hash: str
+    sticks: Sticks
+    x: np.ndarray
+    y: np.ndarray
+
+    def description(self, wavelength: float) -> str:
+        a, b, c, alpha, beta, gamma = self.structure.cell
+        return (
+            f"Simulated from {self.source_file.name} ({self.structure.formula or self.structure.name}) for "
+            f"λ = {wavelength:g} Å; a={a:g} b={b:g} c={c:g} Å, α={alpha:g} β={beta:g} γ={gamma:g}°."
+        )
+
+
+def _tokens(text: str):
+    """
+    Yields the tokens of a CIF as (text, quoted) pairs. Text fields between lines starting with `;` are one token.
+    """
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith(";"):
+            field = [lines[i][1:]]
+            i += 1
+            while i < len(lines) and not lines[i].startswith(";"):
+                field.append(lines[i])
+                i += 1
+            yield "\n".join(field).strip(), True
+            i += 1
+            continue
+        for match in _TOKEN.finditer(lines[i]):
+            if match.group("comment") is not None:
+                break
+            if match.group("bare") is not None:
+                yield match.group("bare"), False
+            else:
+                yield match.group("single") if match.group("single") is not None else match.group("double"), True
+        i += 1
+
+
+def _is_keyword(token: str, quoted: bool) -> bool:
+    return not quoted and (token.startswith("_") or token.lower().startswith(("loop_", "data_", "save_", "global_")))
+
+
+def read_cif(text: str) -> tuple[str, dict[str, str], dict[str, list[str]]]:
+    """
+    Reads the first data block of a CIF.
+
+    Returns:
+        tuple[str, dict[str, str], dict[str, list[str]]]: The block name, the single values and the loop columns,
+            both by lower case tag.
+
+    Raises:
+        ValueError: If the CIF has no data block or a malformed loop.
+    """
+    tokens = list(_tokens(text))
+    block, values, columns = None, {}, {}
+    i = 0
+    while i < len(tokens):
+        token, quoted = tokens[i]
+        lower = token.lower()
+        if not quoted and lower.startswith("data_"):
+            if block is not None:
+                break
+            block = token[5:]
+            i += 1
+        elif not quoted and lower == "loop_":
+            i += 1
+            tags = []
+            while i < len(tokens) and not tokens[i][1] and tokens[i][0].startswith("_"):
+                tags.append(tokens[i][0].lower())
+                i += 1
+            items = []
+            while i < len(tokens) and not _is_keyword(*tokens[i]):
+                items.append(tokens[i][0])
+                i += 1
+            if not tags or len(items) % len(tags):
+                raise ValueError(f"A loop of {len(tags)} columns holds {len(items)} values.")
+            for j, tag in enumerate(tags):
+                columns[tag] = items[j :: len(tags)]
+        elif not quoted and token.startswith("_") and i + 1 < len(tokens):
+            values[lower] = tokens[i + 1][0]
+            i += 2
+        else:
+            i += 1
+    if block is None:
+        raise ValueError("The file has no CIF data block.")
+    return block, values, columns
+
+
+def _number(value: str | None) -> float | None:
+    """
+    Parses a CIF number such as `5.4309(3)`; None for the unknown (`?`) and inapplicable (`.`) values.
+    """
+    if value is None or value in ("?", "."):
+        return None
+    try:
+        return float(_UNCERTAINTY.sub("", value))
+    except ValueError:
+        raise ValueError(f"'{value}' is not a number.")
+
+
+def _element(symbol: str) -> int:
+    """
+    Returns the atomic number of a type symbol or site label such as `Cu2+`, `O1` or `CU`.
+    """
+    letters = re.match(r"[A-Za-z]+", symbol)
+    if letters:
+        for candidate in (letters[0][:2], letters[0][:1]):
+            candidate = candidate.capitalize()
+            if candidate in ALL_ELEMENTS:
+                return ALL_ELEMENTS.index(candidate) + 1
+            if candidate == "D":  # deuterium scatters X-rays like hydrogen
+                return 1
+    raise ValueError(f"Unknown element '{symbol}'.")
+
+
+def parse_symmetry_operation(operation: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parses a symmetry operation such as `-x+1/2, y, -z+1/2`.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The rotation matrix and the translation acting on fractional coordinates.
+    """
+    components = operation.replace(" ", "").lower().split(",")
+    if len(components) != 3:
+        raise ValueError(f"Malformed symmetry operation '{operation}'.")
+    rotation, translation = np.zeros((3, 3)), np.zeros(3)
+    for row, component in enumerate(components):
+        for term in re.findall(r"[+-]?[^+-]+", component):
+            axis = re.search(r"[xyz]", term)
+            try:
+                if axis is None:
+                    translation[row] += float(Fraction(term))
+                else:
+                    coefficient = term[: axis.start()].rstrip("*") + term[axis.end() :]
+                    coefficient = {"": 1.0, "+": 1.0, "-": -1.0}.get(coefficient) or float(Fraction(coefficient))
+                    rotation[row, "xyz".index(axis[0])] += coefficient
+            except (ValueError, ZeroDivisionError):
+                raise ValueError(f"Malformed symmetry operation '{operation}'.")
+    return rotation, translation
+
+
+def structure_from_cif(text: str, name: str = None) -> Structure:
+    """
+    Parses a CIF and expands its atom sites to the unit cell.
+
+    Raises:
+        ValueError: If the cell, the atom sites or the symmetry operations are missing or malformed.
+    """
+    block, values, columns = read_cif(text)
+    try:
+        cell = tuple(
+            _number(values[f"_cell_{tag}"])
+            for tag in ("length_a", "length_b", "length_c", "angle_alpha", "angle_beta", "angle_gamma")
+        )
+    except KeyError as e:
+        raise ValueError(f"The CIF lacks {e.args[0]}.")
+    if None in cell or min(cell) <= 0 or max(cell[3:]) >= 180:
+        raise ValueError(f"Invalid unit cell {cell}.")
+
+    operations = columns.get("_space_group_symop_operation_xyz") or columns.get("_symmetry_equiv_pos_as_xyz")
+    if not operations:
+        group = values.get("_space_group_name_h-m_alt") or values.get("_symmetry_space_group_name_h-m") or "P 1"
+        if group.replace(" ", "").upper() != "P1":
+            raise ValueError(f"The CIF lists no symmetry operations of its space group {group}.")
+        operations = ["x,y,z"]
+    rotations, translations = zip(*(parse_symmetry_operation(op) for op in operations))
+    rotations, translations = np.array(rotations), np.array(translations)
+
+    if "_atom_site_fract_x" not in columns:
+        raise ValueError("The CIF lists no atom sites with fractional coordinates.")
+    sites = len(columns["_atom_site_fract_x"])
+
+    def column(tag, default=None):
+        return columns.get(tag, [default] * sites)
+
+    symbols = columns.get("_atom_site_type_symbol") or columns.get("_atom_site_label")
+    if symbols is None:
+        raise ValueError("The CIF names no elements of its atom sites.")
+    u_iso = column("_atom_site_u_iso_or_equiv")
+    b_iso = column("_atom_site_b_iso_or_equiv")
+    positions, atomic_numbers, occupancies, b_factors = [], [], [], []
+    for i in range(sites):
+        site = np.array([_number(columns[f"_atom_site_fract_{axis}"][i]) for axis in "xyz"], dtype=float)
+        if not np.isfinite(site).all():
+            raise ValueError(f"The atom site {i + 1} has no position.")
+        # All images of the site; special positions map onto themselves and are kept once
+        images = (np.einsum("oij,j->oi", rotations, site) + translations) % 1.0
+        images = np.unique(np.round(images, 4) % 1.0, axis=0)
+        occupancy = _number(column("_atom_site_occupancy")[i])
+        if b_iso[i] not in (None, "?", "."):
+            b_factor = _number(b_iso[i])
+        elif u_iso[i] not in (None, "?", "."):
+            b_factor = 8 * np.pi**2 * _number(u_iso[i])
+        else:
+            b_factor = DEFAULT_B
+        positions.append(images)
+        atomic_numbers += [_element(symbols[i])] * len(images)
+        occupancies += [1.0 if occupancy is None else occupancy] * len(images)
+        b_factors += [b_factor] * len(images)
+    formula = values.get("_chemical_formula_sum") or values.get("_chemical_formula_structural") or ""
+    return Structure(
+        name=name or values.get("_chemical_name_mineral") or block,
+        formula=" ".join(formula.split()),
+        cell=cell,
+        positions=np.concatenate(positions),
+        atomic_numbers=np.array(atomic_numbers),
+        occupancies=np.array(occupancies),
+        b_factors=np.array(b_factors),
+    )
+
+
+def form_factors(atomic_numbers: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    Returns the X-ray form factors (electrons) of the atoms at every Q (Å⁻¹) as a (len(q), len(atomic_numbers))
+    matrix, in the Thomas–Fermi–Molière model.
+    """
+    screening = 0.8853 * BOHR_RADIUS * np.asarray(atomic_numbers, dtype=float) ** (-1 / 3)
+    kappa2 = (_MOLIERE_BETA[:, None] / screening[None, :]) ** 2  # (3, atoms)
+    q2 = np.asarray(q, dtype=float)[:, None, None] ** 2
+    return atomic_numbers * (_MOLIERE_ALPHA[:, None] * kappa2 / (kappa2 + q2)).sum(axis=1)
+
+
+def reflections(structure: Structure, q_max: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generates every reflection with 0 < Q ≤ `q_max`, one of each Friedel pair (hkl and -h-k-l).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (n, 3) Miller indices and their Q (Å⁻¹).
+    """
+    metric = structure.metric()
+    reciprocal = np.linalg.inv(metric)
+    d_star_max = q_max / (2 * np.pi)
+    # |h_i| = |d*·a_i| ≤ |d*| |a_i|
+    limits = np.floor(d_star_max * np.sqrt(np.diag(metric))).astype(int)
+    axes = [np.arange(-limit, limit + 1) for limit in limits]
+    hkl = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    h, k, l = hkl.T  # noqa: E741
+    half = (h > 0) | ((h == 0) & (k > 0)) | ((h == 0) & (k == 0) & (l > 0))
+    hkl = hkl[half]
+    q = 2 * np.pi * np.sqrt(np.einsum("ni,ij,nj->n", hkl, reciprocal, hkl))
+    inside = q <= q_max
+    return hkl[inside], q[inside]
+
+
+def intensities(structure: Structure, hkl: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    Returns |F|² of the reflections, computed in blocks of reflections × atoms.
+    """
+    elements, element_index = np.unique(structure.atomic_numbers, return_inverse=True)
+    result = np.empty(len(q))
+    block = max(1, BLOCK_SIZE // len(structure.atomic_numbers))
+    for start in range(0, len(q), block):
+        block_hkl, block_q = hkl[start : start + block], q[start : start + block]
+        s2 = (block_q / (4 * np.pi))[:, None] ** 2
+        weights = form_factors(elements, block_q)[:, element_index] * structure.occupancies
+        weights *= np.exp(-structure.b_factors * s2)
+        phases = 2 * np.pi * (block_hkl @ structure.positions.T)
+        real = (weights * np.cos(phases)).sum(axis=1)
+        imaginary = (weights * np.sin(phases)).sum(axis=1)
+        result[start : start + block] = real**2 + imaginary**2
+    return result
+
+
+def q_limit(wavelength: float, q_max: float = similarity.Q_MAX) -> float:
+    """
+    Returns the largest Q of a pattern: `q_max`, or the Q at MAX_TWO_THETA if the wavelength does not reach it.
+    """
+    return min(q_max, 4 * np.pi / wavelength * np.sin(np.radians(MAX_TWO_THETA / 2)))
+
+
+def simulate_sticks(structure: Structure, wavelength: float, q_max: float = similarity.Q_MAX) -> Sticks:
+    """
+    Computes the Lorentz-polarization corrected sticks of a structure for `wavelength` (Å), see the module docstring.
+    """
+    hkl, q = reflections(structure, q_limit(wavelength, q_max))
+    squared = intensities(structure, hkl, q)
+    # Systematic absences, e.g. of a centered cell, cancel to rounding errors
+    present = squared > 1e-9 * squared.max() if len(q) else []
+    hkl, q, squared = hkl[present], q[present], squared[present]
+    order = np.argsort(q, kind="stable")
+    hkl, q, squared = hkl[order], q[order], squared[order]
+    # Reflections at the same Q (within rounding) form one stick
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(q) > 1e-7 * q[1:] + 1e-12])) if len(q) else []
+    multiplicity = 2 * np.diff(np.append(starts, len(q)))  # both members of every Friedel pair
+    total = 2 * np.add.reduceat(squared, starts) if len(q) else np.empty(0)
+    stick_q = q[starts] if len(q) else np.empty(0)
+    theta = np.arcsin(stick_q * wavelength / (4 * np.pi))
+    lorentz_polarization = (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+    return Sticks(
+        q=stick_q,
+        intensity=total * lorentz_polarization,
+        multiplicity=multiplicity,
+        hkl=hkl[starts] if len(q) else np.empty((0, 3), dtype=int),
+    )
+
+
+def grid(wavelength: float, points: int = GRID_POINTS) -> np.ndarray:
+    """
+    Returns the Q grid of a simulated pattern: the similarity grid, cut off where the wavelength cannot reach.
+    """
+    return np.linspace(similarity.Q_MIN, q_limit(wavelength), points)
+
+
+def profile(sticks: Sticks, q_grid: np.ndarray, fwhm: float = DEFAULT_FWHM, eta: float = DEFAULT_ETA) -> np.ndarray:
+    """
+    Broadens the sticks with area-normalized pseudo-Voigt profiles onto the evenly spaced `q_grid` and scales the
+    result to a maximum of 1.0 (float32). Every stick is evaluated in a window of PROFILE_WINDOW FWHM on each side,
+    all at once, and accumulated with `np.bincount`.
+    """
+    step = q_grid[1] - q_grid[0]
+    half_width = int(np.ceil(PROFILE_WINDOW * fwhm / step))
+    centers = np.round((sticks.q - q_grid[0]) / step).astype(int)
+    indices = centers[:, None] + np.arange(-half_width, half_width + 1)
+    inside = (indices >= 0) & (indices < len(q_grid))
+    indices = np.clip(indices, 0, len(q_grid) - 1)
+    offsets2 = (q_grid[indices] - sticks.q[:, None]) ** 2 / fwhm**2
+    gauss = np.sqrt(4 * np.log(2) / np.pi) / fwhm * np.exp(-4 * np.log(2) * offsets2)
+    lorentz = 2 / (np.pi * fwhm) / (1 + 4 * offsets2)
+    values = sticks.intensity[:, None] * (eta * lorentz + (1 - eta) * gauss)
+    y = np.bincount(indices[inside], weights=values[inside], minlength=len(q_grid)).astype(np.float32)
+    peak = y.max()
+    return y / peak if peak > 0 else y
+
+
+def cache_file(cache_dir: Path, structure_hash: str, wavelength: float) -> Path:
+    return Path(cache_dir) / f"{structure_hash}-{wavelength:.5f}.npz"
+
+
+def simulate(
+    structure: Structure,
+    wavelength: float,
+    fwhm: float = DEFAULT_FWHM,
+    eta: float = DEFAULT_ETA,
+    cache_dir: Path = None,
+) -> tuple[str, Sticks, np.ndarray, np.ndarray]:
+    """
+    Simulates the pattern of a structure, reusing the sticks and the profile cached in `cache_dir` (by default
+    DATA_DIR/.patterns) for its structure hash and the wavelength. A cached profile is only reused for the same
+    profile parameters; otherwise it is recomputed from the cached sticks.
+
+    Returns:
+        tuple[str, Sticks, np.ndarray, np.ndarray]: The structure hash, the sticks and the Q grid and profile.
+    """
+    cache_dir = Path(cache_dir or data_sources.DATA_DIR / PATTERN_DIR_NAME)
+    structure_hash = structure.structure_hash()
+    path = cache_file(cache_dir, structure_hash, wavelength)
+    q_grid = grid(wavelength)
+    parameters = np.array([fwhm, eta, q_grid[0], q_grid[-1], len(q_grid)])
+    try:
+        with np.load(path) as data:
+            sticks = Sticks(data["q"], data["intensity"], data["multiplicity"], data["hkl"])
+            if np.array_equal(data["parameters"], parameters):
+                return structure_hash, sticks, q_grid, data["y"]
+    except (OSError, ValueError, KeyError):  # not cached yet, or an unreadable cache file
+        sticks = simulate_sticks(structure, wavelength)
+    y = profile(sticks, q_grid, fwhm, eta)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_sources._atomic_write(
+        path,
+        lambda f: np.savez(
+            f,
+            q=sticks.q,
+            intensity=sticks.intensity,
+            multiplicity=sticks.multiplicity,
+            hkl=sticks.hkl,
+            parameters=parameters,
+            y=y,
+        ),
+        mode="wb",
+    )
+    return structure_hash, sticks, q_grid, y
+
+
+def simulate_file(
+    path: Path, wavelength: float, fwhm: float = DEFAULT_FWHM, eta: float = DEFAULT_ETA, cache_dir: Path = None
+) -> SimulatedPattern:
+    """
+    Parses a CIF and simulates its pattern, see `simulate`. Module level, so it can run in a worker process.
+    """
+    path = Path(path)
+    structure = structure_from_cif(path.read_text(errors="replace"))
+    structure_hash, sticks, x, y = simulate(structure, wavelength, fwhm, eta, cache_dir)
+    return SimulatedPattern(path, structure, structure_hash, sticks, x, y)
+
+
+def _simulate_files(args: tuple) -> list[tuple[Path, SimulatedPattern | None, str | None]]:
+    paths, wavelength, fwhm, eta, cache_dir = args
+    results = []
+    for path in paths:
+        try:
+            results.append((path, simulate_file(path, wavelength, fwhm, eta, cache_dir), None))
+        except (OSError, ValueError) as e:
+            results.append((path, None, str(e)))
+    return results
+
+
+def simulate_files(
+    paths: list[Path],
+    wavelength: float,
+    fwhm: float = DEFAULT_FWHM,
+    eta: float = DEFAULT_ETA,
+    processes: int = None,
+    progress: Callable[[int, int], None] = None,
+    chunk_size: int = 8,
+) -> tuple[list[SimulatedPattern], dict[Path, str]]:
+    """
+    Simulates the patterns of many CIFs in `processes` worker processes (all cores by default). `progress` is called
+    with the number of simulated and of all files; if it raises, the remaining files are not simulated.
+
+    Returns:
+        tuple[list[SimulatedPattern], dict[Path, str]]: The patterns in the order of `paths`, and the error per
+            other file.
+    """
+    cache_dir = data_sources.DATA_DIR / PATTERN_DIR_NAME
+    chunks = [(paths[i : i + chunk_size], wavelength, fwhm, eta, cache_dir) for i in range(0, len(paths), chunk_size)]
+    parallel = processes != 1 and len(chunks) > 1
+    if parallel:
+        executor = ProcessPoolExecutor(processes)
+        results = executor.map(_simulate_files, chunks)
+    else:
+        results = map(_simulate_files, chunks)
+    patterns, errors = [], {}
+    done = 0
+    try:
+        for chunk_results in results:
+            for path, pattern, error in chunk_results:
+                if error is None:
+                    patterns.append(pattern)
+                else:
+                    errors[path] = error
+            done += len(chunk_results)
+            if progress is not None:
+                progress(done, len(paths))
+    finally:
+        if parallel:
+            executor.shutdown(cancel_futures=True)
+    return patterns, errors
+
+
+def import_structures(
+    paths: list[Path],
+    wavelength: float = units.CU_K_ALPHA,
+    tags: list[str] = (),
+    fwhm: float = DEFAULT_FWHM,
+    processes: int = None,
+    progress: Callable[[int, int], None] = None,
+) -> tuple[list[Spectrum], dict[Path, str]]:
+    """
+    Simulates the patterns of CIF files and saves them as spectra on the Q grid, tagged SIMULATED_TAG and `tags`,
+    with the elements of their structures. Spectra are named after their files like linked spectra; patterns that
+    are already in the library are skipped.
+
+    Returns:
+        tuple[list[Spectrum], dict[Path, str]]: The new spectra, and why each other file was skipped.
+    """
+    patterns, skipped = simulate_files(list(paths), wavelength, fwhm, processes=processes, progress=progress)
+    tags = [SIMULATED_TAG] + [tag for tag in tags if tag != SIMULATED_TAG]
+    uploads, elements, descriptions = {}, {}, {}
+    with data_sources.library_lock():
+        existing = {h: names[0] for h, names in data_sources.hash_index()["content"].items()}
+        taken = {p.stem for p in data_sources.DATA_DIR.glob("*.meta")}
+        taken |= {p.stem for p in data_sources.DATA_DIR.glob("*.npz")}
+        for pattern in patterns:
+            content_hash = data_sources.content_hash(pattern.x, pattern.y)
+            if content_hash in existing:
+                skipped[pattern.source_file] = f"Already in the library as '{existing[content_hash]}'."
+                continue
+            name = data_sources._free_name(pattern.source_file, taken)
+            taken.add(name)
+            existing[content_hash] = name
+            uploads[name] = (pattern.x, pattern.y)
+            elements[name] = pattern.structure.elements
+            descriptions[name] = pattern.description(wavelength)
+        spectra = data_sources.save_new_spectra(
+            uploads,
+            contained_elements=set(),
+            tags=tags,
+            x_units={name: units.Q for name in uploads},
+            wavelengths={name: wavelength for name in uploads},
+            write_thumbnails=False,
+            elements=elements,
+            descriptions=descriptions,
+        )
+    return spectra, skipped
+
+
+def import_directory(
+    root: Path,
+    wavelength: float = units.CU_K_ALPHA,
+    tags: list[str] = (),
+    fwhm: float = DEFAULT_FWHM,
+    processes: int = None,
+    progress: Callable[[int, int], None] = None,
+) -> tuple[list[Spectrum], dict[Path, str]]:
+    """
+    Imports every .cif file below `root` (any case of the suffix), see `import_structures`.
+    """
+    paths = sorted(path for path in Path(root).rglob("*") if path.suffix.lower() == ".cif" and path.is_file())
+    return import_structures(paths, wavelength, tags, fwhm, processes, progress)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", type=Path, help="Directory of .cif files")
+    parser.add_argument("--wavelength", type=float, default=units.CU_K_ALPHA, help="Wavelength (Å)")
+    parser.add_argument("--fwhm", type=float, default=DEFAULT_FWHM, help="Peak width in Q (Å⁻¹)")
+    parser.add_argument("--tag", action="append", default=[], help="Tag of all imported spectra (repeatable)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes")
+    args = parser.parse_args()
+
+    spectra, skipped = import_directory(args.root, args.wavelength, args.tag, args.fwhm, args.processes)
+    print(f"Imported {len(spectra)} structures, skipped {len(skipped)} files.")
+    for path, reason in skipped.items():
+        print(f"  {path}: {reason}")
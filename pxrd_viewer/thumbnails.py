@@ -0,0 +1,65 @@
+"""
+Sparkline previews of spectra for the gallery.
+
+A thumbnail is a small SVG with one path: the spectrum is decimated to the minimum and maximum of every pixel
+column, so narrow reflections stay visible at any size. Thumbnails depend only on the x/y data and are stored
+under the content hash of the spectrum, which lets the browser cache them forever.
+
+Run as `python pxrd_viewer/thumbnails.py` to create the thumbnails of spectra saved before they existed.
+"""
+
+import numpy as np
+
+WIDTH = 160
+HEIGHT = 48
+STROKE = "#1976d2"  # the Quasar primary color of the app
+
+
+def sparkline_path(x: np.ndarray, y: np.ndarray, width: int = WIDTH, height: int = HEIGHT) -> str:
+    """
+    Returns the SVG path data of y(x), scaled to `width` × `height` with at most two points per pixel column.
+    """
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if len(x) < 2 or x.min() == x.max():
+        return f"M0,{height / 2:g}H{width}"
+    order = np.argsort(x, kind="stable")
+    x, y = x[order], y[order]
+    columns = ((x - x[0]) / (x[-1] - x[0]) * (width - 1)).astype(np.int64)
+    starts = np.flatnonzero(np.diff(columns, prepend=-1))
+    low = np.minimum.reduceat(y, starts)
+    high = np.maximum.reduceat(y, starts)
+    span = high.max() - low.min()
+    scale = (height - 2) / span if span > 0 else 0.0
+    # SVG y points down; one pixel of margin keeps the stroke inside the view box
+    top = height - 1 - (high - low.min()) * scale
+    bottom = height - 1 - (low - low.min()) * scale
+    points = np.empty((2 * len(starts), 2))
+    points[0::2, 0] = points[1::2, 0] = columns[starts] + 0.5
+    points[0::2, 1], points[1::2, 1] = top, bottom
+    return "M" + "L".join(f"{px:.1f},{py:.1f}" for px, py in points)
+
+
+def render_svg(x: np.ndarray, y: np.ndarray, width: int = WIDTH, height: int = HEIGHT) -> str:
+    """
+    Renders the thumbnail of a spectrum as a standalone SVG document.
+    """
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" preserveAspectRatio="none">'
+        f'<path d="{sparkline_path(x, y, width, height)}" fill="none" stroke="{STROKE}" stroke-width="1" '
+        'stroke-linejoin="round" vector-effect="non-scaling-stroke"/></svg>'
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_sources
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keep-orphans", action="store_true", help="Keep thumbnails of deleted spectra")
+    args = parser.parse_args()
+
+    created, removed = data_sources.backfill_thumbnails(prune=not args.keep_orphans)
+    print(f"Created {created} thumbnails, removed {removed} orphaned ones.")
@@ -0,0 +1,75 @@
+"""
+Conversions between the x-axis units of diffraction patterns.
+
+Q = 4π sin(θ) / λ does not depend on the wavelength, so every conversion goes through Q:
+2θ needs the wavelength of the measurement (source) or of the requested view (target), d = 2π / Q does not.
+"""
+
+import numpy as np
+
+Q = "q"
+TWO_THETA = "2theta"
+D_SPACING = "d"
+
+UNITS = {Q: "Q (Å⁻¹)", TWO_THETA: "2θ (°)", D_SPACING: "d (Å)"}
+
+CU_K_ALPHA = 1.5406  # Å
+
+# Common X-ray tube anodes (Kα1 lines), offered as presets for the view wavelength
+ANODE_WAVELENGTHS = {
+    "Cu Kα": 1.5406,
+    "Mo Kα": 0.70930,
+    "Co Kα": 1.78897,
+    "Fe Kα": 1.93604,
+    "Cr Kα": 2.28970,
+    "Ag Kα": 0.55941,
+}
+
+
+def _require_wavelength(unit: str, wavelength: float | None):
+    if unit == TWO_THETA and not wavelength:
+        raise ValueError("Converting from or to 2θ requires a wavelength.")
+
+
+def to_q(x: np.ndarray, unit: str, wavelength: float = None) -> np.ndarray:
+    """
+    Converts an axis given in `unit` to Q. `wavelength` (Å) is only needed for 2θ.
+    """
+    _require_wavelength(unit, wavelength)
+    x = np.asarray(x, dtype=np.float64)
+    if unit == Q:
+        return x
+    if unit == TWO_THETA:
+        return (4 * np.pi / wavelength) * np.sin(np.radians(x) / 2)
+    if unit == D_SPACING:
+        with np.errstate(divide="ignore"):
+            return 2 * np.pi / x
+    raise ValueError(f"Unknown unit '{unit}', expected one of {', '.join(UNITS)}.")
+
+
+def from_q(q: np.ndarray, unit: str, wavelength: float = None) -> np.ndarray:
+    """
+    Converts Q to `unit`. Points that do not exist in the target unit (Q = 0 as d-spacing, or reflections beyond
+    2θ = 180° for the given wavelength) become NaN, which plotly draws as gaps.
+    """
+    _require_wavelength(unit, wavelength)
+    q = np.asarray(q, dtype=np.float64)
+    if unit == Q:
+        return q
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if unit == TWO_THETA:
+            return 2 * np.degrees(np.arcsin(q * wavelength / (4 * np.pi)))
+        if unit == D_SPACING:
+            return np.where(q > 0, 2 * np.pi / q, np.nan)
+    raise ValueError(f"Unknown unit '{unit}', expected one of {', '.join(UNITS)}.")
+
+
+def convert(
+    x: np.ndarray, unit: str, wavelength: float | None, target_unit: str, target_wavelength: float = None
+) -> np.ndarray:
+    """
+    Converts an axis measured in `unit` at `wavelength` to `target_unit` at `target_wavelength`.
+    """
+    if unit == target_unit and (unit != TWO_THETA or wavelength == target_wavelength):
+        return np.asarray(x)
+    return from_q(to_q(x, unit, wavelength), target_unit, target_wavelength)
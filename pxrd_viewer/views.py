@@ -0,0 +1,226 @@
+"""
+Saved comparison views of the viewer: the lines in view with their styles and Q corrections, and the x axis.
+
+A view is a small dict that references spectra by name:
+
+    {"v": 1, "x_unit": "q", "wavelength": 1.5406, "lines": [
+        {"role": "selected", "spectrum": "CuO_300K", "color": "#FF0000", "inverse": false},
+        {"spectrum": "CuO_500K", "q_shift": 0.012},
+        {"inputs": [0, 1], "operation": "difference", "color": "#008000"}]}
+
+Style fields that equal the defaults of new lines are left out, and derived lines refer to their inputs by index.
+`encode` packs a view into a URL-safe token for `/?view=<token>`, and named views are stored for everyone in
+`.views.json` next to the spectra.
+"""
+
+import base64
+import json
+import math
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import data_sources
+import derived
+import units
+from data_sources import Spectrum
+
+VERSION = 1
+STORE_FILE_NAME = ".views.json"
+
+# Defaults of the style fields of a line; fields with these values are not stored
+LINE_DEFAULTS = {
+    "color": "#0000FF",
+    "opacity": 0.8,
+    "dash": "solid",
+    "width": 2.0,
+    "inverse": True,
+    "q_shift": 0.0,
+    "q_scale": 1.0,
+    "name": None,
+}
+ROLES = ("selected", "rotation", "pinned")
+
+# Allowed ranges of the numeric style fields, those of the sliders of a line
+OPACITY_RANGE = (0.0, 1.0)
+WIDTH_RANGE = (0.0, 3.0)
+
+# Upper bounds for views decoded from URLs, so a crafted link cannot make the server load the whole library
+MAX_LINES = 64
+MAX_TOKEN_LENGTH = 16 * 1024
+MAX_JSON_SIZE = 256 * 1024
+
+# Arrays of a view are read in parallel; most of the time is spent waiting for the disk or the archive share
+PRELOAD_THREADS = 8
+
+
+def compact_line(entry: dict) -> dict:
+    """
+    Returns the view entry of a line without the fields that have their default value.
+    """
+    return {
+        key: value
+        for key, value in entry.items()
+        if value is not None and not (key == "role" and value == "pinned") and LINE_DEFAULTS.get(key, ...) != value
+    }
+
+
+def expand_line(entry: dict) -> dict:
+    """
+    Returns the view entry of a line with all default fields filled in.
+    """
+    return {"role": "pinned", **LINE_DEFAULTS, **entry}
+
+
+def _is_number(value) -> bool:
+    # JSON allows Infinity and NaN, and booleans are ints
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _check_style(entry: dict) -> bool:
+    """
+    Whether the style fields of a view entry have the types (and ranges) the viewer can draw.
+    """
+    style = expand_line(entry)
+    return (
+        _is_number(style["q_shift"])
+        and _is_number(style["q_scale"])
+        and _is_number(style["opacity"])
+        and OPACITY_RANGE[0] <= style["opacity"] <= OPACITY_RANGE[1]
+        and _is_number(style["width"])
+        and WIDTH_RANGE[0] <= style["width"] <= WIDTH_RANGE[1]
+        and isinstance(style["color"], str)
+        and isinstance(style["dash"], str)
+        and isinstance(style["inverse"], bool)
+        and (style["name"] is None or isinstance(style["name"], str))
+    )
+
+
+def _check(view) -> dict:
+    if not isinstance(view, dict) or view.get("v") != VERSION or not isinstance(view.get("lines"), list):
+        raise ValueError("Not a saved view of this version")
+    if view.get("x_unit", units.Q) not in units.UNITS:
+        raise ValueError(f"Unknown x axis unit '{view['x_unit']}'")
+    wavelength = view.get("wavelength")
+    if wavelength is not None and not (_is_number(wavelength) and wavelength > 0):
+        raise ValueError("The wavelength of the view must be a positive number")
+    lines = view["lines"]
+    if len(lines) > MAX_LINES:
+        raise ValueError(f"A view can hold at most {MAX_LINES} lines")
+    for i, entry in enumerate(lines):
+        if not isinstance(entry, dict) or entry.get("role", "pinned") not in ROLES:
+            raise ValueError(f"Line {i} of the view is malformed")
+        if not _check_style(entry):
+            raise ValueError(f"Line {i} of the view has an invalid style")
+        inputs = entry.get("inputs")
+        if inputs is None:
+            if not isinstance(entry.get("spectrum"), str):
+                raise ValueError(f"Line {i} of the view references no spectrum")
+        elif not (isinstance(inputs, list) and all(isinstance(j, int) and 0 <= j < i for j in inputs)):
+            raise ValueError(f"Derived line {i} of the view must refer to earlier lines")
+        elif entry.get("role", "pinned") != "pinned" or entry.get("operation", "difference") not in derived.OPERATIONS:
+            raise ValueError(f"Derived line {i} of the view is malformed")
+        elif entry.get("operation") == "scaled_sum" and not (
+            isinstance(entry.get("scales"), list)
+            and len(entry["scales"]) == len(inputs)
+            and all(_is_number(scale) for scale in entry["scales"])
+        ):
+            raise ValueError(f"Derived line {i} of the view needs one scale factor per input")
+    for role in ("selected", "rotation"):
+        if sum(entry.get("role") == role for entry in lines) > 1:
+            raise ValueError(f"A view has at most one {role} line")
+    return view
+
+
+def encode(view: dict) -> str:
+    """
+    Packs a view into a URL-safe token: its JSON, deflated without zlib header, in base64 without padding.
+    """
+    data = json.dumps(view, separators=(",", ":"), ensure_ascii=False).encode()
+    compressor = zlib.compressobj(9, wbits=-15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return base64.urlsafe_b64encode(compressed).rstrip(b"=").decode("ascii")
+
+
+def decode(token: str) -> dict:
+    """
+    Unpacks and checks a token made by `encode`.
+
+    Raises:
+        ValueError: If the token is not a valid view.
+    """
+    if len(token) > MAX_TOKEN_LENGTH:
+        raise ValueError("The view token is too long")
+    try:
+        compressed = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        decompressor = zlib.decompressobj(wbits=-15)
+        data = decompressor.decompress(compressed, MAX_JSON_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError("The view is too large")
+        view = json.loads(data)
+    except (zlib.error, ValueError) as e:
+        raise ValueError(f"Not a valid view token: {e}") from e
+    return _check(view)
+
+
+def referenced_spectra(view: dict) -> list[str]:
+    """
+    Returns the names of the spectra the lines of a view show, without duplicates.
+    """
+    return list(dict.fromkeys(entry["spectrum"] for entry in view["lines"] if "spectrum" in entry))
+
+
+def preload(spectra: list[Spectrum], threads: int = PRELOAD_THREADS) -> dict[str, str]:
+    """
+    Reads the arrays of `spectra` concurrently, so showing a view afterwards reads nothing.
+
+    Returns:
+        dict[str, str]: The error per spectrum whose arrays could not be read.
+    """
+
+    def load(spectrum):
+        try:
+            spectrum.x, spectrum.y
+        except (OSError, ValueError) as e:
+            return spectrum.name, str(e)
+        return spectrum.name, None
+
+    with ThreadPoolExecutor(max(1, min(threads, len(spectra)))) as executor:
+        return {name: error for name, error in executor.map(load, spectra) if error is not None}
+
+
+def _store_file():
+    return data_sources.DATA_DIR / STORE_FILE_NAME
+
+
+def saved_views() -> dict[str, str]:
+    """
+    Returns the tokens of the stored views by name, in alphabetical order.
+    """
+    try:
+        with open(_store_file(), "r") as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return dict(sorted(stored.items(), key=lambda item: item[0].casefold()))
+
+
+def save_view(name: str, view: dict) -> str:
+    """
+    Stores a view under `name`, replacing a view of the same name.
+
+    Returns:
+        str: The token of the view.
+    """
+    token = encode(_check(view))
+    with data_sources.library_lock():
+        stored = saved_views()
+        stored[name] = token
+        data_sources._atomic_write(_store_file(), lambda f: json.dump(stored, f, indent=1))
+    return token
+
+
+def delete_view(name: str) -> None:
+    with data_sources.library_lock():
+        stored = saved_views()
+        if stored.pop(name, None) is not None:
+            data_sources._atomic_write(_store_file(), lambda f: json.dump(stored, f, indent=1))
@@ -0,0 +1,38 @@
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# The app modules import each other as top-level modules (the app is started as `python pxrd_viewer/app.py`).
+sys.path.insert(0, str(Path(__file__).parent.parent / "pxrd_viewer"))
+
+import data_sources  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    An empty library in `tmp_path / "library"`, so tests can keep other files (uploads, archives) next to it.
+    """
+    library = tmp_path / "library"
+    library.mkdir()
+    monkeypatch.setattr(data_sources, "DATA_DIR", library)
+    monkeypatch.setitem(data_sources._catalog_cache, "generation", None)
+    return library
+
+
+def raw_bytes(counts, machine="POLY II", title="sample"):
+    """
+    Returns a minimal .raw file of a POLY II (int16 counts) or Powdat (int32 counts) diffractometer.
+    """
+    info_offset = 0x600 if machine == "POLY II" else 0x800
+    header = bytearray(info_offset + 0x200)
+    struct.pack_into("8s8s", header, 0x00, b"RAW1.01", machine.encode())
+    struct.pack_into("32s", header, 0x20, title.encode())
+    struct.pack_into("<HHff", header, 0x13E, 40, 30, 1.5406, 1.5406)
+    struct.pack_into("<H", header, info_offset + 0x22, len(counts))
+    struct.pack_into("<ff", header, info_offset + 0x2C, 10.0, 0.0)
+    struct.pack_into("<f", header, info_offset + 0x34, 80.0)
+    return bytes(header) + np.asarray(counts, dtype="<i2" if machine == "POLY II" else "<i4").tobytes()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import align
+import data_sources
+import units
+
+Q = np.linspace(0.5, 6.0, 3000)
+REFLECTIONS = [1.5, 2.3, 3.7, 4.1]
+
+
+def pattern(centers):
+    return 0.1 + sum(np.exp(-((Q - c) ** 2) / 2e-4) for c in centers)
+
+
+def test_align_recovers_a_zero_offset_and_a_lattice_scale():
+    reference = (Q, pattern(REFLECTIONS))
+    correction, similarity = align.align(reference, (Q, pattern([c + 0.03 for c in REFLECTIONS])), align.SHIFT)
+    assert correction == pytest.approx(-0.03, abs=5e-4)
+    assert similarity > 0.99
+
+    # Descending axes (as converted d-spacings are) are handled as well
+    scaled = pattern([c * 1.02 for c in REFLECTIONS])
+    correction, similarity = align.align(reference, (Q[::-1], scaled[::-1]), align.SCALE)
+    assert correction == pytest.approx(1 / 1.02, rel=5e-4)
+    assert similarity > 0.99
+
+
+def test_corrections_are_limited_to_the_searched_range():
+    reference = (Q, pattern(REFLECTIONS))
+    correction, _ = align.align(reference, (Q, pattern([c + 0.5 for c in REFLECTIONS])), max_correction=0.1)
+    assert abs(correction) <= 0.1 + 2 * (Q[-1] - Q[0]) / align.DEFAULT_BINS
+
+
+def test_rank_library_finds_shifted_matches(data_dir):
+    shifted = pattern([c - 0.05 for c in REFLECTIONS])
+    data_sources.save_new_spectrum("other", (Q, pattern([1.0, 2.9, 5.2])), {"Si"}, [])
+    data_sources.save_new_spectrum("shifted", (Q, shifted), {"Si"}, [])
+    # Stored in 2θ; the ranking works in Q regardless of the unit a spectrum was saved in
+    two_theta = units.from_q(Q, units.TWO_THETA, units.CU_K_ALPHA)
+    data_sources.save_new_spectrum(
+        "shifted_2theta", (two_theta, shifted), {"Si"}, [], x_unit=units.TWO_THETA, wavelength=units.CU_K_ALPHA
+    )
+
+    ranking = align.rank_library((Q, pattern(REFLECTIONS)), data_sources.list_available_spectra(), block_size=2)
+    assert sorted(a.name for a in ranking[:2]) == ["shifted", "shifted_2theta"]
+    for alignment in ranking[:2]:
+        assert alignment.correction == pytest.approx(0.05, abs=5e-4)
+        assert alignment.similarity > 0.99 > alignment.unaligned_similarity
+
+    (data_dir / "other.npz").unlink()
+    ranking = align.rank_library((Q, pattern(REFLECTIONS)), data_sources.list_available_spectra(), block_size=2)
+    assert sorted(a.name for a in ranking) == ["shifted", "shifted_2theta"]
@@ -0,0 +1,138 @@
+import io
+import struct
+import zipfile
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api
+import counts_codec
+import data_sources
+
+
+@pytest.fixture
+def client(data_dir):
+    app = FastAPI()
+    app.include_router(api.router)
+    return TestClient(app)
+
+
+def save(name, points=10, tags=(), elements=("Cu",)):
+    x = np.linspace(1.0, 5.0, points)
+    y = np.random.rand(points)
+    data_sources.save_new_spectrum(name, (x, y), set(elements), list(tags))
+    return x, y
+
+
+def test_catalog_is_paged_filtered_and_revalidated(client):
+    for i in range(5):
+        save(f"sample_{i}", tags=["oxide"] if i % 2 else [])
+    save("quartz", elements=("Si", "O"))
+
+    response = client.get("/api/spectra", params={"limit": 2, "offset": 2})
+    assert response.json()["total"] == 6
+    assert len(response.json()["spectra"]) == 2
+    oxides = client.get("/api/spectra", params={"tag": "oxide"}).json()["spectra"]
+    assert sorted(s["name"] for s in oxides) == ["sample_1", "sample_3"]
+    assert client.get("/api/spectra", params={"element": ["Si", "O"]}).json()["total"] == 1
+    assert client.get("/api/spectra", params={"q": "quartz"}).json()["spectra"][0]["name"] == "quartz"
+
+    etag = response.headers["ETag"]
+    assert client.get("/api/spectra", headers={"If-None-Match": etag}).status_code == 304
+    save("new_one")
+    assert client.get("/api/spectra", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_spectrum_data_as_float32_and_npy_with_etags(client):
+    x, y = save("sample", points=7)
+    response = client.get("/api/spectra/sample/data")
+    assert response.headers["X-Points"] == "7"
+    data = np.frombuffer(response.content, dtype="<f4").reshape(2, -1)
+    assert np.allclose(data, [x, y])
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert (
+        client.get("/api/spectra/sample/data", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    )
+
+    npy = client.get("/api/spectra/sample/data", params={"format": "npy"})
+    assert np.allclose(np.load(io.BytesIO(npy.content)), [x, y])
+    assert npy.headers["ETag"] != response.headers["ETag"]
+
+    by_hash = client.get(client.get("/api/spectra/sample").json()["data_url"])
+    assert by_hash.content == response.content
+    assert "immutable" in by_hash.headers["Cache-Control"]
+
+    assert client.get("/api/spectra/missing/data").status_code == 404
+    assert client.get("/api/spectra/sample/counts").status_code == 404
+
+    counts = np.array([3, 40, 900, 40, 3], dtype="<i2")
+    raw_counts = counts_codec.RawCounts(counts, 10.0, 80.0, 1.5406)
+    data_sources.save_new_spectrum("counted", raw_counts.to_xy(), {"Cu"}, [], raw_counts=raw_counts)
+    stored = np.load(io.BytesIO(client.get("/api/spectra/counted/counts").content))
+    assert stored.dtype == np.dtype("<i2")
+    np.testing.assert_array_equal(stored, counts)
+    assert client.get("/api/spectra/sample/data", params={"format": "csv"}).status_code == 400
+
+
+def test_bulk_fetch(client):
+    arrays = {name: save(name, points=points) for name, points in [("a", 4), ("b", 6)]}
+
+    response = client.get("/api/bulk", params={"name": ["b", "a"]})
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["b.npy", "a.npy"]
+    npz = np.load(io.BytesIO(response.content))
+    assert np.allclose(npz["a"], arrays["a"])
+    assert (
+        client.get(
+            "/api/bulk", params={"name": ["b", "a"]}, headers={"If-None-Match": response.headers["ETag"]}
+        ).status_code
+        == 304
+    )
+
+    raw = client.post("/api/bulk", json={"names": ["a", "b"], "format": "f32"}).content
+    offset = 0
+    for name in ["a", "b"]:
+        (points,) = struct.unpack_from("<I", raw, offset)
+        data = np.frombuffer(raw, dtype="<f4", count=2 * points, offset=offset + 4).reshape(2, points)
+        assert np.allclose(data, arrays[name])
+        offset += 4 + 8 * points
+    assert offset == len(raw)
+
+    assert client.post("/api/bulk", json={"names": ["a", "nope"]}).json()["detail"] == {"missing": ["nope"]}
+    (data_sources.DATA_DIR / "b.npz").unlink()
+    response = client.post("/api/bulk", json={"names": ["a", "b"]})
+    assert response.status_code == 404 and response.json()["detail"] == {"unavailable": ["b"]}
+    assert client.get("/api/spectra/b/data").status_code == 404
+
+
+def test_thumbnails_are_immutable_and_rendered_on_demand(client):
+    save("sample", points=50)
+    url = client.get("/api/spectra/sample").json()["data_url"].replace("/data/", "/thumbnails/") + ".svg"
+    response = client.get(url)
+    assert response.headers["content-type"] == "image/svg+xml"
+    assert "immutable" in response.headers["Cache-Control"]
+
+    # A thumbnail that was never written (or got lost) is rendered from the data
+    data_sources.thumbnail_file(url.rsplit("/", 1)[1].removesuffix(".svg")).unlink()
+    assert client.get(url).content == response.content
+    assert client.get("/api/thumbnails/" + "0" * 32 + ".svg").status_code == 404
+    assert client.get("/api/thumbnails/..%2F.lock.svg").status_code in (404, 422)
+
+
+def test_export_streams_filtered_spectra(client):
+    save("sample_1", tags=["oxide"])
+    save("sample_2", tags=["oxide"])
+    save("other")
+    response = client.get("/api/export", params={"tag": "oxide"})
+    assert response.headers["Content-Type"] == "application/zip"
+    assert response.headers["X-Spectra"] == "2"
+    assert "attachment" in response.headers["Content-Disposition"]
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert sorted(names) == ["metadata.csv", "sample_1.xy", "sample_2.xy"]
+
+    response = client.post("/api/export", json={"names": ["other"], "format": "npz"})
+    assert list(np.load(io.BytesIO(response.content))["metadata"]["name"]) == ["other"]
+    assert client.get("/api/export", params={"name": "missing"}).status_code == 404
+    assert client.get("/api/export", params={"format": "hdf5"}).status_code == 400
@@ -0,0 +1,73 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+import archive
+import data_sources
+from tests.conftest import raw_bytes
+
+
+@pytest.fixture
+def library(data_dir, tmp_path):
+    share = tmp_path / "share"
+    (share / "2024").mkdir(parents=True)
+    (share / "sample.raw").write_bytes(raw_bytes([1, 5, 20, 5, 1], title="CuO 300K"))
+    (share / "2024" / "sample.raw").write_bytes(raw_bytes([2, 100000, 2], machine="Powdat"))
+    (share / "2024" / "scan.XYD").write_text("10.0 1\n20.0 4\n30.0 2\n")
+    (share / "broken.raw").write_bytes(b"not a raw file")
+    return share
+
+
+def test_linking_reads_only_headers_and_decodes_on_first_view(library, monkeypatch):
+    def no_decoding(path):
+        raise AssertionError("linking must not decode the counts")
+
+    with monkeypatch.context() as m:
+        m.setattr(data_sources, "load_spectrum_file", no_decoding)
+        spectra, skipped = archive.link_directory(library, tags=["archive"])
+    # Files are linked in path order; names that are taken get the parent directory as prefix
+    assert sorted(s.name for s in spectra) == ["sample", "scan", "share_sample"]
+    assert list(skipped) == [library / "broken.raw"]
+    # Nothing is copied into the library
+    assert not list(data_sources.DATA_DIR.glob("*.npz"))
+
+    by_name = {s.name: s for s in data_sources.list_available_spectra()}
+    sample = by_name["share_sample"]
+    assert sample.linked and sample.source_file == (library / "sample.raw").resolve()
+    assert sample.description == "CuO 300K" and sample.tags == ["archive"]
+    with open(library / "sample.raw", "rb") as f:
+        expected = data_sources.load_raw_file(f)
+    np.testing.assert_array_equal(sample.y, expected[1])
+    np.testing.assert_allclose(sample.x, expected[0])
+    assert by_name["sample"].y.max() == 1.0 and by_name["scan"].x_unit == "2theta"
+    assert data_sources.load_xyd_file(io.BytesIO(b"1 2\n3 4\n"))[1][-1] == 1.0
+
+    # Linking again skips the files that are already linked
+    spectra, skipped = archive.link_directory(library)
+    assert spectra == [] and len(skipped) == 4
+
+
+def test_validation_reindexes_changed_files(library):
+    spectra, _ = archive.link_directory(library)
+    path = library / "sample.raw"
+    sample = next(s for s in spectra if s.source_file == path.resolve())
+    path.write_bytes(raw_bytes([1, 2, 3, 40, 2, 1]))
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10**9))
+    with pytest.raises(data_sources.LinkedFileChangedError):
+        sample.read_data()
+
+    (library / "2024" / "scan.XYD").unlink()
+    report = data_sources.validate_linked_spectra()
+    assert report == {"changed": [sample.name], "missing": ["scan"], "unreadable": []}
+    updated = next(s for s in data_sources.list_available_spectra() if s.name == sample.name)
+    assert updated.content_hash != sample.content_hash
+    assert data_sources.hash_index()["content"][updated.content_hash] == [sample.name]
+    assert len(updated.y) == 6
+
+    # Renaming and deleting only touch the .meta file, never the archive
+    renamed = data_sources.edit_spectrum(updated, new_name="renamed")
+    assert renamed.source_file == path.resolve() and len(renamed.y) == 6
+    data_sources.delete_spectrum(renamed)
+    assert path.exists()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import counts_codec
+import data_sources
+import dedup
+import integrity
+from tests.conftest import raw_bytes
+
+
+@pytest.mark.parametrize("dtype", ["<i2", "<i4"])
+def test_counts_round_trip_losslessly(dtype):
+    rng = np.random.default_rng(0)
+    info = np.iinfo(dtype)
+    counts = np.concatenate([rng.poisson(500, 1000), [0, info.max, info.min, info.max, 7]]).astype(dtype)
+    encoded = counts_codec.encode(counts)
+    decoded = counts_codec.decode(encoded)
+    assert decoded.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(decoded, counts)
+    assert len(counts_codec.encode(np.full(4000, 1000, dtype=dtype))) < 100
+
+    with pytest.raises(ValueError):
+        counts_codec.decode(encoded[:-5])
+    with pytest.raises(ValueError):
+        counts_codec.decode(b"not counts")
+    with pytest.raises(ValueError):
+        counts_codec.encode(counts.astype(np.float32))
+
+
+def test_raw_imports_keep_their_counts(data_dir, tmp_path):
+    rng = np.random.default_rng(1)
+    counts = rng.poisson(np.linspace(50, 5000, 2000)).astype("<i4")
+    raw_file = tmp_path / "sample.raw"
+    raw_file.write_bytes(raw_bytes(counts, machine="Powdat"))
+    x, y, raw_counts = data_sources.parse_spectrum_file(raw_file)
+
+    counted, arrays = data_sources.save_new_spectra(
+        {"counted": (x, y), "arrays": (x, y)}, {"Cu"}, [], allow_duplicates=True, raw_counts={"counted": raw_counts}
+    )
+    assert (data_dir / "counted.npz").stat().st_size < (data_dir / "arrays.npz").stat().st_size / 4
+
+    # Normalized on read to exactly the arrays of the parsed file, so the content hash is unchanged
+    stored_x, stored_y = data_sources.Spectrum(counted.name, counted.source_file).read_data()
+    np.testing.assert_array_equal(stored_x, x)
+    np.testing.assert_array_equal(stored_y, y)
+    assert data_sources.content_hash(stored_x, stored_y) == counted.content_hash == arrays.content_hash
+    np.testing.assert_array_equal(data_sources.read_npz_x(counted.source_file), x)
+
+    stored = counted.read_counts()
+    assert stored.counts.dtype == np.dtype("<i4")
+    np.testing.assert_array_equal(stored.counts, counts)
+    np.testing.assert_allclose(stored.sigma(), np.sqrt(counts) / counts.max(), rtol=1e-6)
+    assert arrays.read_counts() is None
+
+    assert integrity.check_library(processes=1).ok
+    assert dedup.find_duplicates(threshold=0.999)[0] == [["arrays", "counted"]]
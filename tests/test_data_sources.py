@@ -1,10 +1,12 @@
 import io
+import multiprocessing
 import numpy as np
 from pathlib import Path
 
 import pytest
 
-from pxrd_viewer.data_sources import load_xyd_file
+import data_sources
+from data_sources import load_xyd_file
 
 # Collect all .xyd files in the data/xyds folder
 DATA_DIR = Path(__file__).parent / "data" / "xyds"
@@ -30,3 +32,166 @@ def test_load_xyd_file_shape_and_normalization(xyd_file_path):
     assert np.isclose(np.max(y), 1.0)
     # Check that there are at least two data points
     assert len(x) >= 2
+
+
+def random_spectrum():
+    return np.arange(10.0), np.random.rand(10)
+
+
+def _save_spectra_in_process(data_dir, names):
+    data_sources.DATA_DIR = Path(data_dir)
+    for name in names:
+        data_sources.save_new_spectrum(name, random_spectrum(), {"Cu"}, ["worker"])
+
+
+def _rename_in_process(data_dir, old_name, new_name):
+    data_sources.DATA_DIR = Path(data_dir)
+    spectrum = next(s for s in data_sources.list_available_spectra() if s.name == old_name)
+    data_sources.edit_spectrum(spectrum, new_name=new_name)
+
+
+def test_concurrent_saves_from_several_processes(data_dir):
+    ctx = multiprocessing.get_context("spawn")
+    batches = [[f"p{p}_{i}" for i in range(10)] for p in range(4)]
+    processes = [ctx.Process(target=_save_spectra_in_process, args=(str(data_dir), names)) for names in batches]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    names = {s.name for s in data_sources.list_available_spectra()}
+    assert names == {name for batch in batches for name in batch}
+    assert data_sources.read_generation() == 40
+    assert not list(data_dir.glob("*.tmp"))
+
+
+def test_catalog_sees_changes_of_other_processes(data_dir):
+    data_sources.save_new_spectrum("original", random_spectrum(), {"Cu"}, [])
+    assert [s.name for s in data_sources.list_available_spectra()] == ["original"]
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=_rename_in_process, args=(str(data_dir), "original", "renamed")
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    spectra = data_sources.list_available_spectra()
+    assert [s.name for s in spectra] == ["renamed"]
+    assert np.array_equal(spectra[0].x, np.arange(10.0))
+    assert sorted(p.name for p in data_dir.glob("*.npz")) == ["renamed.npz"]
+
+
+def test_data_dir_is_created_on_first_write(tmp_path, monkeypatch):
+    missing = tmp_path / "library"
+    monkeypatch.setattr(data_sources, "DATA_DIR", missing)
+    assert data_sources.list_available_spectra() == []
+    assert not missing.exists()
+    data_sources.save_new_spectrum("first", random_spectrum(), {"Cu"}, [])
+    assert [s.name for s in data_sources.list_available_spectra()] == ["first"]
+
+
+def test_failed_save_leaves_no_files(data_dir):
+    data_sources.save_new_spectrum("taken", random_spectrum(), {"Cu"}, [])
+    generation = data_sources.read_generation()
+    with pytest.raises(FileExistsError):
+        data_sources.save_new_spectrum("taken", random_spectrum(), {"Cu"}, [])
+    assert data_sources.read_generation() == generation
+    assert sorted(p.name for p in data_dir.iterdir() if not p.name.startswith(".")) == ["taken.meta", "taken.npz"]
+
+
+def test_batch_save_is_all_or_nothing(data_dir):
+    data_sources.save_new_spectrum("taken", random_spectrum(), {"Cu"}, [])
+    uploads = {name: random_spectrum() for name in ["a", "b", "taken"]}
+    with pytest.raises(FileExistsError):
+        data_sources.save_new_spectra(uploads, {"Cu"}, ["batch"])
+    assert [s.name for s in data_sources.list_available_spectra()] == ["taken"]
+
+    generation = data_sources.read_generation()
+    del uploads["taken"]
+    saved = data_sources.save_new_spectra(uploads, {"Cu"}, ["batch"], display_names={"a": "Sample A"})
+    assert [s.readable_name for s in saved] == ["Sample A", "b"]
+    assert data_sources.read_generation() == generation + 1
+    assert sorted(s.name for s in data_sources.list_available_spectra()) == ["a", "b", "taken"]
+
+
+def test_duplicates_are_rejected_using_the_hash_index(data_dir):
+    x, y = random_spectrum()
+    data_sources.save_new_spectrum("original", (x, y), {"Cu"}, [], raw_hash="raw-1")
+    assert data_sources.find_duplicate(x, y.astype(np.float32)) == "original"
+    assert data_sources.find_duplicate(raw_hash="raw-1") == "original"
+    with pytest.raises(data_sources.DuplicateSpectrumError) as error:
+        data_sources.save_new_spectrum("copy", (x, y), {"Cu"}, [])
+    assert error.value.existing_name == "original"
+    with pytest.raises(data_sources.DuplicateSpectrumError):
+        data_sources.save_new_spectra({"a": (x, y + 1), "b": (x, y + 1)}, {"Cu"}, [])
+
+    spectrum = data_sources.list_available_spectra()[0]
+    renamed = data_sources.edit_spectrum(spectrum, new_name="renamed", tags=["t"])
+    assert renamed.content_hash == spectrum.content_hash
+    assert data_sources.find_duplicate(x, y) == "renamed"
+    data_sources.delete_spectrum(renamed)
+    assert data_sources.find_duplicate(x, y) is None
+    data_sources.save_new_spectrum("copy", (x, y), {"Cu"}, [])
+
+    # Deleting one of two copies saved on purpose keeps the other findable
+    newest = data_sources.save_new_spectrum("newest", (x, y), {"Cu"}, [], allow_duplicates=True)
+    data_sources.delete_spectrum(newest)
+    assert data_sources.find_duplicate(x, y) == "copy"
+
+
+def test_hash_index_is_rebuilt_for_existing_libraries(data_dir):
+    x, y = random_spectrum()
+    data_sources.save_new_spectrum("legacy", (x, y), {"Cu"}, [])
+    (data_dir / data_sources.HASH_INDEX_FILE_NAME).unlink()
+    assert data_sources.find_duplicate(x, y) == "legacy"
+    assert (data_dir / data_sources.HASH_INDEX_FILE_NAME).exists()
+
+    # Indexes of older versions, which named one spectrum per hash, are rebuilt as well
+    data_sources._write_hash_index({"content": {data_sources.content_hash(x, y): "legacy"}, "raw": {}})
+    assert data_sources.hash_index()["content"] == {data_sources.content_hash(x, y): ["legacy"]}
+
+
+def test_batch_edit_applies_all_changes_with_one_invalidation(data_dir):
+    for name in ["a", "b"]:
+        data_sources.save_new_spectrum(name, random_spectrum(), {"Cu", "O"}, ["keep", "drop"])
+    generation = data_sources.read_generation()
+
+    updated = data_sources.edit_spectra(
+        data_sources.list_available_spectra(),
+        add_elements={"Fe"},
+        remove_elements={"O"},
+        add_tags=["new"],
+        remove_tags=["drop"],
+        description="batch",
+    )
+    assert data_sources.read_generation() == generation + 1
+    for spectrum in updated + data_sources.list_available_spectra():
+        assert spectrum.contained_elements == {"Cu", "Fe"}
+        assert spectrum.tags == ["keep", "new"]
+        assert spectrum.description == "batch"
+        assert spectrum.content_hash is not None
+
+
+def test_batch_edit_rolls_back_on_failure(data_dir, monkeypatch):
+    for name in ["a", "b", "c"]:
+        data_sources.save_new_spectrum(name, random_spectrum(), {"Cu"}, ["old"])
+    spectra = sorted(data_sources.list_available_spectra(), key=lambda s: s.name)
+
+    real_replace = data_sources.os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(data_sources.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        data_sources.edit_spectra(spectra, tags=["new"])
+    monkeypatch.setattr(data_sources.os, "replace", real_replace)
+
+    assert [s.tags for s in data_sources.list_available_spectra()] == [["old"]] * 3
+    assert not list(data_dir.glob(".*.tmp"))
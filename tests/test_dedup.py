@@ -0,0 +1,37 @@
+import numpy as np
+
+import data_sources
+import units
+from dedup import find_duplicates
+
+
+def test_find_duplicates_reports_exact_and_near_duplicates(data_dir):
+    x = np.linspace(1.0, 6.0, 2000)
+    peaks = np.exp(-((x - 2.0) ** 2) / 0.001) + 0.5 * np.exp(-((x - 3.5) ** 2) / 0.001)
+    other = np.exp(-((x - 4.5) ** 2) / 0.001)
+    data_sources.save_new_spectrum("a", (x, peaks), {"Cu"}, [])
+    data_sources.save_new_spectrum("a_copy", (x, peaks), {"Cu"}, [], allow_duplicates=True)
+    data_sources.save_new_spectrum("a_noisy", (x, peaks + 0.001 * np.random.rand(len(x))), {"Cu"}, [])
+    data_sources.save_new_spectrum("other", (x, other), {"Cu"}, [])
+    # The same pattern on a 2θ axis is compared on Q
+    two_theta = units.from_q(x, units.TWO_THETA, 1.5406)
+    data_sources.save_new_spectrum(
+        "a_2theta", (two_theta, peaks), {"Cu"}, [], x_unit=units.TWO_THETA, wavelength=1.5406
+    )
+
+    data_sources.save_new_spectrum("gone", (x, other + 0.5), {"Cu"}, [])
+    spectra = data_sources.list_available_spectra()
+    # Deleted after it was listed
+    (data_dir / "gone.npz").unlink()
+    exact, near, skipped = find_duplicates(spectra, threshold=0.99)
+    assert skipped == ["gone"]
+    # Read once for both passes, without caching the arrays on the catalog
+    assert not any(hasattr(spectrum, "_x") for spectrum in spectra)
+    assert [sorted(group) for group in exact] == [["a", "a_copy"]]
+    assert sorted(tuple(sorted(pair[:2])) for pair in near) == [
+        ("a", "a_2theta"),
+        ("a", "a_noisy"),
+        ("a_2theta", "a_copy"),
+        ("a_2theta", "a_noisy"),
+        ("a_copy", "a_noisy"),
+    ]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import derived
+
+
+def test_resample_matches_np_interp_and_caches_weights():
+    x = np.sort(np.random.uniform(1.0, 5.0, 200))
+    y = np.random.rand(200)
+    grid = np.linspace(0.5, 6.0, 300)
+    key = ("sample", grid[0], grid[-1], len(grid))
+    resampled = derived.resample(x, y, grid, key=key)
+    inside = (grid >= x[0]) & (grid <= x[-1])
+    assert np.allclose(resampled[inside], np.interp(grid[inside], x, y))
+    assert np.isnan(resampled[~inside]).all()
+    assert derived.interpolation_weights(x, grid, key) is derived.interpolation_weights(x, grid, key)
+
+
+def test_shared_grid_covers_the_overlap_of_ascending_axes():
+    d_spacing = np.linspace(10.0, 1.0, 50)  # descending, as converted d-spacings are
+    x, y = derived.ascending(np.append(d_spacing, np.nan), np.arange(51.0))
+    assert x[0] == 1.0 and y[0] == 49.0
+    grid = derived.shared_grid([x, np.linspace(2.0, 20.0, 400)])
+    assert (grid[0], grid[-1]) == (2.0, 10.0)
+    with pytest.raises(ValueError):
+        derived.shared_grid([np.linspace(0, 1, 10), np.linspace(2, 3, 10)])
+
+
+def test_combine_operations():
+    a, b, c = np.array([4.0, 6.0]), np.array([2.0, 0.0]), np.array([1.0, 1.0])
+    assert np.allclose(derived.combine([a, b, c], "difference"), [1.0, 5.0])
+    ratio = derived.combine([a, b], "ratio")
+    assert ratio[0] == 2.0 and np.isnan(ratio[1])
+    assert np.allclose(derived.combine([a, b], "sum"), [6.0, 6.0])
+    assert np.allclose(derived.combine([a, b], "scaled_sum", [0.5, -1.0]), [0.0, 3.0])
+    with pytest.raises(ValueError):
+        derived.combine([a], "sum")
@@ -0,0 +1,50 @@
+import csv
+import io
+import zipfile
+
+import numpy as np
+
+import data_sources
+import export
+import units
+
+
+def save(name, q_min=1.0, q_max=5.0, points=200):
+    x = np.linspace(q_min, q_max, points)
+    return data_sources.save_new_spectrum(name, (x, np.sin(x) + 2), {"Cu"}, ["oxide"])
+
+
+def test_xy_zip_holds_text_files_and_metadata(data_dir):
+    spectra = [save("a"), save("b", points=50), save("gone", q_max=6.0)]
+    spectra[2].source_file.unlink()
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(export.stream(spectra, "xy-zip"))))
+    assert sorted(archive.namelist()) == ["a.xy", "b.xy", "metadata.csv"]
+    x, y = np.loadtxt(io.StringIO(archive.read("b.xy").decode())).T
+    assert np.allclose(x, spectra[1].x, rtol=1e-6) and np.allclose(y, spectra[1].y, rtol=1e-6)
+    rows = list(csv.DictReader(io.StringIO(archive.read("metadata.csv").decode())))
+    assert [(row["name"], row["points"], row["tags"]) for row in rows] == [
+        ("a", "200", "oxide"),
+        ("b", "50", "oxide"),
+        ("gone", "0", "oxide"),
+    ]
+    assert rows[2]["error"] and not rows[0]["error"]
+
+
+def test_npz_matrix_is_streamed_in_chunks(data_dir, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(export, "FLUSH_SIZE", 1000)
+    spectra = [save(f"s{i}", q_min=1.0 + i, q_max=5.0 + i) for i in range(5)]
+    two_theta = data_sources.save_new_spectrum("tt", (np.linspace(10, 80, 100), np.ones(100)), {"Cu"}, [])
+    two_theta.x_unit = units.TWO_THETA  # and no wavelength to convert it with
+
+    chunks = list(export.stream(spectra + [two_theta], "npz"))
+    assert len(chunks) > 5
+    with np.load(io.BytesIO(b"".join(chunks))) as data:
+        q, y, metadata = data["q"], data["y"], data["metadata"]
+    assert y.shape == (6, export.GRID_POINTS) and y.dtype == np.float32
+    assert list(metadata["name"]) == ["s0", "s1", "s2", "s3", "s4", "tt"]
+    inside = (q >= 2.0) & (q <= 6.0)
+    assert np.allclose(y[1, inside], np.sin(q[inside]) + 2, atol=1e-3)
+    assert np.isnan(y[1, ~inside]).all()
+    assert np.isnan(y[5]).all() and metadata["error"][5] and not metadata["error"][0]
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import data_sources
+from fulltext import TextIndex, tokenize
+
+
+def spectrum(name, description="", tags=(), display_name=None):
+    return SimpleNamespace(name=name, display_name=display_name, tags=list(tags), description=description)
+
+
+def test_tokenize_splits_names_and_folds_case_and_accents():
+    assert tokenize("CuO_300K, calcinée à 850 °C") == ["cuo", "300k", "calcinee", "a", "850", "c"]
+
+
+def test_search_requires_all_word_prefixes_and_ranks_by_bm25():
+    index = TextIndex(
+        [
+            spectrum("a", "Ball milled for 2 h, then annealed in argon at 850 C."),
+            spectrum("b", "Annealed in air. " + "Long notes about the furnace and the sample holder. " * 5),
+            spectrum("annealed_ref", "Reference"),
+            spectrum("c", "Hydrothermal synthesis"),
+        ]
+    )
+    names = lambda query: index.search(query)[0]  # noqa: E731
+    assert names("anneal argon") == ["a"]
+    # Hits in the name outrank hits in descriptions, and short descriptions outrank long ones
+    assert names("annealed") == ["annealed_ref", "a", "b"]
+    assert names("hydro") == ["c"]
+    assert names("nothing here") == [] and names("  ") == []
+    page, total = index.search("annealed", offset=1, limit=1)
+    assert page == ["a"] and total == 3
+
+
+def test_updates_replace_and_remove_entries():
+    index = TextIndex([spectrum(f"s{i}", "quenched") for i in range(40)])
+    assert index.search("quenched")[1] == 40
+    index.update(added=[spectrum("s3", "sintered")], removed=["s4"])
+    assert index.search("quenched")[1] == 38
+    assert index.search("sintered")[0] == ["s3"]
+    # Many removals rebuild the cached posting arrays
+    index.update(removed=[f"s{i}" for i in range(5, 40)])
+    assert sorted(index.search("quenched")[0]) == ["s0", "s1", "s2"]
+    assert len(index) == 4
+
+
+def test_library_mutations_update_the_index_in_place(data_dir, monkeypatch):
+    monkeypatch.setitem(data_sources._fulltext_cache, "generation", None)
+    x = np.linspace(1.0, 5.0, 10)
+    first = data_sources.save_new_spectrum("first", (x, np.random.rand(10)), {"Cu"}, [], "calcined in air")
+    index = data_sources.fulltext_index()
+
+    data_sources.save_new_spectra({"second": (x, np.random.rand(10))}, {"Cu"}, [], "calcined in argon")
+    assert sorted(index.search("calcined")[0]) == ["first", "second"]
+    renamed = data_sources.edit_spectrum(first, new_name="renamed", description="quenched")
+    assert index.search("calcined")[0] == ["second"] and index.search("quenched")[0] == ["renamed"]
+    data_sources.edit_spectra([renamed], add_tags=["hydrated"])
+    assert index.search("hydrated")[0] == ["renamed"]
+    data_sources.delete_spectrum(renamed)
+    assert index.search("quenched")[0] == []
+    assert data_sources.fulltext_index() is index
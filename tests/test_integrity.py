@@ -0,0 +1,57 @@
+import numpy as np
+
+import data_sources
+import integrity
+
+
+def save(name, points=20):
+    x = np.linspace(1.0, 5.0, points)
+    return data_sources.save_new_spectrum(name, (x, np.random.rand(points)), {"Cu"}, [])
+
+
+def test_broken_entries_are_reported_and_quarantined(data_dir, monkeypatch):
+    monkeypatch.setattr(integrity, "CHUNK_SIZE", 2)
+    for name in ("good", "nan", "no_data", "hash"):
+        save(name)
+    (data_dir / "malformed.meta").write_text("name: malformed\n")
+    (data_dir / "malformed.npz").write_bytes(b"not a zip")
+    np.savez(data_dir / "nan.npz", x=np.linspace(1, 5, 20), y=np.full(20, np.nan))
+    (data_dir / "no_data.npz").unlink()
+    np.savez(data_dir / "hash.npz", x=np.linspace(1, 5, 20), y=np.ones(20))
+    np.savez(data_dir / "orphan.npz", x=np.ones(3), y=np.ones(3))
+    data_sources._write_hash_index({"version": data_sources.HASH_INDEX_VERSION, "content": {}, "raw": {}})
+
+    # One broken entry no longer takes down the listing
+    assert sorted(s.name for s in data_sources.list_available_spectra()) == ["good", "hash", "nan"]
+
+    report = integrity.check_library(processes=2)
+    problems = {problem.entry: problem for problem in report.problems}
+    assert sorted(problems) == ["", "hash", "malformed", "nan", "no_data", "orphan"]
+    assert "source_file" in problems["malformed"].message and "NaN" in problems["nan"].message
+    assert problems["malformed"].files == [data_dir / "malformed.meta", data_dir / "malformed.npz"]
+    assert problems["no_data"].files == [data_dir / "no_data.meta"]
+    assert report.index_stale and not report.ok
+
+    moved = integrity.quarantine(report)
+    assert len(moved) == 8 and all(path.exists() for path in moved)
+    assert sorted(path.name for path in data_dir.iterdir() if not path.name.startswith(".")) == [
+        "good.meta",
+        "good.npz",
+    ]
+    assert integrity.check_library(processes=1).ok
+    assert [s.name for s in data_sources.list_available_spectra()] == ["good"]
+
+
+def test_linked_spectra_are_not_quarantined(data_dir, tmp_path_factory):
+    archive = tmp_path_factory.mktemp("archive")
+    spectrum = save("stored")
+    meta = data_sources.read_meta(data_dir / "stored.meta")
+    meta.update(name="linked", source_file=str(archive / "gone.raw"), linked=True, source_size=1, source_mtime_ns=1)
+    data_sources._write_meta(data_dir / "linked.meta", meta)
+    data_sources.delete_spectrum(spectrum)
+
+    report = integrity.check_library(processes=1)
+    assert [(p.entry, p.files) for p in report.problems] == [("linked", [])]
+    assert "missing" in report.problems[0].message
+    assert integrity.quarantine(report) == []
+    assert (data_dir / "linked.meta").exists()
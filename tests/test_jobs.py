@@ -0,0 +1,142 @@
+import json
+import time
+from dataclasses import asdict
+
+import numpy as np
+
+import data_sources
+import jobs
+from jobs import JobQueue
+
+
+@jobs.job_kind("test-count", "Count")
+def count(context, steps: int, wait: bool = False):
+    for i in range(steps):
+        context.progress(i, steps)
+        if wait:
+            time.sleep(0.002)
+    context.progress(steps, steps)
+    return f"counted to {steps}"
+
+
+def wait_for(job, states=jobs.FINISHED_STATES, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.state not in states:
+        assert time.monotonic() < deadline, f"job is still {job.state}"
+        time.sleep(0.01)
+
+
+def test_jobs_run_and_are_journaled(data_dir):
+    queue = JobQueue(workers=2)
+    queue.start()
+    job = queue.submit("test-count", steps=3)
+    wait_for(job)
+    queue.stop()
+    assert (job.state, job.done, job.total, job.result) == (jobs.DONE, 3, 3, "counted to 3")
+
+    restored = JobQueue().jobs()
+    assert [(j.id, j.state, j.result) for j in restored] == [(job.id, jobs.DONE, "counted to 3")]
+
+
+def test_queued_and_interrupted_jobs_run_again_after_a_restart(data_dir):
+    queue = JobQueue()
+    queued = queue.submit("test-count", steps=2)
+    # An identical job that did not start yet is not queued twice
+    assert queue.submit("test-count", steps=2) is queued
+    running = queue.submit("test-count", steps=1000, wait=True)
+    queue.start()
+    wait_for(running, states=[jobs.RUNNING])
+    queue.stop()
+    wait_for(running, states=[jobs.QUEUED])
+
+    restarted = JobQueue()
+    restarted.start()
+    jobs_by_id = {job.id: job for job in restarted.jobs()}
+    restarted.cancel(running.id)
+    wait_for(jobs_by_id[queued.id])
+    wait_for(jobs_by_id[running.id])
+    restarted.stop()
+    assert jobs_by_id[queued.id].state == jobs.DONE
+    assert jobs_by_id[running.id].state == jobs.CANCELLED
+
+
+def test_cancel(data_dir):
+    queue = JobQueue(workers=1)
+    queue.start()
+    running = queue.submit("test-count", steps=1000, wait=True)
+    waiting = queue.submit("test-count", steps=5)
+    wait_for(running, states=[jobs.RUNNING])
+    assert queue.cancel(waiting.id)
+    assert waiting.state == jobs.CANCELLED
+    assert queue.cancel(running.id)
+    wait_for(running)
+    queue.stop()
+    assert running.state == jobs.CANCELLED and 0 < running.done < 1000
+    assert not queue.cancel(running.id)
+
+
+def test_thumbnail_job_renders_deferred_thumbnails(data_dir):
+    (spectrum,) = data_sources.save_new_spectra(
+        {"a": (np.linspace(1, 5, 50), np.random.rand(50))}, {"Cu"}, [], write_thumbnails=False
+    )
+    path = data_sources.thumbnail_file(spectrum.content_hash)
+    assert not path.exists()
+    queue = JobQueue()
+    queue.start()
+    job = queue.submit("thumbnails")
+    wait_for(job)
+    queue.stop()
+    assert job.state == jobs.DONE and path.exists()
+
+
+def wait_for_all(queues, job_id, states=jobs.FINISHED_STATES, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        for queue in queues:
+            queue.refresh()
+        if all(queue.get(job_id).state in states for queue in queues):
+            return
+        assert time.monotonic() < deadline, f"job is still {queues[0].get(job_id).state}"
+        time.sleep(0.01)
+
+
+def journaled_states(data_dir, job_id):
+    entries = [json.loads(line) for line in (data_dir / jobs.JOURNAL_FILE_NAME).read_text().splitlines()]
+    return [entry["state"] for entry in entries if entry["id"] == job_id]
+
+
+def test_worker_processes_share_the_journal(data_dir):
+    # Two queues on one journal act like two worker processes of the server
+    first, second = JobQueue(workers=1), JobQueue(workers=1)
+    job = first.submit("test-count", steps=3)
+    assert second.submit("test-count", steps=3).id == job.id
+    first.start()
+    second.start()
+    wait_for_all([first, second], job.id)
+    assert journaled_states(data_dir, job.id) == [jobs.QUEUED, jobs.RUNNING, jobs.DONE]
+
+    # Startup jobs are queued once for all workers, even when they have finished already
+    startup = first.submit_at_startup("test-count", steps=2)
+    wait_for_all([first, second], startup.id)
+    assert second.submit_at_startup("test-count", steps=2).id == startup.id
+
+    running = first.submit("test-count", steps=10**6, wait=True)
+    wait_for(running, states=[jobs.RUNNING])
+    crashed = jobs.Job("crashed", "test-count", "Count", {"steps": 1}, jobs.RUNNING, owner="gone")
+    with open(data_dir / jobs.JOURNAL_FILE_NAME, "a") as f:
+        f.write(json.dumps(asdict(crashed)) + "\n")
+    third = JobQueue(workers=1)
+    third.start()
+    # Still running in a live worker, while the job of the crashed worker runs again
+    assert third.get(running.id).state == jobs.RUNNING
+    assert third.get("crashed").message == "Restarted after a server restart"
+    wait_for_all([third], "crashed")
+    assert third.get("crashed").state == jobs.DONE
+
+    # Cancelled in another worker than the one running it
+    assert third.cancel(running.id)
+    wait_for(running)
+    for queue in (first, second, third):
+        queue.stop()
+    assert running.state == jobs.CANCELLED
+    assert journaled_states(data_dir, running.id)[-1] == jobs.CANCELLED
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import data_sources
+import library_watcher
+from library_watcher import LibraryWatcher
+
+
+def save(name):
+    return data_sources.save_new_spectrum(name, (np.arange(10.0), np.random.rand(10)), {"Cu"}, [])
+
+
+def test_refresh_reports_only_changed_entries(data_dir):
+    save("kept")
+    watcher = LibraryWatcher()
+    assert not watcher.refresh()
+
+    added = save("added")
+    delta = watcher.refresh()
+    assert [s.name for s in delta.added] == ["added"]
+    assert not delta.changed and not delta.removed
+
+    data_sources.edit_spectrum(added, tags=["new"])
+    delta = watcher.refresh()
+    assert [(s.name, s.tags) for s in delta.changed] == [("added", ["new"])]
+
+    data_sources.edit_spectrum(delta.changed[0], new_name="renamed")
+    delta = watcher.refresh()
+    assert [s.name for s in delta.added] == ["renamed"]
+    assert delta.removed == ["added"]
+
+
+def test_apply_delta_keeps_order():
+    a, b, c, d, new_b = (SimpleNamespace(name=name) for name in ["a", "b", "c", "d", "b"])
+    delta = library_watcher.LibraryDelta(added=[d], changed=[new_b], removed=["a"])
+    assert library_watcher.apply_delta([a, b, c], delta) == [new_b, c, d]
+
+
+@pytest.mark.parametrize("force_polling", [True, False])
+def test_watcher_pushes_one_debounced_delta_per_burst(data_dir, force_polling):
+    if not force_polling and library_watcher.watchfiles is None:
+        pytest.skip("watchfiles is not installed")
+
+    async def scenario():
+        watcher = LibraryWatcher(debounce=0.2, poll_interval=0.05, force_polling=force_polling)
+        deltas = []
+        watcher.subscribe(deltas.append)
+        watcher.start()
+        await asyncio.sleep(0.2)
+        for i in range(5):
+            save(f"bulk_{i}")
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if deltas:
+                break
+        await asyncio.sleep(0.3)
+        await watcher.stop()
+        return deltas
+
+    deltas = asyncio.run(scenario())
+    assert len(deltas) == 1
+    assert sorted(s.name for s in deltas[0].added) == [f"bulk_{i}" for i in range(5)]
@@ -0,0 +1,32 @@
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_latency_seconds", "Test latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    lines = histogram.render().splitlines()
+    assert lines[:2] == ["# HELP test_latency_seconds Test latency.", "# TYPE test_latency_seconds histogram"]
+    assert lines[2:] == [
+        'test_latency_seconds_bucket{le="0.1"} 2',
+        'test_latency_seconds_bucket{le="1"} 3',
+        'test_latency_seconds_bucket{le="+Inf"} 4',
+        "test_latency_seconds_sum 2.65",
+        "test_latency_seconds_count 4",
+    ]
+
+
+def test_counter_labels_and_timed_functions(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    counter = metrics.Counter("test_requests_total", "Test requests.", label_names=("result",))
+    counter.inc(result="hit")
+    counter.inc(2, result="miss")
+    assert counter.samples() == ['test_requests_total{result="hit"} 1', 'test_requests_total{result="miss"} 2']
+
+    histogram = metrics.Histogram("test_call_seconds", "Test calls.")
+    add = metrics.timed(histogram)(lambda a, b: a + b)
+    assert add(1, 2) == 3
+    with metrics.timer(histogram):
+        pass
+    assert histogram.count == 2
+    assert "test_requests_total" in metrics.render()
@@ -0,0 +1,76 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import data_sources
+import peaks
+import units
+
+X = np.linspace(1.0, 6.0, 4000)
+# center, area, FWHM, eta
+PEAKS = [(2.0, 1.5, 0.03, 0.3), (3.1, 2.0, 0.02, 0.5), (3.15, 1.0, 0.025, 0.2), (4.4, 0.5, 0.06, 0.9)]
+
+
+def pattern(shift=0.0, noise=0.0, seed=0):
+    y = 0.3 + 0.05 * (X - 3) + sum(a * peaks.pseudo_voigt(X, c + shift, w, e) for c, a, w, e in PEAKS)
+    return y + noise * np.random.default_rng(seed).standard_normal(len(X))
+
+
+def test_jacobian_matches_finite_differences():
+    x = X[None, ::10]
+    reference = np.array([3.0])
+    p = np.array([[0.3, 0.05] + [v for c, a, w, e in PEAKS for v in (a, c, w, e)]])
+    _, jacobian = peaks._model_and_jacobian(x, reference, p)
+    for k in range(p.shape[1]):
+        step = np.zeros_like(p)
+        step[0, k] = 1e-6 * max(1.0, abs(p[0, k]))
+        numeric = (
+            peaks._model_and_jacobian(x, reference, p + step)[0] - peaks._model_and_jacobian(x, reference, p - step)[0]
+        )
+        np.testing.assert_allclose(jacobian[0, :, k], numeric[0] / (2 * step[0, k]), atol=1e-5 * np.abs(jacobian).max())
+
+
+def test_fit_spectrum_recovers_overlapping_peaks():
+    fit = peaks.fit_spectrum(X, pattern(noise=0.01))
+    assert fit.converged and fit.r_squared > 0.999
+    np.testing.assert_allclose(fit.centers, [c for c, *_ in PEAKS], atol=1e-3)
+    np.testing.assert_allclose(fit.areas, [a for _, a, *_ in PEAKS], rtol=0.05)
+    np.testing.assert_allclose(fit.fwhm, [w for *_, w, _ in PEAKS], rtol=0.05)
+    np.testing.assert_allclose(fit.evaluate(X), pattern(), atol=0.02)
+
+
+def test_fit_batch_follows_peaks_across_spectra():
+    shifts = np.linspace(-0.01, 0.01, 5)
+    # Different grids and a spectrum that does not cover the window
+    spectra = [
+        (X[::step], pattern(shift, noise=0.005, seed=i)[::step])
+        for i, (shift, step) in enumerate(zip(shifts, [1, 2, 3, 1, 2]))
+    ]
+    spectra.append((np.linspace(5.0, 6.0, 100), np.ones(100)))
+    fits = peaks.fit_batch(spectra, [3.1, 3.15], window=(2.9, 3.35))
+    assert fits[-1] is None
+    for shift, fit in zip(shifts, fits):
+        np.testing.assert_allclose(fit.centers, [3.1 + shift, 3.15 + shift], atol=1e-3)
+        assert fit.crystallite_sizes()[0] == pytest.approx(2 * np.pi * 0.9 / 0.02, rel=0.05)
+
+
+def test_fit_spectra_reads_library_spectra_block_by_block(data_dir):
+    data_sources.save_new_spectrum("q", (X, pattern()), {"Cu"}, [])
+    two_theta = units.from_q(X, units.TWO_THETA, units.CU_K_ALPHA)
+    data_sources.save_new_spectrum(
+        "2theta", (two_theta, pattern() + 0.01), {"Cu"}, [], x_unit=units.TWO_THETA, wavelength=units.CU_K_ALPHA
+    )
+    data_sources.save_new_spectrum("gone", (X, pattern() + 0.02), {"Cu"}, [])
+    spectra = {s.name: s for s in data_sources.list_available_spectra()}
+    spectra = [spectra[name] for name in ["q", "gone", "2theta"]]
+    (data_dir / "gone.npz").unlink()
+
+    # Only the metadata of a spectrum is sent to a worker process
+    assert len(spectra[0].y) == len(X)
+    assert not hasattr(pickle.loads(pickle.dumps(spectra[0])), "_y")
+
+    fits = peaks.fit_spectra(spectra, [3.1, 3.15], window=(2.9, 3.35), block_size=2)
+    assert fits[1] is None
+    for fit in (fits[0], fits[2]):
+        np.testing.assert_allclose(fit.centers, [3.1, 3.15], atol=1e-3)
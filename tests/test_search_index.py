@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from search_index import CatalogIndex
+
+
+def spectrum(name, display_name=None, tags=()):
+    return SimpleNamespace(name=name, display_name=display_name, tags=list(tags))
+
+
+def test_search_matches_substrings_of_all_words_across_fields():
+    spectra = [
+        spectrum("CuO_300K", "Copper oxide", ["oxide", "reference"]),
+        spectrum("Fe2O3", None, ["oxide"]),
+        spectrum("sample_7", "Cu foil", ["metal"]),
+    ]
+    index = CatalogIndex(spectra)
+    names = lambda query: [s.name for s in index.search(query)[0]]  # noqa: E731
+    assert names("oxide") == ["CuO_300K", "Fe2O3"]
+    assert names("cu") == ["CuO_300K", "sample_7"]
+    assert names("cu ref") == ["CuO_300K"]
+    assert names("300") == ["CuO_300K"]
+    assert names("nothing") == []
+    assert names("") == ["CuO_300K", "Fe2O3", "sample_7"]
+
+
+def test_search_ranks_exact_and_prefix_matches_first_and_pages():
+    spectra = [spectrum(f"x_{i}_quartz") for i in range(120)] + [spectrum("quartz_ref"), spectrum("quartz")]
+    index = CatalogIndex(spectra)
+    page, total = index.search("quartz", limit=50)
+    assert total == 122
+    assert [s.name for s in page[:2]] == ["quartz", "quartz_ref"]
+    second_page, _ = index.search("quartz", offset=50, limit=50)
+    assert not {s.name for s in page} & {s.name for s in second_page}
+
+
+def test_sync_reindexes_only_changed_spectra_and_search_can_be_scoped():
+    spectra = [spectrum(f"sample_{i}", tags=["oxide"] if i % 2 else []) for i in range(200)]
+    index = CatalogIndex(spectra)
+    assert index.search("oxide", scope={"sample_1", "sample_2", "sample_3"})[1] == 2
+    assert [s.name for s in index.search("", scope={"sample_5", "missing"})[0]] == ["sample_5"]
+
+    updated = [s for s in spectra if s.name != "sample_1"] + [spectrum("quartz", tags=["oxide"])]
+    updated[0] = spectrum("sample_0", "Renamed", ["oxide"])
+    index.sync(updated)
+    assert index.by_name["sample_0"] is updated[0] and "sample_1" not in index.by_name
+    assert index.search("renamed")[0] == [updated[0]]
+    assert index.search("oxide")[1] == 101  # 99 odd samples, sample_0 and quartz
+    assert index.search("sample_1")[1] == 110 and "sample_1" not in {s.name for s in index.search("sample_1")[0]}
+
+    # Positions of removed spectra are reclaimed once most of the index is empty
+    index.sync(updated[:10])
+    assert len(index._entries) == 10 and index.search("sample")[1] == 10
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import data_sources
+import similarity
+
+Q = np.linspace(0.5, 6.0, 2000)
+
+
+def pattern(centers, seed=0):
+    noise = 0.01 * np.random.default_rng(seed).random(len(Q))
+    return 0.2 + sum(np.exp(-((Q - c) ** 2) / 2e-4) for c in centers) + noise
+
+
+def test_matrix_is_extended_row_by_row_and_compacted(data_dir, monkeypatch):
+    data_sources.save_new_spectra(
+        {"a": (Q, pattern([1.5, 3.0])), "b": (Q, pattern([1.5, 3.0], seed=1)), "c": (Q, pattern([2.2, 4.7]))},
+        {"Si"},
+        [],
+    )
+    assert similarity.update_matrix(processes=1) == 3
+    triangle = data_dir / similarity.SIMILARITY_DIR_NAME / "triangle.f32"
+    assert triangle.stat().st_size == 6 * 4
+
+    # A new spectrum adds one row; a copy of existing data shares its row
+    data_sources.save_new_spectrum("d", (Q, pattern([2.2, 4.7], seed=2)), {"Si"}, [])
+    data_sources.save_new_spectrum("a_copy", (Q, pattern([1.5, 3.0])), {"Si"}, [], allow_duplicates=True)
+    assert similarity.update_matrix(processes=1, block_size=1) == 1
+    assert triangle.stat().st_size == 10 * 4
+
+    spectra, matrix = similarity.load_matrix()
+    fingerprints = similarity.fingerprints(spectra)
+    np.testing.assert_allclose(matrix, fingerprints @ fingerprints.T, atol=1e-6)
+    names = [s.name for s in spectra]
+    assert matrix[names.index("a"), names.index("a_copy")] > 0.999
+    assert matrix[names.index("a"), names.index("b")] > 0.95 > matrix[names.index("a"), names.index("c")]
+
+    data_sources.delete_spectrum(next(s for s in spectra if s.name == "b"))
+    assert similarity.compact() == 1
+    spectra, matrix = similarity.load_matrix()
+    fingerprints = similarity.fingerprints(spectra)
+    np.testing.assert_allclose(matrix, fingerprints @ fingerprints.T, atol=1e-6)
+    order = [s.name for s in similarity.cluster_order()]
+    assert abs(order.index("c") - order.index("d")) == 1
+    assert similarity.stored_order() is not None
+
+    # The tree is built from the packed triangle, without the dense matrix
+    spectra, triangle = similarity.load_triangle()
+    assert len(triangle) == len(spectra) * (len(spectra) + 1) // 2
+    np.testing.assert_array_equal(similarity.linkage(triangle), similarity.linkage(matrix))
+    # The triangle is the working memory of the clustering
+    assert np.isinf(triangle[0])
+    monkeypatch.setattr(similarity, "MAX_CLUSTER_SPECTRA", 2)
+    with pytest.raises(ValueError):
+        similarity.load_triangle()
+
+
+def naive_average_linkage_heights(distance):
+    clusters = {i: [i] for i in range(len(distance))}
+    heights = []
+    while len(clusters) > 1:
+        keys = list(clusters)
+        pairs = [(distance[np.ix_(clusters[a], clusters[b])].mean(), a, b) for a in keys for b in keys if a < b]
+        height, a, b = min(pairs)
+        heights.append(height)
+        clusters[a] += clusters.pop(b)
+    return heights
+
+
+def test_linkage_matches_naive_average_linkage():
+    rng = np.random.default_rng(3)
+    points = rng.random((40, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    matrix = points @ points.T
+    links = similarity.linkage(matrix)
+    distance = 1.0 - matrix
+    np.testing.assert_allclose(links[:, 2], naive_average_linkage_heights(distance), atol=1e-5)
+    assert links[-1, 3] == 40
+    assert sorted(similarity.leaf_order(links)) == list(range(40))
+
+    # Two well separated groups are two flat clusters
+    groups = np.repeat(np.eye(2), 5, axis=0) + 0.01 * rng.random((10, 2))
+    groups /= np.linalg.norm(groups, axis=1, keepdims=True)
+    labels = similarity.flat_clusters(similarity.linkage(groups @ groups.T), 0.9)
+    assert len(set(labels[:5])) == len(set(labels[5:])) == 1 and labels[0] != labels[5]
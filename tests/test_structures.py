@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+import data_sources
+import structures
+import units
+
+COPPER = """
+data_copper
+_chemical_formula_sum 'Cu'
+_cell_length_a 3.6150(2)
+_cell_length_b 3.6150(2)
+_cell_length_c 3.6150(2)
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_symmetry_space_group_name_H-M 'F m -3 m'
+loop_
+_symmetry_equiv_pos_as_xyz
+'x, y, z'
+'x, 1/2+y, 1/2+z'
+'x+1/2, y, z+1/2'
+'x+1/2, y+1/2, z'
+'-x, -y, -z'
+loop_
+_atom_site_label
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_U_iso_or_equiv
+Cu1 0 0 0 0.0080
+"""
+
+# The same cell in P1, every atom listed
+COPPER_P1 = """
+data_cu_p1
+_cell_length_a 3.615
+_cell_length_b 3.615
+_cell_length_c 3.615
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+loop_
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_B_iso_or_equiv
+Cu 0.5 0.5 0 0.6317
+Cu 0 0 0 0.6317
+Cu 0.5 0 0.5 0.6317  # comment
+Cu 0 0.5 0.5 0.6317
+"""
+
+
+def test_structures_are_expanded_and_simulated():
+    rotation, translation = structures.parse_symmetry_operation("-x+1/2, y-x, 1/2+z")
+    np.testing.assert_array_equal(rotation, [[-1, 0, 0], [-1, 1, 0], [0, 0, 1]])
+    np.testing.assert_array_equal(translation, [0.5, 0, 0.5])
+
+    copper = structures.structure_from_cif(COPPER)
+    assert (copper.name, copper.formula, copper.elements) == ("copper", "Cu", {"Cu"})
+    assert len(copper.positions) == 4
+    assert copper.structure_hash() == structures.structure_from_cif(COPPER_P1).structure_hash()
+
+    sticks = structures.simulate_sticks(copper, 1.5406)
+    # Face centering: only reflections with all indices even or all odd
+    np.testing.assert_allclose(sticks.q[:3], 2 * np.pi / 3.615 * np.sqrt([3, 4, 8]))
+    assert list(sticks.multiplicity[:3]) == [8, 6, 12]
+    assert sticks.intensity.argmax() == 0
+    two_theta = 2 * np.degrees(np.arcsin(sticks.q * 1.5406 / (4 * np.pi)))
+    assert two_theta.max() <= structures.MAX_TWO_THETA
+
+    with pytest.raises(ValueError):
+        structures.structure_from_cif(COPPER.replace("_cell_length_b 3.6150(2)", ""))
+    with pytest.raises(ValueError):
+        structures.structure_from_cif(COPPER.replace("Cu1 0 0 0", "Xx1 0 0 0"))
+
+
+def test_cif_directories_are_imported_with_cached_patterns(data_dir, tmp_path, monkeypatch):
+    cifs = tmp_path / "cifs"
+    (cifs / "more").mkdir(parents=True)
+    (cifs / "copper.cif").write_text(COPPER)
+    (cifs / "more" / "copper_p1.CIF").write_text(COPPER_P1)
+    (cifs / "broken.cif").write_text("not a cif")
+
+    patterns, errors = structures.simulate_files(
+        sorted(cifs.rglob("*.[cC][iI][fF]")), 1.5406, processes=2, chunk_size=1
+    )
+    assert [p.source_file.name for p in patterns] == ["copper.cif", "copper_p1.CIF"]
+    assert list(errors) == [cifs / "broken.cif"]
+    assert len(list((data_dir / structures.PATTERN_DIR_NAME).glob("*.npz"))) == 1
+
+    def no_simulation(*args):
+        raise AssertionError("cached patterns must not be simulated again")
+
+    monkeypatch.setattr(structures, "simulate_sticks", no_simulation)
+    spectra, skipped = structures.import_directory(cifs, tags=["reference"], processes=1)
+    assert [s.name for s in spectra] == ["copper"]
+    assert set(skipped) == {cifs / "broken.cif", cifs / "more" / "copper_p1.CIF"}
+
+    (spectrum,) = data_sources.list_available_spectra()
+    assert spectrum.tags == [structures.SIMULATED_TAG, "reference"]
+    assert spectrum.contained_elements == {"Cu"} and spectrum.x_unit == units.Q
+    assert "copper.cif" in spectrum.description
+    peak = spectrum.x[spectrum.y.argmax()]
+    assert abs(peak - 2 * np.pi / 3.615 * np.sqrt(3)) < 0.002
@@ -0,0 +1,29 @@
+import numpy as np
+
+import data_sources
+import thumbnails
+
+
+def test_sparkline_keeps_narrow_peaks_and_fits_the_view_box():
+    x = np.linspace(1.0, 6.0, 100_000)
+    y = np.zeros_like(x)
+    y[54_321] = 10.0  # a single-point reflection
+    path = thumbnails.sparkline_path(x[::-1], y[::-1], width=100, height=40)
+    points = np.array([p.split(",") for p in path[1:].split("L")], dtype=float)
+    assert len(points) <= 200
+    assert points[:, 0].min() >= 0 and points[:, 0].max() <= 100
+    assert points[:, 1].min() == 1.0 and points[:, 1].max() == 39.0
+    assert thumbnails.sparkline_path(np.ones(3), np.ones(3)) == "M0,24H160"
+
+
+def test_thumbnails_are_written_on_save_and_backfilled(data_dir):
+    x = np.linspace(1.0, 5.0, 20)
+    spectrum = data_sources.save_new_spectrum("a", (x, np.random.rand(20)), {"Cu"}, [])
+    assert data_sources.thumbnail_file(spectrum.content_hash).read_text().startswith("<svg")
+
+    data_sources.thumbnail_file(spectrum.content_hash).unlink()
+    orphan = data_sources.thumbnail_file("0" * 32)
+    orphan.write_text("<svg/>")
+    assert data_sources.backfill_thumbnails() == (1, 1)
+    assert data_sources.thumbnail_file(spectrum.content_hash).exists() and not orphan.exists()
+    assert data_sources.backfill_thumbnails() == (0, 0)
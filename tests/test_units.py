@@ -0,0 +1,52 @@
+import struct
+
+import numpy as np
+import pytest
+
+import data_sources
+import units
+
+
+def test_conversions_round_trip_through_q():
+    two_theta = np.linspace(5.0, 120.0, 50)
+    q = units.to_q(two_theta, units.TWO_THETA, units.CU_K_ALPHA)
+    assert np.allclose(units.from_q(q, units.TWO_THETA, units.CU_K_ALPHA), two_theta)
+    # Bragg's law: λ = 2 d sin(θ)
+    d = units.convert(two_theta, units.TWO_THETA, units.CU_K_ALPHA, units.D_SPACING)
+    assert np.allclose(2 * d * np.sin(np.radians(two_theta) / 2), units.CU_K_ALPHA)
+    # The same Q at a shorter wavelength appears at smaller angles
+    mo = units.convert(two_theta, units.TWO_THETA, units.CU_K_ALPHA, units.TWO_THETA, 0.7093)
+    assert np.all(mo < two_theta)
+
+
+def test_unreachable_points_become_nan_and_2theta_needs_a_wavelength():
+    q = np.array([0.0, 1.0, 20.0])
+    assert np.isnan(units.from_q(q, units.D_SPACING)[0])
+    assert np.isnan(units.from_q(q, units.TWO_THETA, units.CU_K_ALPHA)[2])
+    with pytest.raises(ValueError):
+        units.to_q(q, units.TWO_THETA)
+
+
+def test_spectra_record_their_axis_and_cache_conversions(data_dir):
+    x = np.linspace(10.0, 80.0, 20)
+    spectrum = data_sources.save_new_spectrum(
+        "quartz", (x, np.random.rand(20)), {"Si"}, [], x_unit=units.TWO_THETA, wavelength=units.CU_K_ALPHA
+    )
+    loaded = data_sources.load_spectrum(data_dir / "quartz.meta")
+    assert (loaded.x_unit, loaded.wavelength) == (units.TWO_THETA, units.CU_K_ALPHA)
+
+    q = spectrum.x_in(units.Q, 0.7093)
+    assert q is spectrum.x_in(units.Q, 1.0)  # Q does not depend on the view wavelength
+    assert np.allclose(spectrum.x_in(units.TWO_THETA, units.CU_K_ALPHA), x)
+    assert spectrum.x_in(units.TWO_THETA, 0.7093) is spectrum.x_in(units.TWO_THETA, 0.7093)
+
+    with pytest.raises(ValueError):
+        data_sources.save_new_spectrum("no_wavelength", (x, np.random.rand(20)), {"Si"}, [], x_unit=units.TWO_THETA)
+
+
+def test_raw_files_report_q_and_their_wavelength(tmp_path):
+    header = bytearray(0x14A)
+    struct.pack_into("<f", header, 0x142, 0.7093)
+    (tmp_path / "sample.raw").write_bytes(bytes(header))
+    assert data_sources.spectrum_file_axis(tmp_path / "sample.raw") == (units.Q, 0.7093)
+    assert data_sources.spectrum_file_axis(tmp_path / "sample.xyd") == (None, None)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import data_sources
+import units
+import views
+
+
+VIEW = {
+    "v": views.VERSION,
+    "x_unit": units.TWO_THETA,
+    "wavelength": 1.5406,
+    "lines": [
+        views.compact_line({"role": "selected", "spectrum": "CuO_300K", **views.LINE_DEFAULTS, "inverse": False}),
+        views.compact_line({"role": "pinned", "spectrum": "CuO_500K", **views.LINE_DEFAULTS, "q_shift": 0.012}),
+        {"inputs": [0, 1], "operation": "scaled_sum", "scales": [1.0, -0.5]},
+    ],
+}
+
+
+def test_views_round_trip_through_compact_url_tokens():
+    assert VIEW["lines"][:2] == [
+        {"role": "selected", "spectrum": "CuO_300K", "inverse": False},
+        {"spectrum": "CuO_500K", "q_shift": 0.012},
+    ]
+    token = views.encode(VIEW)
+    assert token.replace("-", "").replace("_", "").isalnum() and len(token) < 250
+    assert views.decode(token) == VIEW
+    assert views.expand_line(VIEW["lines"][1])["color"] == views.LINE_DEFAULTS["color"]
+    assert views.referenced_spectra(VIEW) == ["CuO_300K", "CuO_500K"]
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"lines": [{"inputs": [0]}]},
+        {"lines": [{"spectrum": "a"}, {"inputs": [0], "operation": "scaled_sum", "scales": [1, 2]}]},
+        {"lines": [{"spectrum": "a"}, {"inputs": [0], "operation": "scaled_sum", "scales": ["2"]}]},
+        {"lines": [{"role": "selected", "spectrum": "a"}, {"role": "selected", "spectrum": "b"}]},
+        {"lines": [{"spectrum": "a"}] * (views.MAX_LINES + 1)},
+        {"lines": [{"spectrum": "a", "q_shift": "x"}]},
+        {"lines": [{"spectrum": "a", "q_scale": float("inf")}]},
+        {"lines": [{"spectrum": "a", "width": "wide"}]},
+        {"lines": [{"spectrum": "a", "opacity": 2}]},
+        {"lines": [{"spectrum": "a", "color": 255}]},
+        {"lines": [{"spectrum": "a", "dash": None}]},
+        {"lines": [{"spectrum": "a", "inverse": 1}]},
+        {"lines": [], "wavelength": "abc"},
+        {"lines": [], "wavelength": -1.5},
+    ],
+)
+def test_malformed_views_are_rejected(fields):
+    with pytest.raises(ValueError):
+        views.decode(views.encode({"v": views.VERSION, **fields}))
+    with pytest.raises(ValueError):
+        views.decode("not a token")
+
+
+def test_saved_views_and_preload(data_dir):
+    views.save_view("b", VIEW)
+    views.save_view("A", {"v": views.VERSION, "lines": []})
+    assert list(views.saved_views()) == ["A", "b"]
+    assert views.decode(views.saved_views()["b"]) == VIEW
+    views.delete_view("A")
+    assert list(views.saved_views()) == ["b"]
+
+    class Unreadable:
+        name = "gone"
+
+        @property
+        def x(self):
+            raise FileNotFoundError("gone.npz")
+
+    spectrum = data_sources.save_new_spectrum("a", (np.arange(10.0), np.random.rand(10)), {"Cu"}, [])
+    assert views.preload([spectrum, Unreadable()]) == {"gone": "gone.npz"}